@@ -0,0 +1,65 @@
+# Checkpoint
+#
+# A checkpoint saves all of the dynamic state of a neuron factory into a
+#     single binary file, so that a simulation can be resumed later, or
+#     several experiments can be branched from one warmed up state.
+#     Restoring a checkpoint rebuilds the factory as it was, without
+#     constructing the network or stepping it again.
+#
+# The file starts with a magic string and a format version, followed by the
+#     pickled factory and the states of the random number generators.
+#     Everything in this variant lives in numpy arrays and plain objects,
+#     which pickle by value.  The exception is the constant driver, which
+#     keeps the bound method for its current phase (waiting for its delay,
+#     or driving).  Bound methods are saved by name as persistent ids, and
+#     looked up on the restored driver.
+#
+# Components holding open files reduce themselves to something that can be
+#     reopened: frame drivers keep the path of their frames, and stream
+#     recorders keep the path of their data file.
+
+import cPickle, random
+import numpy.random
+from types import MethodType
+
+MAGIC = "NEUROTRANSMISSION CHECKPOINT"
+VERSION = 1
+
+def persistent_id(obj):
+    """
+    Saves bound methods as their instance and name.
+    """
+    if isinstance(obj, MethodType) and obj.im_self is not None:
+        return (obj.im_self, obj.im_func.__name__)
+
+def persistent_load(pid):
+    instance, name = pid
+    return getattr(instance, name)
+
+def checkpoint(factory, path):
+    """
+    Saves the state of the neuron |factory| to the file at |path|.
+    """
+    with open(path, "wb") as f:
+        f.write("%s %d\n" % (MAGIC, VERSION))
+        pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump((factory, random.getstate(), numpy.random.get_state()))
+
+def restore(path):
+    """
+    Restores a neuron factory from the checkpoint file at |path|.
+    The random number generators are restored as well.
+    """
+    with open(path, "rb") as f:
+        header = f.readline().split()
+        if " ".join(header[:-1]) != MAGIC:
+            raise ValueError("%s is not a checkpoint" % path)
+        if int(header[-1]) != VERSION:
+            raise ValueError("Unsupported checkpoint version %s" % header[-1])
+        unpickler = cPickle.Unpickler(f)
+        unpickler.persistent_load = persistent_load
+        factory, random_state, numpy_state = unpickler.load()
+    random.setstate(random_state)
+    numpy.random.set_state(numpy_state)
+    return factory
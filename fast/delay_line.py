@@ -0,0 +1,101 @@
+# Delay Line
+#
+# The delay line holds a history of presynaptic voltages, so that synapses
+#     with a delay can read the voltage from |delay| releases ago with a
+#     single array lookup, rather than each keeping its own queue.
+#
+# A neuron releases its output synapses on each timestep on which it is
+#     stepped, and pushes its voltage into the delay line first.  The history
+#     of each source (presynaptic soma) is a ring buffer, indexed by the
+#     number of pushes of that source modulo the depth of the buffer, which
+#     is one more than the longest registered delay.  While a neuron is
+#     stable, nothing is pushed, so its history is frozen and its synapses
+#     hold their last release, like the queues of individual synapses did.
+#     Memory grows with the number of source neurons, not the number of
+#     synapses.
+# In an ensemble, variants are stepped independently, so each of them has its
+#     own history and count of pushes.
+
+from numpy import empty, zeros, arange, asarray, where
+
+class DelayLine:
+    def __init__(self, baseline=-70.0, ensemble=1):
+        """
+        Creates an empty delay line for an |ensemble| of variants.
+        Voltages that have not been pushed yet are the |baseline| voltage.
+        """
+        self.baseline = baseline
+        self.ensemble = ensemble
+        self.sources = []
+        self.columns = dict()
+        self.depth = 1
+        self.buffer = empty((ensemble, 1, 0))
+        self.heads = zeros((ensemble, 0), dtype=int)
+
+    def register(self, source_id, delay=0):
+        """
+        Registers a reader of |source_id| with the given |delay|.
+        Returns the column of the source in the buffer.
+        """
+        if delay < 0: raise ValueError
+        self.depth = max(self.depth, delay+1)
+        try: return self.columns[source_id]
+        except KeyError:
+            column = len(self.sources)
+            self.columns[source_id] = column
+            self.sources.append(source_id)
+            return column
+
+    def resize(self):
+        """
+        Reallocates the buffer to fit newly registered sources and delays,
+            keeping as much history as both buffers hold.
+        """
+        old, old_heads = (self.buffer, self.heads)
+        _, old_depth, old_width = old.shape
+        self.buffer = empty((self.ensemble, self.depth, len(self.sources)))
+        self.buffer.fill(self.baseline)
+        self.heads = zeros((self.ensemble, len(self.sources)), dtype=int)
+        self.heads[:, :old_width] = old_heads
+
+        variants = arange(self.ensemble)[:, None]
+        columns = arange(old_width)
+        for age in xrange(min(old_depth, self.depth)):
+            pushes = old_heads - age
+            self.buffer[variants, pushes % self.depth, columns] = \
+                old[variants, pushes % old_depth, columns]
+
+    def variants(self, columns):
+        """
+        Returns the variant indices to index the buffer at |columns| with.
+        Allocates the buffer if sources or delays were registered.
+        """
+        if self.buffer.shape[1:] != (self.depth, len(self.sources)):
+            self.resize()
+        return arange(self.ensemble).reshape(
+            (self.ensemble,) + (1,) * asarray(columns).ndim)
+
+    def push(self, columns, values, mask=None):
+        """
+        Pushes the |values| of the sources in |columns|, which have a row for
+            each variant.  Only the variants in the boolean |mask| are pushed,
+            or all of them if it is None.
+        """
+        variants = self.variants(columns)
+        heads = self.heads[:, columns]
+        heads += 1 if mask is None else mask
+        self.heads[:, columns] = heads
+        rows = heads % self.depth
+        if mask is not None:
+            values = where(mask, values, self.buffer[variants, rows, columns])
+        self.buffer[variants, rows, columns] = values
+
+    def get(self, columns, delays):
+        """
+        Returns the values of the sources in |columns| from |delays| pushes
+            ago, one for each variant.  Both may be arrays, and the values
+            then have a row for each variant.
+        """
+        variants = self.variants(columns)
+        return self.buffer[variants,
+            (self.heads[:, columns] - delays) % self.depth, columns]
@@ -4,10 +4,40 @@
 #     environment.  Entities should register with an env_id.
 #
 # An array is kept for previous and next values to avoid race conditions.
-#     When a timestep is run, the buffers shift.
+#     When a timestep is run, the buffers are swapped.
 # Values are retrieved from the pervious array and set to the next array.
+#
+# The env_ids written during a timestep are kept in a dirty set (batched
+#     writes keep their arrays of env_ids, which may overlap).  After the
+#     buffers are swapped, only those slots are copied back into the next
+#     array, so a step costs time in the number of changed values rather than
+#     the number of registered values.  The env_ids copied by the last step
+#     are kept in |changed|, so that readers of those values can be woken.
+#     When nothing is dirty, many timesteps can be skipped at once, which
+#     records the unchanged values for each of them in bulk.
+#
+# The environment also holds the delay line, which keeps a history of the
+#     voltages released by presynaptic somas (see delay_line.py).
+#
+# Recorded values are passed to a recorder (see recorder.py), which keeps
+#     them in memory by default, or streams them to disk.  Spikes of spiking
+#     env_ids are kept as events by a spike recorder.
+#
+# An environment can hold an ensemble of variants of the same network, which
+#     differ only in their parameters (eg synapse strengths or driver
+#     currents).  The buffers then have a row for each variant and a column
+#     for each env_id, and batched reads and writes move every variant at
+#     once.  A value is dirty if it changed in any variant.  Parameters are
+#     either shared by all variants, or sequences with a value for each
+#     variant, and batch() gathers them into arrays of the same layout.
+#     Columns of batched arrays are read and written with gather() and
+#     scatter(), which index a single variant as a flat array, since
+#     indexing columns of a 2D array is several times slower.
 
 from random import betavariate
+from numpy import empty, array, arange, concatenate
+from delay_line import DelayLine
+from recorder import MemoryRecorder, SpikeRecorder
 
 def betav(maximum, noise=0.5, rate=1.0):
     if rate < 0.0 or noise < 0.0: raise ValueError
@@ -16,42 +46,197 @@ def betav(maximum, noise=0.5, rate=1.0):
     b = ratio * a
     return maximum*(betavariate(a,b))
 
+def gather(values, columns):
+    """
+    Returns the given |columns| of a batched array of |values|.
+    """
+    return values.take(columns, axis=1)
+
+def scatter(values, columns, new_values):
+    """
+    Sets the given |columns| of a batched array of |values|.
+    """
+    if len(values) == 1: values[0][columns] = new_values
+    else: values[:, columns] = new_values
+
+def bind_parts(parts, state, names, shared=False):
+    """
+    Binds the state called |names| of the grids of neurons among |parts| (see
+        Environment.batch_parts) to views of the arrays of the same names in
+        |state|, which have a column for each component of the parts.
+    Flat arrays are bound instead if the state is |shared| by the variants.
+    """
+    start = 0
+    for part in parts:
+        if isinstance(part, list):
+            start += len(part)
+            continue
+        end = start + part.size
+        for name in names:
+            if shared: part.bind_flat(name, getattr(state, name)[start:end])
+            else: part.bind(name, getattr(state, name)[:, start:end])
+        start = end
+
 class Environment:
-    def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+    def __init__(self, noise=0.0, recorder=None, ensemble=1):
+        self.noise = noise
+        self.ensemble = ensemble
+
+        self.size = 0
+        self.prev_values = empty((ensemble, 0))
+        self.next_values = empty((ensemble, 0))
+        self.dirty = set()
+        self.dirty_batches = []
+        self.changed = empty(0, dtype=int)
+        self.recorder = MemoryRecorder() if recorder is None else recorder
+        self.spikes = SpikeRecorder()
+        self.delay_line = DelayLine(ensemble=ensemble)
+
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
+
+    def batch(self, values, dtype=float):
+        """
+        Returns an array with a row for each variant and a column for each of
+            the |values|, which are either shared by all variants, or
+            sequences with a value for each variant.
+        """
+        batched = empty((self.ensemble, len(values)), dtype=dtype)
+        try: columns = array(values, dtype=dtype)
+        except ValueError: columns = None
+        if columns is None:
+            for i,value in enumerate(values): batched[:, i] = value
+        elif columns.ndim == 1: batched[:] = columns
+        else: batched[:] = columns.T
+        return batched
+
+    def batch_parts(self, parts, name, dtype=float, shared=False):
+        """
+        Returns a batched array of the attribute called |name| of |parts|,
+            which are lists of components (eg somas), or grids of neurons
+            that hold it in arrays (see population.py), in order.
+        A flat array is returned instead if the attribute is |shared| by the
+            variants.
+        """
+        blocks = []
+        for part in parts:
+            if not isinstance(part, list):
+                if shared: blocks.append(part.flat(name))
+                else: blocks.append(part.batched(name))
+            elif shared:
+                blocks.append(array([getattr(c, name) for c in part], dtype=dtype))
+            else: blocks.append(self.batch([getattr(c, name) for c in part], dtype))
+        if shared: batched = empty(0, dtype=dtype)
+        else: batched = empty((self.ensemble, 0), dtype=dtype)
+        return concatenate([batched] + blocks, axis=-1).astype(dtype)
+
+    def unbatch(self, column):
+        """
+        Returns a |column| of a batched array as a single value, or as an
+            array with a value for each variant of an ensemble.
+        """
+        if self.ensemble == 1: return column.item(0)
+        return column.copy()
 
-        self.prev_values = []
-        self.next_values = []
-        self.dirty = True
-        self.records = dict()
-        self.spikes = dict()
+    def get_record(self, env_id, spikes=False, variant=None):
+        """
+        Returns the record of |env_id|, or its spike count if |spikes|.
+        In an ensemble, the record of the given |variant| is returned, or a
+            list of the records of every variant if |variant| is None.
+        """
+        if variant is None:
+            if self.ensemble > 1:
+                return [self.get_record(env_id, spikes, i)
+                    for i in xrange(self.ensemble)]
+            variant = 0
+        if spikes: return self.spikes.spike_count(env_id, variant)
+        else: return self.recorder.get(env_id, variant)
 
-    def get_record(self, env_id, spikes=False):
-        if spikes: return self.spikes[env_id]
-        else: return self.records[env_id]
+    def resize(self, capacity):
+        """
+        Reallocates the buffers to hold |capacity| values.
+        """
+        for name in ("prev_values", "next_values"):
+            old = getattr(self, name)
+            new = empty((self.ensemble, capacity))
+            new[:, :self.size] = old[:, :self.size]
+            setattr(self, name, new)
 
     def register(self, initial=0.0, record=False, spiking=False):
-        env_id = len(self.prev_values)
-        self.prev_values.append(initial)
-        self.next_values.append(initial)
+        env_id = self.size
+        if env_id == self.prev_values.shape[1]:
+            self.resize(max(16, 2 * env_id))
+        self.size += 1
+        self.prev_values[:, env_id] = initial
+        self.next_values[:, env_id] = initial
+        self.dirty.add(env_id)
         if record:
-            self.records[env_id] = []
+            self.recorder.register(env_id)
             if spiking:
-                self.spikes[env_id] = 0
+                self.spikes.register(env_id)
         return env_id
 
+    def register_many(self, count, initial=0.0, record=False, spiking=False):
+        """
+        Registers |count| consecutive env_ids at once, eg for a grid of
+            neurons.  The |initial| values are a single value, or a batched
+            array with a column for each env_id.
+        Returns an array of the env_ids.
+        """
+        env_ids = arange(self.size, self.size + count)
+        if self.size + count > self.prev_values.shape[1]:
+            self.resize(max(16, 2 * self.size, self.size + count))
+        self.size += count
+        self.prev_values[:, env_ids] = initial
+        self.next_values[:, env_ids] = initial
+        self.dirty_batches.append(env_ids)
+        if record:
+            self.recorder.register_many(env_ids)
+            if spiking:
+                self.spikes.register_many(env_ids)
+        return env_ids
+
     def get(self, env_id):
-        return self.prev_values[env_id]
+        if self.ensemble == 1: return self.prev_values.item(0, env_id)
+        return self.prev_values[:, env_id].copy()
+
+    def get_many(self, env_ids):
+        return gather(self.prev_values, env_ids)
 
     def set(self, env_id, new_voltage):
-        self.dirty = True
-        self.next_values[env_id] = new_voltage
+        self.dirty.add(env_id)
+        self.next_values[:, env_id] = new_voltage
+
+    def set_many(self, env_ids, new_values):
+        # Only values that change are marked dirty, so that components
+        #     which set every timestep do not force a copy of every slot.
+        env_ids = array(env_ids, dtype=int)
+        new_values = array(new_values, dtype=float)
+        changed = (gather(self.next_values, env_ids) != new_values).any(axis=0)
+        self.dirty_batches.append(env_ids[changed])
+        scatter(self.next_values, env_ids, new_values)
 
     def adjust(self, env_id, delta):
-        self.dirty = True
-        self.next_values[env_id] += delta
+        self.dirty.add(env_id)
+        self.next_values[:, env_id] += delta
+
+    def is_dirty(self):
+        """
+        Returns whether any value was written since the last step.
+        """
+        return len(self.dirty) > 0 or \
+            any(len(env_ids) > 0 for env_ids in self.dirty_batches)
+
+    def skip(self, count):
+        """
+        Cycles the environment |count| times while no values change.
+        """
+        if self.is_dirty():
+            raise RuntimeError("Cannot skip a dirty environment")
+        self.recorder.record(self.prev_values, count)
+        self.spikes.record(self.prev_values, count)
+        self.dirty_batches = []
+        self.changed = empty(0, dtype=int)
 
     def step(self):
         """
@@ -59,15 +244,19 @@ class Environment:
         Returns whether the environment is stable (not dirty, no changes)
         """
         # Record any env_ids that have been set to record.
-        for env_id in self.records:
-            self.records[env_id].append(self.prev_values[env_id])
-        for env_id in self.spikes:
-            if self.prev_values[env_id] >= 30.0:
-                self.spikes[env_id] += 1
-
-        if self.dirty:
-            self.dirty = False
-            for i in xrange(len(self.prev_values)):
-                self.prev_values[i]=self.next_values[i]
-            return False
-        else: return True
+        self.recorder.record(self.prev_values)
+        self.spikes.record(self.prev_values)
+
+        dirty = concatenate(self.dirty_batches + [list(self.dirty)]).astype(int)
+        if len(dirty) > 0:
+            # Swap the buffers, and copy the dirty slots back into the next
+            #     buffer, which still holds their old values.
+            self.prev_values, self.next_values = \
+                self.next_values, self.prev_values
+            scatter(self.next_values, dirty, gather(self.prev_values, dirty))
+            self.dirty.clear()
+            self.dirty_batches = []
+            stable = False
+        else: stable = True
+        self.changed = dirty
+        return stable
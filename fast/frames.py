@@ -0,0 +1,185 @@
+# Frames
+#
+# Video input for grids of photoreceptors.  A frame source is any iterator of
+#     frames (2D arrays), such as the frames of a directory of images, or of
+#     a video saved as a .npy array with a frame in each row, which is
+#     memory-mapped so that frames are only read from disk when they are
+#     shown.  Color frames are reduced to their first channel, like the
+#     images of test_grid.py.
+#
+# A frame driver shows frames on a grid of neurons, one every |interval|
+#     timesteps, by setting their external currents to the frame scaled by
+#     a |gain|.  It is registered with the neuron factory like a driver
+#     schedule (see tools.py), and only writes and wakes the neurons whose
+#     pixel changed since the previous frame.  After the last frame, the
+#     currents are left as they are.
+#
+# Reading a frame from disk and decoding it can take longer than several
+#     timesteps, so a prefetcher reads frames in a background thread, and
+#     keeps a few of them queued while the network is stepped.  Errors in
+#     the thread are raised when the frame that failed is taken.
+#
+# Threads and open files cannot be saved in a checkpoint (see checkpoint.py),
+#     so a frame driver given the path of its frames saves the path and the
+#     number of frames shown instead, and reopens the frames after that
+#     many on restore.  A frame driver given an iterator of frames cannot be
+#     checkpointed.
+
+from itertools import islice
+from os import listdir
+from os.path import isdir, join, splitext
+from threading import Thread
+from Queue import Queue
+from traceback import format_exc
+from numpy import asarray, load, arange, flatnonzero, empty
+from environment import scatter
+from population import NeuronGrid
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+def luminance(frame):
+    """
+    Returns a |frame| as a 2D array of floats, keeping the first channel of
+        color frames.
+    """
+    frame = asarray(frame, dtype=float)
+    if frame.ndim == 3: frame = frame[:, :, 0]
+    return frame
+
+def directory_frames(path, start=0):
+    """
+    Yields the images in the directory at |path|, in order of their names,
+        from the one at index |start|.
+    """
+    import matplotlib.image as mpimg
+    names = [name for name in sorted(listdir(path))
+        if splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    for name in names[start:]:
+        yield mpimg.imread(join(path, name))
+
+def array_frames(path, start=0):
+    """
+    Yields the frames of the video saved as a .npy array at |path|, from the
+        one at index |start|.
+    """
+    for frame in islice(load(path, mmap_mode="r"), start, None):
+        yield frame
+
+def open_frames(path, start=0):
+    """
+    Returns an iterator of the frames at |path|, which is a directory of
+        images or a .npy video, from the one at index |start|.
+    """
+    if isdir(path): return directory_frames(path, start)
+    return array_frames(path, start)
+
+class Prefetcher:
+    def __init__(self, frames, depth=2):
+        """
+        Reads |frames| in a background thread, keeping up to |depth| frames
+            ready to be taken.
+        """
+        self.queue = Queue(depth)
+        self.done = False
+        self.thread = Thread(target=self.fetch, args=(iter(frames),))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fetch(self, frames):
+        # Frames are converted in the thread, which reads memory-mapped frames
+        #     from disk.  The end of the frames is marked with None.
+        try:
+            for frame in frames:
+                self.queue.put((luminance(frame), None))
+            self.queue.put((None, None))
+        except Exception: self.queue.put((None, format_exc()))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.done: raise StopIteration
+        frame, error = self.queue.get()
+        if error is not None:
+            self.done = True
+            raise RuntimeError("Cannot read frame:\n%s" % error)
+        if frame is None:
+            self.done = True
+            raise StopIteration
+        return frame
+
+class FrameDriver:
+    def __init__(self, neurons, frames, interval=1, gain=1.0, onset=0,
+            prefetch=2):
+        """
+        Shows |frames| on the |neurons|, which are a grid (list of rows), a
+            NeuronGrid (see population.py), or a list in the order of the
+            pixels, one frame every |interval| timesteps from |onset|.  The
+            external current of each neuron is set to its pixel times |gain|.
+        |frames| is the path of the frames (see open_frames), or an iterator
+            of frames, in which case the driver cannot be checkpointed.
+        Up to |prefetch| frames are read ahead in a background thread, or
+            none if it is 0.
+        """
+        if isinstance(neurons, NeuronGrid):
+            self.neuron_ids = neurons.neuron_ids.ravel()
+        else:
+            if len(neurons) > 0 and isinstance(neurons[0], list):
+                neurons = [neuron for row in neurons for neuron in row]
+            self.neuron_ids = asarray([neuron.neuron_id for neuron in neurons],
+                dtype=int)
+        if isinstance(frames, basestring):
+            self.path = frames
+            frames = open_frames(frames)
+        else: self.path = None
+        self.prefetch = prefetch
+        self.frames = self.read(frames)
+        self.interval = interval
+        self.gain = gain
+        self.onset = onset
+        self.current = None
+        self.shown = 0
+
+    def read(self, frames):
+        """
+        Returns an iterator of the luminance of |frames|, prefetched if
+            |prefetch| is positive.
+        """
+        if self.prefetch > 0: return Prefetcher(frames, self.prefetch)
+        return (luminance(frame) for frame in frames)
+
+    def __getstate__(self):
+        # The frames are reopened from the path on restore.
+        if self.path is None:
+            raise ValueError("Cannot checkpoint a frame driver reading an "
+                "iterator of frames; give it the path of the frames instead")
+        state = self.__dict__.copy()
+        del state["frames"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = self.read(open_frames(self.path, self.shown))
+
+    def drive(self, external_current, time):
+        """
+        Shows the next frame at |time| by setting the |external_current| of
+            the neurons, which is a batched array indexed by neuron id.
+        Returns the time of the next frame (None after the last frame), and
+            the ids of the neurons whose current changed.
+        """
+        unchanged = empty(0, dtype=int)
+        if time < self.onset: return self.onset, unchanged
+        try: frame = next(self.frames)
+        except StopIteration: return None, unchanged
+        if frame.size != len(self.neuron_ids):
+            raise ValueError("Frame of shape %s does not fit %d neurons"
+                % (frame.shape, len(self.neuron_ids)))
+
+        current = self.gain * frame.reshape(-1)
+        if self.current is None: changed = arange(len(current))
+        else: changed = flatnonzero(current != self.current)
+        scatter(external_current, self.neuron_ids[changed], current[changed])
+        self.current = current
+        self.shown += 1
+        return time + self.interval, self.neuron_ids[changed]
@@ -0,0 +1,58 @@
+# Gap Junction Matrix
+#
+# The gap junction matrix computes the gap current of many neurons at once.
+# Rows and columns are neurons, and values are the conductances of the
+#     junctions between them.  Every junction is stored in both directions,
+#     so the matrix is symmetric.
+#
+# The gap current of neuron i is the product of row i of the graph Laplacian
+#     with the voltage vector: the sum of g_ij * (v_j - v_i) over partners.
+#     It is evaluated in that form, one term per junction, rather than as
+#     (G v)_i - (sum_j g_ij) v_i, to avoid cancellation between large terms.
+#     Entries of each row keep the order in which junctions were created.
+# In an ensemble, conductances are kept with a row for each variant.
+
+from numpy import array, ones, repeat, zeros, concatenate, cumsum, bincount
+from scipy.sparse import csr_matrix
+from synapse_matrix import row_entries, segment_sums
+
+class GapJunctionMatrix:
+    def __init__(self, neurons, environment, env_ids=None):
+        """
+        Builds the matrix from the gap junctions of |neurons|, which must
+            be ordered by neuron_id.
+        Voltages are read from the |environment|, at the |env_ids| of the
+            somas of every neuron of the network, by default those of the
+            |neurons|, so that neurons without gap junctions can be left out.
+        """
+        self.environment = environment
+        if env_ids is None:
+            env_ids = [neuron.soma.env_id for neuron in neurons]
+        self.env_ids = array(env_ids, dtype=int)
+        size = len(self.env_ids)
+
+        rows, indices, data = ([], [], [])
+        for neuron in neurons:
+            for other,conductance in neuron.gap_junctions:
+                rows.append(neuron.neuron_id)
+                indices.append(other.neuron_id)
+                data.append(conductance)
+        indptr = concatenate(([0],
+            cumsum(bincount(array(rows, dtype=int), minlength=size))))
+        self.matrix = csr_matrix(
+            (ones(len(indices)), array(indices, dtype=int), indptr),
+            shape=(size, size))
+        self.conductances = environment.batch(data)
+
+    def gap_current(self, rows, voltage):
+        """
+        Computes the gap current of the neurons in |rows|, given an array of
+            the |voltage| of each variant of each of them.
+        """
+        positions, counts = row_entries(self.matrix, rows)
+        if len(positions) == 0: return zeros(voltage.shape)
+        partner_voltage = self.environment.get_many(
+            self.env_ids[self.matrix.indices[positions]])
+        difference = partner_voltage - repeat(voltage, counts, axis=1)
+        return segment_sums(counts,
+            self.conductances.take(positions, axis=1) * difference)
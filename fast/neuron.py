@@ -13,27 +13,33 @@ NeuronTypes = enum(
     GANGLION = 4
 )
 
+# The default soma type of each neuron type, whether it spikes, and the base
+#     current it always has (None to keep the given base current).
+NEURON_SOMAS = {
+    NeuronTypes.PHOTORECEPTOR : (SOMA_TYPES.PHOTORECEPTOR, False, None),
+    NeuronTypes.HORIZONTAL    : (SOMA_TYPES.HORIZONTAL,    False, -10),
+    NeuronTypes.GANGLION      : (SOMA_TYPES.DEFAULT,       True,  None),
+}
+
 class Neuron:
     def __init__(self, neuron_id=None, base_current=0.0, record=False,
-                    neuron_type=NeuronTypes.GANGLION, environment=None):
+                    neuron_type=NeuronTypes.GANGLION, environment=None,
+                    soma_type=None):
+        """
+        Creates a neuron of the given |neuron_type|.
+        The |soma_type| of the neuron type can be overridden, eg with a list
+            of soma types for the variants of an ensemble.
+        """
         self.environment = environment
         self.neuron_id = neuron_id
         self.synapses = []
 
         # Soma
-        if neuron_type == NeuronTypes.PHOTORECEPTOR:
-            self.soma = Soma(environment=environment,
-                soma_type=SOMA_TYPES.PHOTORECEPTOR, record=record, spiking=False)
-            self.spiking = False
-        elif neuron_type == NeuronTypes.HORIZONTAL:
-            base_current = -10
-            self.soma = Soma(environment=environment,
-                soma_type=SOMA_TYPES.HORIZONTAL, record=record, spiking=False)
-            self.spiking = False
-        elif neuron_type == NeuronTypes.GANGLION:
-            self.soma = Soma(environment=environment,
-                soma_type=SOMA_TYPES.DEFAULT, record=record, spiking=True)
-            self.spiking = True
+        default_type, self.spiking, fixed_current = NEURON_SOMAS[neuron_type]
+        if fixed_current is not None: base_current = fixed_current
+        self.soma = Soma(environment=environment,
+            soma_type=soma_type or default_type,
+            record=record, spiking=self.spiking)
 
         # Synapses
         self.in_synapses = []
@@ -49,14 +55,21 @@ class Neuron:
         self.ligand_current = 0.0
         self.external_current = 0.0
 
+        # Array of external currents, indexed by neuron_id.
+        # This is set by the neuron factory when it compiles the network.
+        self.external_currents = None
+
         # Active flags
         self.stable = False
 
-    def get_record(self, spikes=False):
-        return self.environment.get_record(self.soma.env_id, spikes)
+    def get_record(self, spikes=False, variant=None):
+        return self.environment.get_record(self.soma.env_id, spikes, variant)
 
     def set_external_current(self, current):
+        # The current may be a sequence with a value for each variant.
         self.external_current = current
+        if self.external_currents is not None:
+            self.external_currents[:, self.neuron_id] = current
 
     def clear_ligand_current(self):
         old = self.ligand_current
@@ -66,60 +79,14 @@ class Neuron:
     def change_ligand_current(self, delta):
         self.ligand_current += delta
 
-    def activate_dendrites(self):
-        # Activate the neuron from each dendrite
-        # This will check the receptor type and decide how to modify the neuron
-        # * This operation has side effects!
-        self.ligand_current = 0.0
-        for synapse in self.in_synapses:
-            synapse.activate_dendrites(self)
-        return self.ligand_current
-
-    def activate_gap_junctions(self, soma_voltage):
-        # Check gap junctions if active
-        gap_current = 0
-        for other,conductance in self.gap_junctions:
-            df = conductance*(other.soma.get_voltage() - soma_voltage)
-            gap_current += df
-        return gap_current
-
-    def step(self, time):
-        soma_voltage = self.soma.get_voltage()
-        old_current = self.current
-
-        ### Calculate current
-        # Start with base curent.
-        new_current = self.base_current
-
-        # Add gap current.
-        if self.active_gap_junctions:
-            new_current += self.activate_gap_junctions(soma_voltage)
-
-        # Add ligand current.
-        new_current += self.activate_dendrites()
-
-        # Add external current.
-        new_current += self.external_current
-
-        # Destabilize if the current has changed.
-        if abs(old_current - new_current) > 0.000001:
-            self.current = new_current
-            self.stable = False
-
-        # If unstable, perform computations.
-        if not self.stable:
-            # Activate the output synapses
-            for synapse in self.out_synapses:
-                synapse.step(soma_voltage)
-            # Activate the soma
-            self.stable = self.soma.step(new_current)
-
     @staticmethod
     def create_synapse(pre, post, receptor=epsp, delay=0, strength=1):
         if pre.spiking:
-            synapse = SpikingSynapse(receptor, delay, strength, pre.environment)
+            synapse = SpikingSynapse(receptor, delay, strength, pre.environment,
+                source_id=pre.soma.env_id)
         else:
-            synapse = GradedSynapse(receptor, delay, strength, pre.environment)
+            synapse = GradedSynapse(receptor, delay, strength, pre.environment,
+                source_id=pre.soma.env_id)
 
         pre.out_synapses.append(synapse)
         post.in_synapses.append(synapse)
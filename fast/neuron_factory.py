@@ -5,33 +5,223 @@
 #     components it holds.
 #
 # Drivers can be added to activate particular neurons at each timestep.
+#
+# Neurons are not stepped one by one.  When the factory is initialized, it
+#     compiles the network into arrays:
+#     - Soma state is gathered into a SomaPopulation, which cycles every
+#           unstable soma in one batched kernel per timestep.
+#     - Synapses are gathered into a SynapseMatrix, which computes the ligand
+#           current of every neuron with one sparse product, and releases
+#           the synapses of stepped neurons through the delay line of the
+#           environment.
+#     - Gap junctions are gathered into a GapJunctionMatrix, which computes
+#           the gap current of every neuron with one sparse Laplacian product.
+#     - Neuron currents and stability flags are kept in arrays.
+# Adding components afterwards stores the compiled state back into the
+#     neurons and somas, and the network is recompiled on the next step.
+#
+# Each timestep only evaluates the neurons whose inputs may have changed:
+#     unstable neurons, neurons whose drivers ran, and neurons that read a
+#     value that changed in the environment (their own voltage, the voltage
+#     of gap junction partners, and the activation of input synapses).
+#     Neurons release their output synapses on the timesteps on which they
+#     are stepped (see delay_line.py), so the synapses of stable neurons
+#     hold their last release.  Quiescent neurons cost nothing per timestep.
+#
+# Grids of neurons (see population.py) keep the state of their neurons in
+#     arrays, and are compiled by copying them into the compiled arrays,
+#     which the arrays of the grids then view.  Only neurons with synapses or
+#     gap junctions are visited one by one when compiling, and the neurons
+#     of a grid are not created until they are indexed.
+#
+# Drivers return the next time they need to be driven, or None if they are
+#     done, and are only called at those times.  Driver schedules (see
+#     tools.py) and frame drivers (see frames.py) drive many neurons at once
+#     in the same way, and write their currents directly into the external
+#     currents of the compiled network.
+#
+# When no neuron is woken or unstable and no value changed, every timestep is
+#     identical until the next driver is scheduled.  The factory then skips
+#     ahead to that time, and the environment records the unchanged values
+#     for the skipped timesteps in bulk.
+#
+# Recorded voltages are kept in memory unless a |recorder| is given, such as
+#     a StreamRecorder that writes them to disk (see recorder.py).  close()
+#     flushes the recorder.
+#
+# A factory with an |ensemble| of K variants simulates K copies of the network
+#     at once, which share their topology but may differ in any parameter
+#     given as a sequence of K values: base currents, synapse strengths, gap
+#     junction conductances, soma types, and driver currents.  Every state
+#     array has a row for each variant, so one timestep costs the Python
+#     overhead of a single network.  A neuron is evaluated if any variant
+#     needs it, but only its unstable variants are stepped, so each variant
+#     matches a network simulated on its own.  Records have one series for
+#     each variant (see Environment.get_record).
 
 from math import ceil
-from environment import Environment
+from numpy import array, zeros, ones, empty, arange, where, \
+                  flatnonzero, absolute, concatenate, unique
+from scipy.sparse import csr_matrix
+from environment import Environment, gather, scatter, bind_parts
+from soma import SomaPopulation
+from synapse_matrix import SynapseMatrix, row_entries
+from gap_junction_matrix import GapJunctionMatrix
 from neuron import Neuron, NeuronTypes
+from population import NeuronGrid
 from receptor import epsp
 
+def merge(arrays, size):
+    """
+    Returns the sorted union of |arrays| of ids below |size|.
+    Large unions are gathered with a mask instead of sorting.
+    """
+    ids = concatenate(arrays + [empty(0, dtype=int)]).astype(int)
+    if len(ids) * 16 < size: return unique(ids)
+    mask = zeros(size, dtype=bool)
+    mask[ids] = True
+    return flatnonzero(mask)
+
 class NeuronFactory:
-    def __init__(self):
-        self.environment = Environment()
+    def __init__(self, recorder=None, ensemble=1):
+        self.environment = Environment(recorder=recorder, ensemble=ensemble)
         self.neurons = []
+        self.grids = []
         self.synapses = []
 
+        # Runs of consecutive neurons, and grids, in order of neuron id.
+        self.parts = []
+        self.size = 0
+
         self.drivers = {}
         self.neuron_drivers = {}
 
         self.time = 0
+        self.somas = None
+        self.driver_schedule = dict()
+        self.schedules = set()
+
+    def initialize(self):
+        parts = self.parts
+        self.somas = SomaPopulation(
+            [[neuron.soma for neuron in part] if isinstance(part, list)
+                else part for part in parts], self.environment)
+        neurons = self.connected_neurons()
+        self.synapse_matrix = SynapseMatrix(neurons, self.environment,
+            self.size)
+        self.gap_matrix = GapJunctionMatrix(neurons, self.environment,
+            self.somas.env_ids)
+
+        batch = self.environment.batch_parts
+        self.base_current = batch(parts, "base_current")
+        self.external_current = batch(parts, "external_current")
+        self.current = batch(parts, "current")
+        self.stable = batch(parts, "stable", dtype=bool)
+        for neuron in self.neurons:
+            neuron.external_currents = self.external_current
+        self.bind_grids()
+
+        # Rows are environment ids, and columns are the neurons that read
+        #     them when computing their current.  Every neuron reads its own
+        #     soma.
+        rows, columns = ([self.somas.env_ids], [arange(self.size)])
+        for neuron in neurons:
+            readers = [other.soma.env_id for other,_ in neuron.gap_junctions] \
+                + [synapse.env_id for synapse in neuron.in_synapses]
+            rows.append(readers)
+            columns.append([neuron.neuron_id] * len(readers))
+        rows, columns = (concatenate(rows).astype(int),
+                         concatenate(columns).astype(int))
+        self.readers = csr_matrix((ones(len(rows)), (rows, columns)),
+            shape=(self.environment.size, self.size))
+
+        # Evaluate every neuron on the first step.
+        self.woken = [arange(self.size)]
+        self.unstable = flatnonzero(~self.stable.all(axis=0))
+
+    def connected_neurons(self):
+        """
+        Returns the neurons that may have synapses or gap junctions, ordered
+            by neuron_id: every neuron created on its own, and the neurons
+            of grids that were connected.
+        """
+        if len(self.grids) == 0: return self.neurons
+        neurons = list(self.neurons)
+        for grid in self.grids:
+            neurons += grid.connected_neurons()
+        neurons.sort(key=lambda neuron: neuron.neuron_id)
+        return neurons
+
+    def bind_grids(self):
+        """
+        Binds the state of grids to views of the compiled arrays.
+        """
+        bind_parts(self.parts, self,
+            ("base_current", "external_current", "current", "stable"))
+        self.somas.bind()
+
+    def __setstate__(self, state):
+        # Views are pickled as copies, so restored grids are bound again.
+        self.__dict__.update(state)
+        if self.somas is not None: self.bind_grids()
+
+    def store(self):
+        """
+        Stores the compiled state back into the neurons and somas.
+        """
+        self.somas.store()
+        unbatch = self.environment.unbatch
+        for neuron in self.neurons:
+            neuron.current = unbatch(self.current[:, neuron.neuron_id])
+            neuron.stable = unbatch(self.stable[:, neuron.neuron_id])
+            neuron.external_current = unbatch(
+                self.external_current[:, neuron.neuron_id])
+            neuron.external_currents = None
+
+    def close(self):
+        # Flush recorded values.
+        self.environment.recorder.close()
+
+    def invalidate(self):
+        # The network must be recompiled to include new components.
+        if self.somas is not None:
+            self.store()
+            self.somas = None
 
     def drive(self):
         # Activate drivers
         # Drivers do not step the neuron, but modify it to prepare for
-        #     a timestep.  If True is returned, the neuron should be
-        #     stepped during this timestep.
-        for neuron,driver in self.neuron_drivers.iteritems():
-            driver.drive(neuron, self.time)
+        #     a timestep.  They return the next time they should be driven,
+        #     and the neurons they drive are evaluated this timestep.
+        for target in self.driver_schedule.pop(self.time, ()):
+            if target in self.schedules:
+                next_time, neuron_ids = target.drive(
+                    self.external_current, self.time)
+            else:
+                next_time = self.neuron_drivers[target].drive(target, self.time)
+                neuron_ids = [target.neuron_id]
+            if next_time is not None:
+                self.schedule_driver(target, max(next_time, self.time+1))
+            self.woken.append(neuron_ids)
+
+    def schedule_driver(self, target, time):
+        # Targets are driven neurons, or driver schedules.
+        self.driver_schedule.setdefault(time, set()).add(target)
 
     def step(self, count=1):
-        for _ in xrange(count):
+        if self.somas is None: self.initialize()
+
+        stop = self.time + count
+        while self.time < stop:
+            # Skip quiescent timesteps.  Only stepped neurons push into the
+            #     delay line, so delayed synapses cannot release while
+            #     skipping, and only drivers can end the skip.
+            skip = self.quiescent_steps(stop)
+            if skip > 0:
+                self.environment.skip(skip)
+                self.time += skip
+                continue
+
             # Activate drivers
             self.drive()
 
@@ -43,29 +233,105 @@ class NeuronFactory:
             if True or self.time % 100 == 0: print(self.time)
 
             # Activate neurons
-            for neuron in self.neurons: neuron.step(self.time)
+            self.step_neurons()
+
+    def quiescent_steps(self, stop):
+        """
+        Returns the number of timesteps from now until |stop| in which nothing
+            happens: no neuron is woken or unstable, no value is dirty, and
+            no driver is scheduled.
+        """
+        if len(self.unstable) > 0: return 0
+        if any(len(woken) > 0 for woken in self.woken): return 0
+        if self.environment.is_dirty(): return 0
+
+        end = stop
+        if len(self.driver_schedule) > 0:
+            end = min(end, min(self.driver_schedule))
+        return max(0, end - self.time)
+
+    def wake(self):
+        """
+        Returns the sorted ids of the neurons to evaluate this timestep.
+        """
+        changed = self.environment.changed
+        positions, _ = row_entries(self.readers, changed)
+        woken = self.woken + [self.unstable, self.readers.indices[positions]]
+        self.woken = []
+        return merge(woken, self.size)
+
+    def step_neurons(self):
+        # Voltages and currents have a row for each variant, and a column for
+        #     each of the |rows|.
+        rows = self.wake()
+        voltage = self.environment.get_many(self.somas.env_ids[rows])
+
+        ### Calculate current
+        # Start with gap current.
+        gap_current = self.gap_matrix.gap_current(rows, voltage)
+
+        # Add base, ligand, and external currents.
+        current = gather(self.base_current, rows) + gap_current \
+            + self.synapse_matrix.ligand_current(voltage, rows) \
+            + gather(self.external_current, rows)
+
+        # Destabilize variants whose current has changed.
+        old_current = gather(self.current, rows)
+        changed = absolute(old_current - current) > 0.000001
+        scatter(self.current, rows, where(changed, current, old_current))
+        unstable = ~gather(self.stable, rows) | changed
+        scatter(self.stable, rows, ~unstable)
+
+        # Cycle the somas with unstable variants together, after releasing
+        #     their output synapses with the voltage they start from.
+        columns = unstable.any(axis=0)
+        active = rows[columns]
+        if len(active) == 0:
+            self.unstable = active
+            return
+        mask = unstable.compress(columns, axis=1)
+        self.synapse_matrix.release(self.somas.env_ids[active],
+            voltage.compress(columns, axis=1), None if mask.all() else mask)
+        stable = self.somas.step(current.compress(columns, axis=1), active,
+            None if mask.all() else mask)
+        scatter(self.stable, active, stable)
+        self.unstable = active[~stable.all(axis=0)]
 
     def create_neuron(self, base_current=0.0,
-            neuron_type=NeuronTypes.GANGLION, record=False):
+            neuron_type=NeuronTypes.GANGLION, record=False, soma_type=None):
         neuron = Neuron(
-            neuron_id=len(self.neurons),
+            neuron_id=self.size,
             base_current=base_current,
             neuron_type=neuron_type,
             environment=self.environment,
-            record=record)
+            record=record,
+            soma_type=soma_type)
+        self.invalidate()
         self.neurons.append(neuron)
+        if len(self.parts) > 0 and isinstance(self.parts[-1], list):
+            self.parts[-1].append(neuron)
+        else: self.parts.append([neuron])
+        self.size += 1
 
         return neuron
 
     def create_neuron_grid(self, width, height, base_current=0.0,
-            neuron_type=NeuronTypes.GANGLION, record=False):
-        output = []
-        for i in xrange(height):
-            row = []
-            for j in xrange(width):
-                row.append(self.create_neuron(base_current, neuron_type, record=record))
-            output.append(row)
-        return output
+            neuron_type=NeuronTypes.GANGLION, record=False, soma_type=None):
+        """
+        Creates a |height| by |width| grid of neurons (see population.py).
+        The |base_current| may be an array shaped like the grid.
+        """
+        self.invalidate()
+        grid = NeuronGrid(width, height, self.size,
+            base_current=base_current,
+            neuron_type=neuron_type,
+            environment=self.environment,
+            record=record,
+            soma_type=soma_type)
+        self.grids.append(grid)
+        self.parts.append(grid)
+        self.size += grid.size
+        return grid
 
     def connect_grids(self, grid1, grid2,
             receptor=epsp, delay=0, strength=25):
@@ -86,17 +352,28 @@ class NeuronFactory:
 
     def create_synapse(self, pre_neuron, post_neuron,
             receptor=epsp, delay=0, strength=1):
+        self.invalidate()
         synapse = Neuron.create_synapse(pre_neuron, post_neuron,
             receptor=receptor, delay=delay, strength=strength)
         self.synapses.append(synapse)
         return synapse
 
     def create_gap_junction(self, pre_neuron, post_neuron, conductance=1.0):
+        self.invalidate()
         Neuron.create_gap_junction(pre_neuron, post_neuron, conductance)
 
     def register_driver(self, neuron, driver, name=None):
         self.neuron_drivers[neuron] = driver
         self.drivers[name] = driver
+        self.schedule_driver(neuron, self.time)
+
+    def register_schedule(self, schedule):
+        """
+        Registers a schedule that drives many neurons at once, such as a
+            DriverSchedule (see tools.py) or a FrameDriver (see frames.py).
+        """
+        self.schedules.add(schedule)
+        self.schedule_driver(schedule, self.time)
 
     def get_driver_data(self, name):
         return (name, self.drivers[name].data)
@@ -0,0 +1,221 @@
+# Neuron Grids
+#
+# A grid of neurons, such as a layer of photoreceptors, can hold a million
+#     neurons, and building a Neuron and a Soma object for each of them takes
+#     minutes and gigabytes before the network is stepped.  A neuron grid
+#     instead keeps the state of all of its neurons in arrays shaped like the
+#     grid, (height, width), with a leading dimension for the variants of an
+#     ensemble, and registers their voltages with the environment at once.
+#     The neuron ids and env_ids of a grid are consecutive, in row-major
+#     order (see neuron_ids and env_ids).
+#
+# Code that wants a neuron, eg to create a synapse or register a driver,
+#     indexes the grid with grid[i][j] or grid[i, j], which returns a view of
+#     that cell.  A view is created the first time its cell is indexed, and
+#     kept, so that it can hold the synapses and gap junctions of its cell.
+#     Views have the attributes that connect a Neuron (its id, its soma's
+#     env_id, synapses, and gap junctions), and set their external current
+#     in the arrays of the grid.  Driver schedules and frame drivers (see
+#     tools.py and frames.py) drive a whole grid without creating views.
+#
+# When the neuron factory compiles the network, it copies the arrays of each
+#     grid into its own, and the arrays of the grid become views of the
+#     columns that hold the grid in the compiled arrays, so that the grid
+#     always shows the current state of its neurons.
+
+from numpy import asarray, arange, zeros, full, empty
+from neuron import NeuronTypes, NEURON_SOMAS
+
+class NeuronGrid:
+    def __init__(self, width, height, first_id, base_current=0.0,
+            neuron_type=NeuronTypes.GANGLION, environment=None, record=False,
+            soma_type=None, resolution=10):
+        """
+        Creates a |height| by |width| grid of neurons of the given
+            |neuron_type|, with ids from |first_id|.
+        The |base_current| is a single value, an array (eg an image) with a
+            value for each neuron, or either of them for each variant of an
+            ensemble.  The |soma_type| of the neuron type can be overridden,
+            eg with a list of soma types for the variants of an ensemble.
+        """
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.environment = environment
+        self.ensemble = environment.ensemble
+        self.shape = (height, width) if self.ensemble == 1 \
+                         else (self.ensemble, height, width)
+        self.neuron_ids = arange(first_id, first_id + self.size).reshape(
+            height, width)
+        self.views = dict()
+
+        default_type, self.spiking, fixed_current = NEURON_SOMAS[neuron_type]
+        if fixed_current is not None: base_current = fixed_current
+        self.soma_type = soma_type or default_type
+
+        # Neuron state
+        self.bind("base_current", self.batched_values(base_current))
+        self.bind("external_current", zeros((self.ensemble, self.size)))
+        self.bind("current", self.batched("base_current").copy())
+        self.bind("stable", zeros((self.ensemble, self.size), dtype=bool))
+
+        # Soma state
+        if isinstance(self.soma_type, list):
+            parameters = zip(*self.soma_type)
+        else: parameters = self.soma_type
+        for name,parameter in zip(("a", "b", "c", "d"), parameters):
+            self.bind(name, self.batched_values(parameter))
+        self.bind("u", self.batched("b") * self.batched("c"))
+        self.bind("prev_voltage", self.batched("c").copy())
+        self.bind("stable_count",
+            zeros((self.ensemble, self.size), dtype=int))
+        self.resolution = full((height, width), resolution, dtype=int)
+        self.time_coefficient = full((height, width), 1.0 / resolution)
+
+        self.env_ids = environment.register_many(self.size,
+            self.batched("c"), record=record, spiking=self.spiking).reshape(
+            height, width)
+
+    def batched_values(self, values):
+        """
+        Returns a batched array of |values| with a column for each neuron,
+            given a single value or an array shaped like the grid, either
+            of them optionally for each variant.
+        """
+        batched = empty((self.ensemble, self.size))
+        values = asarray(values, dtype=float)
+        if values.ndim == 0 or values.ndim == 1: batched[:] = values[..., None]
+        else: batched[:] = values.reshape(-1, self.size)
+        return batched
+
+    def bind(self, name, batched):
+        """
+        Sets the state called |name| to an array shaped like the grid that
+            views the |batched| array, which has a row for each variant and
+            a column for each neuron.
+        """
+        setattr(self, name, batched.reshape(self.shape))
+
+    def batched(self, name):
+        """
+        Returns the state called |name| as a batched array, which views the
+            state of the grid.
+        """
+        return getattr(self, name).reshape(self.ensemble, self.size)
+
+    def flat(self, name):
+        """
+        Returns the shared state called |name| as an array with a value for
+            each neuron, which views the state of the grid.
+        """
+        return getattr(self, name).reshape(self.size)
+
+    def bind_flat(self, name, values):
+        """
+        Sets the shared state called |name| to an array shaped like the grid
+            that views the flat array of |values|.
+        """
+        setattr(self, name, values.reshape(self.height, self.width))
+
+    def voltages(self, variant=0):
+        """
+        Returns an array of the voltage of each neuron in the given |variant|,
+            shaped like the grid.
+        """
+        return self.environment.prev_values[variant].take(self.env_ids)
+
+    def spike_counts(self, variant=0):
+        """
+        Returns an array of the spike count of each neuron in the given
+            |variant|, shaped like the grid.  The neurons must be recorded.
+        """
+        return self.environment.spikes.spike_counts(
+            self.env_ids.ravel(), variant).reshape(self.height, self.width)
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        for i in xrange(self.height):
+            yield GridRow(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple): return self.neuron(*index)
+        if index < 0: index += self.height
+        if not 0 <= index < self.height: raise IndexError(index)
+        return GridRow(self, index)
+
+    def neuron(self, row, column):
+        """
+        Returns the view of the neuron at |row| and |column|.
+        """
+        if row < 0: row += self.height
+        if column < 0: column += self.width
+        if not (0 <= row < self.height and 0 <= column < self.width):
+            raise IndexError((row, column))
+        try: return self.views[(row, column)]
+        except KeyError:
+            view = GridNeuron(self, row, column)
+            self.views[(row, column)] = view
+            return view
+
+    def connected_neurons(self):
+        """
+        Returns the views that have synapses or gap junctions.
+        """
+        return [view for view in self.views.itervalues()
+            if view.in_synapses or view.out_synapses or view.gap_junctions]
+
+class GridRow:
+    def __init__(self, grid, row):
+        self.grid = grid
+        self.row = row
+
+    def __len__(self):
+        return self.grid.width
+
+    def __iter__(self):
+        for j in xrange(self.grid.width):
+            yield self.grid.neuron(self.row, j)
+
+    def __getitem__(self, column):
+        return self.grid.neuron(self.row, column)
+
+class GridSoma:
+    def __init__(self, environment, env_id):
+        self.environment = environment
+        self.env_id = env_id
+
+    def get_voltage(self):
+        return self.environment.get(self.env_id)
+
+class GridNeuron:
+    def __init__(self, grid, row, column):
+        """
+        Creates a view of the neuron at |row| and |column| of a |grid|.
+        """
+        self.grid = grid
+        self.row = row
+        self.column = column
+        self.neuron_id = int(grid.neuron_ids[row, column])
+        self.environment = grid.environment
+        self.spiking = grid.spiking
+        self.soma = GridSoma(grid.environment, int(grid.env_ids[row, column]))
+
+        # Synapses
+        self.in_synapses = []
+        self.out_synapses = []
+
+        # Gap junctions
+        self.gap_junctions = []
+        self.active_gap_junctions = False
+
+    def get_record(self, spikes=False, variant=None):
+        return self.environment.get_record(self.soma.env_id, spikes, variant)
+
+    def get_external_current(self):
+        return self.grid.external_current[..., self.row, self.column]
+
+    def set_external_current(self, current):
+        # The current may be a sequence with a value for each variant.
+        self.grid.external_current[..., self.row, self.column] = current
@@ -1,3 +1,5 @@
+from numpy import maximum, negative
+
 def epsp(strength, activation, neuron):
     curr = activation*strength
     if curr > 0.0:
@@ -10,3 +12,19 @@ def voltage_epsp(strength, activation, neuron):
 
 def ipsp(strength, activation, neuron):
     neuron.change_ligand_current(-strength*activation)
+
+def receptor_weight(receptor, strength):
+    """
+    Expresses a |receptor| function as a signed weight, so that it can be
+        applied by a synapse matrix.
+    Returns a (weight, voltage_gated) tuple, or None if the receptor cannot
+        be expressed as a weight.
+    Synaptic activations are never negative, so an epsp with a negative
+        |strength| never contributes.
+    The |strength| may be a sequence with a value for each variant of an
+        ensemble, and so is the weight.
+    """
+    if receptor is epsp: return (maximum(0.0, strength), False)
+    elif receptor is ipsp: return (negative(strength), False)
+    elif receptor is voltage_epsp: return (strength, True)
+    else: return None
@@ -0,0 +1,419 @@
+# Recorders
+#
+# Recorders hold the values of the recorded env_ids at each timestep.  The
+#     environment passes them its previous values when it steps, with a row
+#     for each variant of an ensemble, and records are read one variant at
+#     a time.  While nothing changes, the environment records the same
+#     values for many timesteps at once, with a |count|.
+#
+# The memory recorder keeps a list of values for each env_id, which is simple
+#     but keeps every sample of the run in memory, boxed as Python floats.
+#
+# The stream recorder keeps a chunk of timesteps in an array, with one row per
+#     timestep and one column per recorded env_id, and appends each full
+#     chunk to a binary file of packed values.  Memory then stays constant
+#     however long the run is.  In an ensemble, each timestep holds a row of
+#     columns for each variant.  The env_ids of the columns are saved in an
+#     index file next to the data file when recording starts, with a row for
+#     each variant.  The columns of a data file are fixed, so env_ids
+#     registered after recording started (eg for neurons added to a running
+#     network) begin a new segment, with its own data and index files, and
+#     the columns of the previous segment followed by the new env_ids.  When
+#     a stream recorder is checkpointed, the data file of its segment is
+#     reopened on restore and truncated to the timesteps recorded at the
+#     checkpoint, and later segments are removed.
+#
+# A record reader memory-maps the data files for analysis, so that only the
+#     parts that are read are loaded from disk, and joins the segments of a
+#     record, from the segment in which its env_id was registered.  Reading
+#     a record from a stream recorder flushes it first.
+#
+# Spikes are sparse, so the spike recorder only keeps spike events, as arrays
+#     of their times, env_ids, and variants.  When the spikes are first
+#     queried, the events are sorted by variant and env_id, and the offset
+#     of the first spike of each env_id is kept as an index, so that the
+#     spike times of an env_id are a slice.  Firing rates and rasters are
+#     computed from the index.  Env_ids can be registered after recording
+#     started (eg for neurons added to a running network), and have no spikes
+#     before they were registered.  The timestep on which each env_id was
+#     registered is kept, and its firing rate is computed from then on.
+
+from os import remove
+from os.path import getsize, exists
+from numpy import array, asarray, empty, zeros, arange, repeat, diff, \
+                  bincount, tile, lexsort, searchsorted, concatenate, int32, \
+                  maximum, load, save, memmap, dtype as numpy_dtype
+
+def index_path(path):
+    """
+    Returns the path of the index file of the data file at |path|.
+    """
+    return path + ".index.npy"
+
+def segment_path(path, segment):
+    """
+    Returns the path of the data file of the given |segment| of the records
+        at |path|.  The first segment is the file at |path| itself.
+    """
+    if segment == 0: return path
+    return "%s.%d" % (path, segment)
+
+def remove_segments(path, first):
+    """
+    Removes the data and index files of the segments of the records at
+        |path| from the segment |first| on.
+    """
+    segment = first
+    while exists(index_path(segment_path(path, segment))):
+        remove(index_path(segment_path(path, segment)))
+        if exists(segment_path(path, segment)):
+            remove(segment_path(path, segment))
+        segment += 1
+
+class MemoryRecorder:
+    def __init__(self):
+        self.records = dict()
+        self.ensemble = 1
+
+    def register(self, env_id):
+        self.records[env_id] = []
+
+    def register_many(self, env_ids):
+        self.records.update((env_id, []) for env_id in env_ids.tolist())
+
+    def record(self, values, count=1):
+        # The values of each variant of an ensemble are kept together.
+        self.ensemble = len(values)
+        if count > 1:
+            for env_id,record in self.records.iteritems():
+                if self.ensemble == 1: value = values.item(0, env_id)
+                else: value = values[:, env_id].tolist()
+                record.extend([value] * count)
+        elif self.ensemble == 1:
+            for env_id,record in self.records.iteritems():
+                record.append(values.item(0, env_id))
+        else:
+            for env_id,record in self.records.iteritems():
+                record.append(values[:, env_id].tolist())
+
+    def get(self, env_id, variant=0):
+        if self.ensemble == 1: return self.records[env_id]
+        return [values[variant] for values in self.records[env_id]]
+
+    def close(self):
+        pass
+
+class StreamRecorder:
+    def __init__(self, path, chunk=1000, dtype=float):
+        """
+        Creates a recorder that writes to the data file at |path|, in chunks
+            of |chunk| timesteps.  Values are stored with the given |dtype|.
+        """
+        self.path = path
+        self.chunk = chunk
+        self.dtype = numpy_dtype(dtype)
+        self.env_ids = []
+        self.buffer = None
+        self.file = None
+        self.count = 0
+        self.ensemble = 1
+        self.segment = 0
+
+    def register(self, env_id):
+        if self.buffer is not None: self.register_many([env_id])
+        else: self.env_ids.append(env_id)
+
+    def register_many(self, env_ids):
+        env_ids = asarray(env_ids, dtype=int).tolist()
+        if self.buffer is None:
+            self.env_ids.extend(env_ids)
+            return
+
+        # The columns of a data file are fixed, so env_ids registered after
+        #     recording started begin a new segment.  A segment in which no
+        #     timestep was recorded yet is replaced instead.
+        registered = set(self.env_ids.tolist())
+        added = [env_id for env_id in env_ids if env_id not in registered]
+        if len(added) == 0: return
+        self.close()
+        if getsize(segment_path(self.path, self.segment)) > 0:
+            self.segment += 1
+        self.env_ids = concatenate((self.env_ids, array(added, dtype=int)))
+        self.start(self.ensemble)
+
+    def start(self, ensemble=1):
+        """
+        Allocates the chunk buffer for an |ensemble| of variants, and creates
+            the data and index files of the current segment.
+        """
+        path = segment_path(self.path, self.segment)
+        if self.segment == 0: remove_segments(self.path, 1)
+        self.env_ids = array(self.env_ids, dtype=int)
+        self.ensemble = ensemble
+        self.buffer = empty((self.chunk, ensemble, len(self.env_ids)),
+            dtype=self.dtype)
+        save(index_path(path), tile(self.env_ids, (ensemble, 1)))
+        self.file = open(path, "wb")
+
+    def record(self, values, count=1):
+        if self.buffer is None: self.start(len(values))
+        if count == 1:
+            self.buffer[self.count] = values[:, self.env_ids]
+            self.count += 1
+            if self.count == self.chunk: self.flush()
+            return
+        row = values[:, self.env_ids]
+        while count > 0:
+            rows = min(count, self.chunk - self.count)
+            self.buffer[self.count:self.count + rows] = row
+            self.count += rows
+            count -= rows
+            if self.count == self.chunk: self.flush()
+
+    def flush(self):
+        """
+        Appends the buffered timesteps to the data file.
+        """
+        if self.file is None: return
+        self.buffer[:self.count].tofile(self.file)
+        self.file.flush()
+        self.count = 0
+
+    def get(self, env_id, variant=0):
+        self.flush()
+        return RecordReader(self.path, self.dtype).get(env_id, variant)
+
+    def __getstate__(self):
+        # The data file is saved as its position, and reopened on restore,
+        #     dropping anything written after the checkpoint.
+        self.flush()
+        state = self.__dict__.copy()
+        if self.file is not None: state["file"] = self.file.tell()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.file is not None:
+            position = self.file
+            self.file = open(segment_path(self.path, self.segment), "r+b")
+            self.file.truncate(position)
+            self.file.seek(position)
+            remove_segments(self.path, self.segment + 1)
+
+    def close(self):
+        if self.file is None: return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+class RecordReader:
+    def __init__(self, path, dtype=float):
+        """
+        Memory-maps the data files of the segments of the records at |path|,
+            written by a stream recorder with the given |dtype|.
+        """
+        self.dtype = numpy_dtype(dtype)
+        self.segments = []
+        while exists(index_path(segment_path(path, len(self.segments)))):
+            self.segments.append(
+                self.load_segment(segment_path(path, len(self.segments))))
+
+    def load_segment(self, path):
+        """
+        Returns the columns of the data file at |path|, as a dict from env_ids
+            to column indices, and its memory-mapped values.
+        """
+        index = load(index_path(path))
+        if index.ndim == 1: index = index.reshape(1, -1)
+        columns = dict((env_id, i) for i,env_id in enumerate(index[0].tolist()))
+        ensemble, width = index.shape
+        size = self.dtype.itemsize * ensemble * width
+        length = getsize(path) // size if size else 0
+        if length > 0:
+            values = memmap(path, dtype=self.dtype, mode="r",
+                shape=(length, ensemble, width))
+        else: values = empty((0, ensemble, width), dtype=self.dtype)
+        return columns, values
+
+    def get(self, env_id, variant=0):
+        """
+        Returns an array of the recorded values of |env_id| in the given
+            |variant|, from the timestep on which it was registered.
+        """
+        parts = [values[:, variant, columns[env_id]]
+            for columns,values in self.segments if env_id in columns]
+        if len(parts) == 0: raise KeyError(env_id)
+        if len(parts) == 1: return parts[0]
+        return concatenate(parts)
+
+class SpikeRecorder:
+    def __init__(self, capacity=1024, threshold=30.0):
+        """
+        Creates an empty spike recorder, with room for |capacity| spikes.
+        Values at or above the |threshold| are spikes.
+        """
+        self.threshold = threshold
+        self.env_ids = []
+        self.columns = None
+        self.ensemble = 1
+        self.times = empty(capacity, dtype=int32)
+        self.ids = empty(capacity, dtype=int32)
+        self.variants = empty(capacity, dtype=int32)
+        self.length = 0
+        self.time = 0
+        self.offsets = None
+
+    def __contains__(self, env_id):
+        if self.columns is None: return env_id in self.env_ids
+        return env_id in self.columns
+
+    def register(self, env_id):
+        if self.columns is not None: self.register_many([env_id])
+        elif env_id not in self.env_ids:
+            self.env_ids.append(env_id)
+
+    def register_many(self, env_ids):
+        env_ids = asarray(env_ids, dtype=int).tolist()
+        if self.columns is None:
+            registered = set(self.env_ids)
+            self.env_ids.extend(env_id for env_id in env_ids
+                if env_id not in registered)
+            return
+
+        # Events keep their env_ids, so env_ids registered after recording
+        #     started are inserted in order, and the index is rebuilt.
+        added = [env_id for env_id in env_ids if env_id not in self.columns]
+        if len(added) == 0: return
+        onsets = dict(zip(self.env_ids.tolist(), self.onsets.tolist()))
+        onsets.update((env_id, self.time) for env_id in added)
+        self.env_ids = array(sorted(onsets), dtype=int)
+        self.onsets = array([onsets[env_id] for env_id in self.env_ids.tolist()],
+            dtype=int)
+        self.columns = dict((env_id, i)
+            for i,env_id in enumerate(self.env_ids.tolist()))
+        self.offsets = None
+
+    def start(self, ensemble=1):
+        """
+        Sorts the registered env_ids, which are then fixed, and records an
+            |ensemble| of variants of them.
+        """
+        self.env_ids = array(sorted(self.env_ids), dtype=int)
+        self.onsets = zeros(len(self.env_ids), dtype=int)
+        self.columns = dict((env_id, i)
+            for i,env_id in enumerate(self.env_ids.tolist()))
+        self.ensemble = ensemble
+
+    def record(self, values, count=1):
+        """
+        Records the spikes among the |values| of the current timestep, which
+            have a row for each variant, repeated for |count| timesteps.
+        """
+        if self.columns is None: self.start(len(values))
+        variants, columns = (values[:, self.env_ids] >= self.threshold).nonzero()
+        if len(columns) > 0:
+            self.append(
+                repeat(arange(self.time, self.time + count, dtype=int32),
+                    len(columns)),
+                tile(self.env_ids[columns], count), tile(variants, count))
+        self.time += count
+
+    def append(self, times, ids, variants=0):
+        """
+        Appends spike events, given arrays of their |times|, |ids|, and
+            |variants|.
+        """
+        length = self.length + len(ids)
+        if length > len(self.times):
+            capacity = max(length, 2 * len(self.times))
+            for name in ("times", "ids", "variants"):
+                old = getattr(self, name)
+                new = empty(capacity, dtype=int32)
+                new[:self.length] = old[:self.length]
+                setattr(self, name, new)
+        self.times[self.length:length] = times
+        self.ids[self.length:length] = ids
+        self.variants[self.length:length] = variants
+        self.length = length
+        self.offsets = None
+
+    def build_index(self):
+        """
+        Sorts the spikes by variant, env_id, and time, and finds the offset
+            of the first spike of each env_id of each variant.  This is done
+            when the spikes are first queried after recording.
+        Rows of the index are positions in |env_ids|, following each other
+            for each variant.
+        """
+        if self.columns is None: self.start()
+        width = len(self.env_ids)
+        times = self.times[:self.length]
+        rows = self.variants[:self.length] * width \
+            + searchsorted(self.env_ids, self.ids[:self.length])
+        order = lexsort((times, rows))
+        self.sorted_times = times[order]
+        self.offsets = searchsorted(rows[order],
+            arange(self.ensemble * width + 1))
+        self.rows = repeat(arange(self.ensemble * width), diff(self.offsets))
+
+    def spike_times(self, env_id, variant=0):
+        """
+        Returns an array of the times at which |env_id| spiked in the given
+            |variant|.
+        """
+        if self.offsets is None: self.build_index()
+        row = variant * len(self.env_ids) + self.columns[env_id]
+        return self.sorted_times[self.offsets[row]:self.offsets[row+1]]
+
+    def spike_count(self, env_id, variant=0):
+        """
+        Returns the number of times |env_id| spiked in the given |variant|.
+        """
+        return len(self.spike_times(env_id, variant))
+
+    def spike_counts(self, env_ids, variant=0):
+        """
+        Returns an array of the number of times each of the |env_ids| spiked
+            in the given |variant|.
+        """
+        if self.offsets is None: self.build_index()
+        rows = variant * len(self.env_ids) \
+            + searchsorted(self.env_ids, env_ids)
+        return self.offsets[rows+1] - self.offsets[rows]
+
+    def dense(self, env_id, variant=0):
+        """
+        Returns a list with 1 for each timestep at which |env_id| spiked in
+            the given |variant|, and 0 otherwise.
+        """
+        record = zeros(self.time, dtype=int)
+        record[self.spike_times(env_id, variant)] = 1
+        return record.tolist()
+
+    def raster(self, start=0, stop=None, variant=0):
+        """
+        Returns the times of the spikes of the given |variant| from |start|
+            until |stop|, and the rows of the env_ids that fired them, which
+            are their positions in |env_ids|.
+        """
+        if self.offsets is None: self.build_index()
+        if stop is None: stop = self.time
+        width = len(self.env_ids)
+        first = self.offsets[variant * width]
+        last = self.offsets[(variant+1) * width]
+        times = self.sorted_times[first:last]
+        window = (times >= start) & (times < stop)
+        return times[window], self.rows[first:last][window] - variant * width
+
+    def rates(self, start=0, stop=None, variant=0):
+        """
+        Returns an array of the firing rate of each of the |env_ids| in the
+            given |variant|, in spikes per timestep, from |start| until
+            |stop|.  Env_ids registered after |start| are counted from the
+            timestep on which they were registered.
+        """
+        if stop is None: stop = self.time
+        _, rows = self.raster(start, stop, variant)
+        counts = bincount(rows, minlength=len(self.env_ids))
+        lengths = maximum(1, stop - maximum(start, self.onsets))
+        return counts / lengths.astype(float)
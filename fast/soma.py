@@ -19,7 +19,20 @@
 # The parameter d describes after-spike reset of the recovery variable
 # u caused by slow high-threshold Na+ and K+ conductances.
 # A typical value is d = 2.
+#
+# A SomaPopulation holds the state of many somas in arrays and cycles them
+#     together in one batched kernel.  The neuron factory builds one from its
+#     somas, and the arrays of its grids of neurons (see population.py), when
+#     it is initialized.
+#
+# In an ensemble (see environment.py), the state arrays have a row for each
+#     variant, and a soma can be given a list of soma types, one for each
+#     variant.  Variants that are stable are not stepped, so that each
+#     variant evolves exactly as it would on its own.
 
+from numpy import array, empty, arange, concatenate, flatnonzero, \
+                  absolute, where, tile
+from environment import gather, scatter, bind_parts
 from enum import enum
 
 # Parameter constants.
@@ -36,6 +49,9 @@ SOMA_TYPES = enum(
     HORIZONTAL       = (0   , 0   , -82.6, 0   )  # Horizontal Cell
 )
 
+# Soma state with a value for each variant of an ensemble.
+BATCHED_STATE = ("a", "b", "c", "d", "u", "prev_voltage")
+
 class Soma:
     def __init__(self, soma_type=SOMA_TYPES.DEFAULT, environment=None,
                             record=False, spiking=False, resolution=10):
@@ -61,7 +77,11 @@ class Soma:
         self.environment.set(self.env_id, v)
 
     def reset(self):
-        self.a, self.b, self.c, self.d = self.soma_type
+        if isinstance(self.soma_type, list):
+            # Each variant of an ensemble has its own soma type.
+            self.a, self.b, self.c, self.d = \
+                (array(parameter) for parameter in zip(*self.soma_type))
+        else: self.a, self.b, self.c, self.d = self.soma_type
         self.u = self.b * self.c
         self.prev_voltage = self.c
 
@@ -112,3 +132,123 @@ class Soma:
 
     def get_adjusted_voltage(self):
         return (min(self.get_voltage(), 30) - self.c) / 100
+
+class SomaPopulation:
+    def __init__(self, parts, environment=None):
+        """
+        Builds a population from |parts|, which are lists of somas, or grids
+            of neurons (see population.py), in order.
+        The parameters and state of each soma are copied into arrays, and
+            the population owns that state from then on.  Use store() to
+            copy it back into the soma objects.  The state arrays of grids
+            become views of the population arrays.
+        Voltages stay in the |environment|, so that synapses and gap
+            junctions can read them as usual.
+        """
+        self.parts = parts
+        self.environment = environment
+        self.env_ids = concatenate([empty(0, dtype=int)] + [
+            array([soma.env_id for soma in part], dtype=int)
+                if isinstance(part, list) else part.env_ids.ravel()
+            for part in parts])
+
+        batch = environment.batch_parts
+        for name in BATCHED_STATE:
+            setattr(self, name, batch(parts, name))
+        self.stable_count = batch(parts, "stable_count", dtype=int)
+        self.resolution = batch(parts, "resolution", dtype=int, shared=True)
+        self.time_coefficient = batch(parts, "time_coefficient", shared=True)
+        self.max_resolution = self.resolution.max() if len(self) else 0
+        self.bind()
+
+    def bind(self):
+        """
+        Binds the state of grids to views of the population arrays.
+        """
+        bind_parts(self.parts, self, BATCHED_STATE + ("stable_count",))
+        bind_parts(self.parts, self, ("resolution", "time_coefficient"),
+            shared=True)
+
+    def __len__(self):
+        return len(self.env_ids)
+
+    def store(self):
+        """
+        Copies the population state back into the soma objects.
+        """
+        unbatch = self.environment.unbatch
+        start = 0
+        for part in self.parts:
+            if not isinstance(part, list):
+                start += part.size
+                continue
+            for i,soma in enumerate(part, start):
+                soma.u = unbatch(self.u[:, i])
+                soma.prev_voltage = unbatch(self.prev_voltage[:, i])
+                soma.stable_count = unbatch(self.stable_count[:, i])
+            start += len(part)
+
+    def step(self, current, indices=None, mask=None):
+        """
+        Steps the somas at |indices| (all somas if None) with the given
+            |current| array, which holds the current of each variant of
+            each stepped soma.
+        Only the variants in the boolean |mask| are stepped, or all of them
+            if it is None.
+        Returns a boolean array of the stability of each variant of the
+            stepped somas.
+        """
+        if indices is None:
+            indices = arange(len(self))
+        env_ids = self.env_ids[indices]
+        old_voltage = array(self.environment.get_many(env_ids), dtype=float)
+        voltage, u = self.cycle(indices, old_voltage.copy(), current)
+
+        old_prev_voltage = gather(self.prev_voltage, indices)
+        old_stable_count = gather(self.stable_count, indices)
+        stable_count = old_stable_count + 1
+        stable_count[absolute(voltage - old_prev_voltage) >= 0.001] = 0
+        prev_voltage = voltage
+        if mask is not None:
+            voltage = where(mask, voltage, old_voltage)
+            u = where(mask, u, gather(self.u, indices))
+            stable_count = where(mask, stable_count, old_stable_count)
+            prev_voltage = where(mask, prev_voltage, old_prev_voltage)
+
+        self.environment.set_many(env_ids, voltage)
+        scatter(self.u, indices, u)
+        scatter(self.stable_count, indices, stable_count)
+        scatter(self.prev_voltage, indices, prev_voltage)
+
+        return stable_count > 10
+
+    def cycle(self, indices, voltage, current):
+        """
+        Batched version of Soma.cycle.
+        Somas that cross 30 mV stop integrating for the rest of the
+            timestep, and are reset at the start of the next one.
+        Returns the new voltage and recovery variable.
+        """
+        # The variants of each soma are cycled as one flat array.
+        shape = voltage.shape
+        a, b, c, d, u = (gather(parameter, indices).ravel() for parameter in
+            (self.a, self.b, self.c, self.d, self.u))
+        time_coefficient = self.time_coefficient[indices]
+        resolution = self.resolution[indices]
+        if len(voltage) > 1:
+            time_coefficient = tile(time_coefficient, len(voltage))
+            resolution = tile(resolution, len(voltage))
+        voltage, current = (voltage.ravel(), current.ravel())
+
+        spiked = flatnonzero(voltage > 30)
+        voltage[spiked] = c[spiked]
+        u[spiked] = u[spiked] + d[spiked]
+
+        for i in xrange(self.max_resolution):
+            live = flatnonzero((voltage <= 30) & (resolution > i))
+            if len(live) == 0: break
+            v = voltage[live]
+            delta_v = (0.04 * v * v) + (5*v) + 140 - u[live] + current[live]
+            voltage[live] = v + time_coefficient[live] * delta_v
+        u += a * ((b * voltage) - u)
+        return voltage.reshape(shape), u.reshape(shape)
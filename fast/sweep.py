@@ -0,0 +1,87 @@
+# Sweep
+#
+# A sweep runs many variants of one experiment, eg the same network with
+#     different synaptic strengths.  Building and warming up the network is
+#     often most of the cost of a run, so the model is built once, and each
+#     variant is run in a forked copy of the process.  Forked processes
+#     share the memory of the model until they write to it (copy-on-write),
+#     so no copy is made up front, and each variant starts from exactly the
+#     same state, including the random number generators.  The environment
+#     and populations of this package are plain numpy arrays, so every
+#     variant writes to its own copy of them.
+#
+# Each variant is passed to a run function, which applies the variant to the
+#     model (eg sets the enzyme concentration), steps it, and returns the
+#     results.  Results are pickled back to the main process, and yielded
+#     as the variants finish, while the remaining variants still run.
+#
+# Forking copies only the thread that forks, so frame drivers that prefetch
+#     in a background thread should be made by the run function.
+#     Components that write to files (eg stream recorders) are shared by
+#     all variants, so the run function should replace them too.
+
+from multiprocessing import Process, Queue, cpu_count
+from Queue import Empty
+from traceback import format_exc
+
+# Seconds to wait for a result before checking that the workers are alive.
+POLL = 1.0
+
+def sweep(model, run, variants, processes=None):
+    """
+    Calls |run|(model, variant) for each of the |variants|, each in a forked
+        copy of |model|, in at most |processes| processes at a time (the
+        number of CPUs by default).
+    Yields (variant, result) pairs in the order that the variants finish.
+    Raises a RuntimeError if a variant raises an exception, or if its
+        process exits without returning a result (eg if it is killed).
+    """
+    if processes is None: processes = cpu_count()
+    variants = list(variants)
+    results = Queue()
+
+    def work(index):
+        try:
+            results.put((index, True, run(model, variants[index])))
+        except Exception: results.put((index, False, format_exc()))
+
+    def collect():
+        """
+        Waits for the next result, checking that the workers are still alive
+            while none arrives.  A worker puts its result before it exits,
+            so a worker that exited without one is waited for once more.
+        """
+        while True:
+            try: return results.get(timeout=POLL)
+            except Empty:
+                dead = [index for index, worker in workers.iteritems()
+                    if not worker.is_alive()]
+                if len(dead) == 0: continue
+                try: return results.get(timeout=POLL)
+                except Empty:
+                    raise RuntimeError(
+                        "Variant %r exited with code %s without a result"
+                        % (variants[dead[0]], workers[dead[0]].exitcode))
+
+    workers = dict()
+    pending = iter(xrange(len(variants)))
+    try:
+        for index in pending:
+            workers[index] = Process(target=work, args=(index,))
+            workers[index].start()
+            if len(workers) == processes: break
+        while len(workers) > 0:
+            index, success, result = collect()
+            workers.pop(index).join()
+            if not success:
+                raise RuntimeError("Variant %r failed:\n%s"
+                    % (variants[index], result))
+            for next_index in pending:
+                workers[next_index] = Process(target=work, args=(next_index,))
+                workers[next_index].start()
+                break
+            yield variants[index], result
+    finally:
+        for worker in workers.itervalues():
+            worker.terminate()
+            worker.join()
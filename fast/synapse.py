@@ -3,91 +3,69 @@
 # The simple synapse does not simulate the axon, synaptic cleft, or dendrite.
 # Instead, it simply takes a voltage from the presynaptic neuron and provides
 #     a means of activating the postsynaptic neuron.
+#
+# Synapses are released in batches by the synapse matrix (see
+#     synapse_matrix.py), which reads delayed voltages from the delay line of
+#     the environment.  The delay line holds the voltage history of the
+#     presynaptic soma (|source_id|) of each synapse, in |column|.  Verbose
+#     synapses report their transmissions when they are released.
 
+from numpy import where, minimum
 from receptor import epsp
-from collections import deque
 
 class SpikingSynapse:
-    def __init__(self, receptor=epsp, delay=0, strength=1, environment=None, verbose=False):
+    spiking = True
+
+    def __init__(self, receptor=epsp, delay=0, strength=1, environment=None,
+                    source_id=None, verbose=False):
         self.receptor = receptor
-        self.delay = delay
+        self.delay = delay or 0
         self.strength = strength
         self.environment = environment
         self.verbose = verbose
         self.env_id = environment.register(0.0)
-
-        self.prev = False
-        if delay:
-            self.delay_queue = deque()
-            for _ in xrange(delay):
-                self.delay_queue.appendleft(-70.0)
-        else:
-            self.delay_queue = None
+        self.source_id = source_id
+        self.column = environment.delay_line.register(source_id, self.delay)
 
     def activate_dendrites(self, neuron):
         self.receptor(self.strength,
             self.environment.get(self.env_id),
             neuron)
 
-    def step(self, voltage):
-        # If there is a delay, use the queue.
-        try:
-            self.delay_queue.appendleft(voltage)
-            # Remove voltage from queue.
-            self.release(self.delay_queue.pop())
-        except AttributeError: 
-            self.release(voltage)
-
-    def release(self, voltage):
-        if voltage > 30:
-            self.environment.set(self.env_id, 1.0)
-            self.prev = True
-            if self.verbose: print("Spiking synapse transmit")
-        elif self.prev:
-            self.environment.set(self.env_id, 0.0)
-            self.prev = False
-
 class GradedSynapse:
-    def __init__(self, receptor=epsp, delay=0, strength=1, environment=None, verbose=False):
+    spiking = False
+
+    def __init__(self, receptor=epsp, delay=0, strength=1, environment=None,
+                    source_id=None, verbose=False):
         self.receptor = receptor
-        self.delay = delay
+        self.delay = delay or 0
         self.strength = strength
         self.environment = environment
         self.verbose = verbose
         self.env_id = environment.register(0.0)
-
-        if delay:
-            self.delay_queue = deque()
-            for _ in xrange(delay):
-                self.delay_queue.appendleft(-70.0)
-        else:
-            self.delay_queue = None
+        self.source_id = source_id
+        self.column = environment.delay_line.register(source_id, self.delay)
 
     def activate_dendrites(self, neuron):
         self.receptor(self.strength,
             self.environment.get(self.env_id),
             neuron)
 
-    def step(self, voltage):
-        # If there is a delay, use the queue.
-        try:
-            self.delay_queue.appendleft(voltage)
-            # Remove voltage from queue.
-            self.release(self.delay_queue.pop())
-        except AttributeError: self.release(voltage)
-
-    def release(self, voltage):
-        # Determine how many molecules to actually release.
-        threshold = -150.0
-        maximum = -82.0
-
-        # If the voltage is too low, don't release.
-        if voltage < threshold: released = 0.0
-        # Otherwise, compute release based on voltage.
-        else:
-            voltage = min(maximum, voltage)
-            released = (voltage - threshold) / (maximum - threshold)
+def spike_release(voltage):
+    """
+    Releases spiking synapses given an array of their delayed |voltage|.
+    Returns an array of synapse activations.
+    """
+    return where(voltage > 30, 1.0, 0.0)
 
-        self.environment.set(self.env_id, released)
-        if self.verbose:
-            if released > 0.0: print("Graded synapse transmit %f" % released)
+def graded_release(voltage):
+    """
+    Releases graded synapses given an array of their delayed |voltage|.
+    Returns an array of synapse activations.
+    """
+    # Release is proportional to the voltage between the threshold and the
+    #     maximum, and none is released below the threshold.
+    threshold = -150.0
+    maximum = -82.0
+    released = (minimum(maximum, voltage) - threshold) / (maximum - threshold)
+    return where(voltage < threshold, 0.0, released)
@@ -0,0 +1,206 @@
+# Synapse Matrix
+#
+# The synapse matrix computes the ligand current of every neuron at once.
+# Rows are postsynaptic neurons and columns are synapses.  Values are synapse
+#     strengths, signed according to the receptor type, so that the ligand
+#     current is a single sparse product with the synapse activations.
+#
+# Voltage gated receptors are held in a second matrix, whose rows are masked
+#     by the voltage of the postsynaptic neuron.
+# Receptors that cannot be expressed as a weight are activated one by one.
+#
+# The matrix also releases synapses in batches.  The voltages of stepped
+#     presynaptic somas are pushed into the delay line of the environment,
+#     and their delayed voltages are read back with a single lookup, and
+#     converted into activations according to the type of each synapse.
+#
+# Both operations can be restricted to a subset of neurons or synapses, so
+#     that the neuron factory only evaluates the parts of the network whose
+#     inputs have changed.
+#
+# In an ensemble, synapse strengths may differ between variants, so the
+#     weights are kept in a separate array with a row for each variant, in
+#     the order of the entries of the matrix, which only holds the structure.
+#     Currents and activations then have a row for each variant.
+
+from numpy import array, where, zeros, ones, arange, repeat, cumsum, \
+                  bincount, flatnonzero
+from scipy.sparse import csr_matrix
+from receptor import receptor_weight
+from synapse import spike_release, graded_release
+
+def segment_sums(counts, values):
+    """
+    Sums consecutive segments of each row of |values|, given the number of
+        entries in each segment (|counts|).
+    Returns an array with a row for each row of |values|.
+    """
+    ensemble, length = (len(values), len(counts))
+    segments = repeat(arange(length), counts)
+    if ensemble > 1:
+        segments = segments + (arange(ensemble) * length)[:, None]
+    return bincount(segments.ravel(), weights=values.ravel(),
+        minlength=ensemble * length).reshape(ensemble, length)
+
+def batched_matrix(environment, rows, columns, values, shape):
+    """
+    Builds a csr matrix of the given |shape| with entries at |rows| and
+        |columns|, and batches their |values| (see Environment.batch).
+    Returns the matrix and the batched values, in the order of the entries
+        of the matrix.
+    """
+    matrix = csr_matrix((arange(len(values), dtype=float), (rows, columns)),
+        shape=shape)
+    return matrix, environment.batch(values)[:, matrix.data.astype(int)]
+
+def row_entries(matrix, rows):
+    """
+    Returns the positions of the entries of |rows| in the data and indices
+        arrays of a csr |matrix|, in order, and the number of entries in
+        each row.  This avoids building a sliced matrix.
+    """
+    starts = matrix.indptr[rows]
+    counts = matrix.indptr[rows+1] - starts
+    ends = cumsum(counts)
+    positions = arange(ends[-1] if len(ends) else 0) \
+        + repeat(starts - (ends - counts), counts)
+    return positions, counts
+
+class SynapseMatrix:
+    def __init__(self, neurons, environment, size=None):
+        """
+        Builds the matrix from the input synapses of |neurons|, which must
+            be ordered by neuron_id.
+        There is a row for each of the |size| neurons of the network, by
+            default one for each of the |neurons|, so that neurons without
+            synapses can be left out.
+        Synapse activations are read from the |environment|.
+        """
+        self.environment = environment
+        self.irregular = []
+
+        env_ids = []
+        rows, columns, values = ([], [], [])
+        gated_rows, gated_columns, gated_values = ([], [], [])
+        for neuron in neurons:
+            for synapse in neuron.in_synapses:
+                weight = receptor_weight(synapse.receptor, synapse.strength)
+                if weight is None:
+                    if environment.ensemble > 1:
+                        raise ValueError("Irregular receptors cannot be "
+                            "simulated in an ensemble")
+                    self.irregular.append((neuron, synapse))
+                    continue
+
+                weight, voltage_gated = weight
+                if voltage_gated:
+                    gated_rows.append(neuron.neuron_id)
+                    gated_columns.append(len(env_ids))
+                    gated_values.append(weight)
+                else:
+                    rows.append(neuron.neuron_id)
+                    columns.append(len(env_ids))
+                    values.append(weight)
+                env_ids.append(synapse.env_id)
+
+        if size is None: size = len(neurons)
+        shape = (size, len(env_ids))
+        self.env_ids = array(env_ids, dtype=int)
+        self.matrix, self.weights = batched_matrix(environment,
+            rows, columns, values, shape)
+        self.gated_matrix, self.gated_weights = batched_matrix(environment,
+            gated_rows, gated_columns, gated_values, shape)
+        self.voltage_gated = len(gated_values) > 0
+
+        # Output synapses, for release.
+        synapses = [synapse for neuron in neurons
+                        for synapse in neuron.out_synapses]
+        self.release_env_ids = array(
+            [synapse.env_id for synapse in synapses], dtype=int)
+        self.columns = array([synapse.column for synapse in synapses], dtype=int)
+        self.delays = array([synapse.delay for synapse in synapses], dtype=int)
+        self.spiking = array([synapse.spiking for synapse in synapses], dtype=bool)
+        self.verbose = array([synapse.verbose for synapse in synapses], dtype=bool)
+
+        # Rows are environment ids of presynaptic somas, and columns are the
+        #     output synapses that read them.
+        sources = [synapse.source_id for synapse in synapses]
+        self.source_matrix = csr_matrix(
+            (ones(len(sources)), (sources, arange(len(sources)))),
+            shape=(environment.size, len(sources)))
+
+    def ligand_current(self, voltage, rows):
+        """
+        Computes the ligand current of the neurons in |rows|, which must be
+            sorted, given an array of the |voltage| of each variant of each
+            of them.
+        """
+        current = self.row_products(self.matrix, self.weights, rows)
+        if self.voltage_gated:
+            current += where(voltage > -60.0, self.row_products(
+                self.gated_matrix, self.gated_weights, rows), 0.0)
+
+        # Activate irregular receptors individually.
+        for neuron,synapse in self.irregular:
+            i = rows.searchsorted(neuron.neuron_id)
+            if i == len(rows) or rows[i] != neuron.neuron_id: continue
+            neuron.ligand_current = 0.0
+            synapse.activate_dendrites(neuron)
+            current[:, i] += neuron.ligand_current
+        return current
+
+    def row_products(self, matrix, weights, rows):
+        """
+        Multiplies the given |rows| of |matrix|, whose entries have the given
+            |weights|, with the synapse activations.
+        Only the activations of synapses in those rows are read.
+        """
+        positions, counts = row_entries(matrix, rows)
+        if len(positions) == 0:
+            return zeros((self.environment.ensemble, len(rows)))
+        activation = self.environment.get_many(
+            self.env_ids[matrix.indices[positions]])
+        return segment_sums(counts, weights.take(positions, axis=1) * activation)
+
+    def release(self, sources, voltage, mask=None):
+        """
+        Pushes the |voltage| of the presynaptic somas with env_ids |sources|
+            into the delay line, and releases their output synapses according
+            to their delayed voltage.  The |voltage| has a row for each
+            variant, and only the variants in the boolean |mask| are pushed
+            and released, or all of them if it is None.
+        """
+        positions, counts = row_entries(self.source_matrix, sources)
+        if len(positions) == 0: return
+        synapses = self.source_matrix.indices[positions]
+
+        # Push each source once, into the column of its first synapse.
+        pushed = flatnonzero(counts)
+        first = self.source_matrix.indices[
+            self.source_matrix.indptr[sources[pushed]]]
+        delay_line = self.environment.delay_line
+        delay_line.push(self.columns[first], voltage[:, pushed],
+            None if mask is None else mask[:, pushed])
+
+        delayed = delay_line.get(self.columns[synapses], self.delays[synapses])
+        released = where(self.spiking[synapses],
+            spike_release(delayed), graded_release(delayed))
+        if mask is not None: mask = mask[:, repeat(arange(len(sources)), counts)]
+        if self.verbose.any(): self.report(synapses, released, mask)
+
+        env_ids = self.release_env_ids[synapses]
+        if mask is not None:
+            released = where(mask, released, self.environment.get_many(env_ids))
+        self.environment.set_many(env_ids, released)
+
+    def report(self, synapses, released, mask=None):
+        """
+        Prints the transmissions of the verbose |synapses|, given their
+            |released| activations, in the variants in the boolean |mask|.
+        """
+        transmitted = released > 0.0
+        if mask is not None: transmitted &= mask
+        for variant, i in zip(*transmitted.nonzero()):
+            if not self.verbose[synapses[i]]: continue
+            if self.spiking[synapses[i]]: print("Spiking synapse transmit")
+            else: print("Graded synapse transmit %f" % released[variant, i])
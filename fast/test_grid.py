@@ -6,7 +6,8 @@ from numpy import array
 
 from neuron import NeuronTypes
 from neuron_factory import NeuronFactory
-from tools import ConstantDriver
+from tools import DriverSchedule
+from frames import FrameDriver, open_frames, luminance
 
 import matplotlib.image as mpimg
 
@@ -36,9 +37,10 @@ def test_grid(
         #image=random_image):
         #image=graded_image):
         #image=random_row):
-        image=lum_img):
-        #image=light_image):
-        #image=dark_image):
+        image=lum_img,
+        #image=light_image,
+        #image=dark_image,
+        frames=None):
     height = len(image)
     width = len(image[0])
 
@@ -49,16 +51,20 @@ def test_grid(
 
     neuron_data = []
 
-    # Create drivers and Connect ganglion cells.
+    # Connect ganglion cells.
     for i in xrange(height):
         #print(image[i][:width])
         for j in xrange(width):
             neuron_factory.create_synapse(photoreceptor_grid[i][j], ganglion_grid[i][j],
                 strength=100)
-            neuron_factory.register_driver(
-                photoreceptor_grid[i][j],
-                ConstantDriver(current=-image[i][j]*255, delay=10))
-            #print(image[i][j]*255)
+
+    # Drive the photoreceptors with the image, or with the frames.
+    if frames is None:
+        neuron_factory.register_schedule(DriverSchedule(photoreceptor_grid,
+            -array(image, dtype=float)*255, onset=10))
+    else:
+        neuron_factory.register_schedule(FrameDriver(photoreceptor_grid,
+            frames, interval=args.interval, gain=-255, onset=10))
 
     for _ in xrange(args.iterations):
         neuron_factory.step()
@@ -72,16 +78,7 @@ def test_grid(
         #print(d)
     '''
 
-    ganglion_activity = []
-    for row in ganglion_grid:
-        #for neuron in row:
-        #    plot([("ganglion", neuron.get_record())])
-        d = [neuron.get_record(spikes=True) for neuron in row]
-        #print([x for x in row[0].get_record()])
-        ganglion_activity.append(d)
-
-        #for neuron in row:
-        #    ganglion_activity.append(neuron.get_record())
+    ganglion_activity = ganglion_grid.spike_counts().tolist()
 
     maximum = max(max(row) for row in ganglion_activity)
     minimum = min(max(row) for row in ganglion_activity)
@@ -107,7 +104,11 @@ def test_grid(
     '''
 
 def main():
-    test_grid()
+    if args.frames is None:
+        test_grid()
+    else:
+        # The first frame sets the size of the grid.
+        test_grid(luminance(next(open_frames(args.frames))), args.frames)
 
 def set_options():
     """
@@ -121,6 +122,10 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 50, help = 
     """table""")
+    parser.add_argument("-f", "--frames", type = str, default = None, help = 
+    """directory of images or .npy video to show instead of the image""")
+    parser.add_argument("-n", "--interval", type = int, default = 10, help = 
+    """timesteps between frames""")
 
     return parser.parse_args()
 
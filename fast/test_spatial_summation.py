@@ -9,7 +9,13 @@ from tools import PulseDriver
 def spatial_summation(num_pre = 3):
     data = []
 
-    neuron_factory = NeuronFactory()
+    # An ensemble simulates a variant for each synapse strength.
+    if args.ensemble > 1:
+        strength = [5 + 15.0 * i / (args.ensemble - 1)
+            for i in xrange(args.ensemble)]
+    else: strength = 10
+
+    neuron_factory = NeuronFactory(ensemble=args.ensemble)
     post_neuron = neuron_factory.create_neuron(record=True)
 
     pre_neurons = []
@@ -21,7 +27,7 @@ def spatial_summation(num_pre = 3):
         pre_neurons.append(pre_neuron)
 
         synapse = neuron_factory.create_synapse(pre_neuron, post_neuron,
-            strength=10, delay=5)
+            strength=strength, delay=5)
 
         neuron_factory.register_driver(pre_neuron,
             PulseDriver(current=100, period=100*(i+1),
@@ -32,8 +38,11 @@ def spatial_summation(num_pre = 3):
     #print("Saved %d out of %d cycles." % (neuron_factory.stable_count, neuron_factory.time))
 
     for pre_neuron in pre_neurons:
-        data.append(("Pre", pre_neuron.get_record()))
-    data.append(("Post", post_neuron.get_record()))
+        data.append(("Pre", pre_neuron.get_record(variant=0)))
+    if args.ensemble > 1:
+        for i,record in enumerate(post_neuron.get_record()):
+            data.append(("Post (strength %.1f)" % strength[i], record))
+    else: data.append(("Post", post_neuron.get_record()))
     if not args.silent:
         plot(data, title="Spatial summation test")
 
@@ -52,6 +61,8 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 1000, help = 
     """table""")
+    parser.add_argument("-e", "--ensemble", type = int, default = 1, help = 
+    """number of synapse strengths to simulate at once""")
 
     return parser.parse_args()
 
@@ -1,11 +1,16 @@
 import argparse
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from plot import plot
 
-from neuron import Neuron
+from neuron import Neuron, NeuronTypes
 from soma import Soma
 from neuron_factory import NeuronFactory
-from tools import PulseDriver
+from recorder import StreamRecorder
+from tools import PulseDriver, ConstantDriver
+from checkpoint import checkpoint, restore
 
 def transmit(strength=0.25, delays=[None, 100]):
     data = []
@@ -39,9 +44,119 @@ def transmit(strength=0.25, delays=[None, 100]):
             data.append(("Post neuron", post_neuron.get_record()))
         plot(data, title="Synaptic transmission")
 
+def check_spikes(spikes, pre_neuron, post_neuron, added, window=100):
+    # The spike events must agree with the recorded voltages.  The post
+    #     neuron was |added| late, so its record starts then, and its rate
+    #     over a window starting earlier only counts the timesteps since.
+    pre_id, post_id = (pre_neuron.soma.env_id, post_neuron.soma.env_id)
+    pre_times = [time for time,voltage in enumerate(pre_neuron.get_record())
+        if voltage >= spikes.threshold]
+    post_times = [added + time
+        for time,voltage in enumerate(post_neuron.get_record())
+            if voltage >= spikes.threshold]
+    if spikes.spike_times(pre_id).tolist() != pre_times \
+            or spikes.spike_times(post_id).tolist() != post_times:
+        raise AssertionError("Spike times do not match the voltages")
+
+    start, stop = (added - window, added + window)
+    pre_window = [time for time in pre_times if start <= time < stop]
+    post_window = [time for time in post_times if start <= time < stop]
+    if len(pre_window) == 0 or len(post_window) == 0:
+        raise AssertionError("No spikes around the late neuron")
+    times, rows = spikes.raster(start, stop)
+    raster = sorted(zip(times.tolist(), spikes.env_ids[rows].tolist()))
+    if raster != sorted([(time, pre_id) for time in pre_window]
+                      + [(time, post_id) for time in post_window]):
+        raise AssertionError("Raster does not match the spike times")
+
+    rates = spikes.rates(start, stop)
+    if rates[spikes.columns[pre_id]] != len(pre_window) / float(stop - start) \
+            or rates[spikes.columns[post_id]] != \
+                len(post_window) / float(stop - added):
+        raise AssertionError("Rates do not match the spike times")
+
+def late_neuron(strength=100, recorder=None):
+    # Recorded neurons added to a running network are recorded from the
+    #     timestep they were added on.
+    neuron_factory = NeuronFactory(recorder=recorder)
+    pre_neuron = neuron_factory.create_neuron(record=True)
+    neuron_factory.register_driver(pre_neuron,
+        PulseDriver(current=strength, period=100, length=1, delay=25))
+    neuron_factory.step(args.iterations / 2)
+
+    post_neuron = neuron_factory.create_neuron(record=True)
+    neuron_factory.create_synapse(pre_neuron, post_neuron, strength=strength)
+    graded_neuron = neuron_factory.create_neuron(record=True,
+        neuron_type=NeuronTypes.PHOTORECEPTOR)
+    neuron_factory.create_synapse(pre_neuron, graded_neuron, strength=strength)
+    neuron_factory.step(args.iterations - args.iterations / 2)
+    neuron_factory.close()
+
+    print("Spikes: pre neuron %d, late post neuron %d" % (
+        pre_neuron.get_record(spikes=True),
+        post_neuron.get_record(spikes=True)))
+    check_spikes(neuron_factory.environment.spikes, pre_neuron, post_neuron,
+        args.iterations / 2)
+    if not args.silent and recorder is None:
+        plot([("Pre neuron", pre_neuron.get_record()),
+              ("Late post neuron", post_neuron.get_record()),
+              ("Late graded neuron", graded_neuron.get_record())],
+            title="Late neuron")
+    return list(graded_neuron.get_record())
+
+def stream_late_neuron(record):
+    # A stream recorder starts a new segment for the late neurons, and must
+    #     match the |record| kept in memory.
+    directory = mkdtemp()
+    try:
+        stream_record = late_neuron(
+            recorder=StreamRecorder(join(directory, "late.dat"), chunk=64))
+    finally: rmtree(directory)
+    if stream_record != record:
+        raise AssertionError("Stream recorder does not match memory")
+
+def resume(current=10, delay=90):
+    # The driver is still waiting out its delay when the checkpoint is
+    #     taken, so the restored driver must be waiting too, and switch
+    #     itself over to driving the neuron once the delay has passed.
+    records = []
+    for interrupted in (False, True):
+        neuron_factory = NeuronFactory()
+        pre_neuron = neuron_factory.create_neuron(record=True)
+        post_neuron = neuron_factory.create_neuron(record=True)
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            delay=delay, strength=100)
+        neuron_factory.register_driver(pre_neuron,
+            ConstantDriver(current=current, delay=args.iterations * 3 / 4))
+        neuron_factory.step(args.iterations / 2)
+
+        if interrupted:
+            directory = mkdtemp()
+            try:
+                path = join(directory, "transmit.checkpoint")
+                checkpoint(neuron_factory, path)
+                neuron_factory = restore(path)
+            finally: rmtree(directory)
+            pre_neuron, post_neuron = neuron_factory.neurons
+            driver = neuron_factory.drivers[None]
+            if driver.drive.im_self is not driver:
+                raise AssertionError("Driver is bound to another driver")
+
+        neuron_factory.step(args.iterations - args.iterations / 2)
+        records.append([list(pre_neuron.get_record()),
+                        list(post_neuron.get_record())])
+
+    if records[0] != records[1]:
+        raise AssertionError("Restored run does not match")
+    if not pre_neuron.get_record(spikes=True):
+        raise AssertionError("Driver did not drive the neuron")
+    print("Restored run matches the uninterrupted run.")
+
 def main():
     #transmit(strength = -0.5)
     transmit(strength = 100, delays=[10])
+    stream_late_neuron(late_neuron())
+    if args.checkpoint: resume()
     #transmit(strength = 0.1, delays=[None])
 
 def set_options():
@@ -56,6 +171,9 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 1000, help = 
     """table""")
+    parser.add_argument("-c", "--checkpoint", action = "store_true", help = 
+    """checkpoint halfway through, and compare the restored run with an
+    uninterrupted one""")
 
     return parser.parse_args()
 
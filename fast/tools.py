@@ -1,7 +1,23 @@
 # Drivers can be added to activate particular neurons at each timestep.
+#     A driver returns the next time it needs to be driven, or None if it
+#     will not change the neuron again, so that the neuron factory only
+#     calls it when something happens.
 # 
 # Probes can be added to any component to take measurements of voltage, current,
 #     or concentration over the course of the simulation.
+#
+# A driver schedule drives many neurons at once, such as a grid of
+#     photoreceptors showing an image.  Instead of a driver object for each
+#     neuron, it keeps a table with a row for each neuron, holding the onset,
+#     period, length, and amplitude of its pulses, and evaluates every row
+#     with array operations.  Changed currents are written directly into the
+#     external currents of the neuron factory.
+
+from numpy import array, asarray, where, minimum, maximum, flatnonzero
+from environment import scatter
+from population import NeuronGrid
+
+NEVER = 2**62
 
 class ConstantDriver:
     def __init__(self, current=0.0, delay=0):
@@ -13,6 +29,7 @@ class ConstantDriver:
         if time-self.delay >= 0:
             self.drive = self.postdelay
             neuron.set_external_current(self.current)
+        else: return self.delay
 
     def postdelay(self, neuron, time):
         pass
@@ -35,3 +52,91 @@ class PulseDriver:
         elif time % self.period == self.length:
             neuron.set_external_current(0.0)
             if self.record: self.data.append(-0.3)
+        return self.delay + self.next_change(time)
+
+    def next_change(self, time):
+        """
+        Returns the first time after |time| (relative to the delay) at which
+            the pulse turns on or off.
+        """
+        start = max(time+1, 0)
+        on = start + (-start % self.period)
+        if 0 <= self.length < self.period:
+            off = time + 1 + ((self.length - time - 1) % self.period)
+            return min(on, off)
+        return on
+
+class DriverSchedule:
+    def __init__(self, neurons, amplitude, onset=0, period=0, length=-1):
+        """
+        Drives the |neurons|, which are a list, a grid (list of rows), or a
+            NeuronGrid (see population.py), with pulses of |amplitude|
+            current, starting at |onset|, and repeating every |period|
+            timesteps.  Pulses last |length| timesteps, after which the
+            current is set to 0.0.
+        Without a |period|, there is a single pulse.  Without a |length|, or
+            with a length of at least the period, the current stays on.
+        Each parameter is a single value or an array (eg an image) with a
+            value for each neuron.  The |amplitude| may also have a leading
+            dimension with a value for each variant of an ensemble.
+        """
+        if isinstance(neurons, NeuronGrid):
+            self.neuron_ids = neurons.neuron_ids.ravel()
+        else:
+            if len(neurons) > 0 and isinstance(neurons[0], list):
+                neurons = [neuron for row in neurons for neuron in row]
+            self.neuron_ids = array([neuron.neuron_id for neuron in neurons],
+                dtype=int)
+        size = len(self.neuron_ids)
+
+        amplitude = asarray(amplitude, dtype=float)
+        if amplitude.size == size: amplitude = amplitude.reshape(size)
+        elif amplitude.ndim > 0: amplitude = amplitude.reshape(-1, size)
+        self.amplitude = amplitude
+
+        def column(values):
+            values = asarray(values, dtype=int)
+            if values.ndim == 0: return values.repeat(size)
+            return values.reshape(size)
+
+        self.onset = column(onset)
+        self.period = column(period)
+        self.length = column(length)
+        self.periodic = self.period > 0
+        self.moduli = where(self.periodic, self.period, 1)
+        self.pulsed = (self.length >= 0) & \
+            (~self.periodic | (self.length < self.period))
+
+    def drive(self, external_current, time):
+        """
+        Sets the |external_current| of the neurons whose current changes at
+            |time|, which is a batched array indexed by neuron id.
+        Returns the next time that a current changes (None if none will),
+            and the ids of the neurons whose current changed.
+        """
+        elapsed = time - self.onset
+        phase = where(self.periodic, elapsed % self.moduli, elapsed)
+        on = (elapsed >= 0) & (phase == 0)
+        off = (elapsed >= 0) & self.pulsed & (phase == self.length) & ~on
+        changed = flatnonzero(on | off)
+        if len(changed) > 0:
+            current = where(on, self.amplitude, 0.0)
+            scatter(external_current, self.neuron_ids[changed],
+                current[..., changed])
+        return self.next_change(time), self.neuron_ids[changed]
+
+    def next_change(self, time):
+        """
+        Returns the first time after |time| at which a current changes, or
+            None if none will.
+        """
+        elapsed = time - self.onset
+        start = maximum(elapsed + 1, 0)
+        on = where(self.periodic, start + (-start % self.moduli),
+            where(elapsed < 0, 0, NEVER))
+        off = where(self.periodic,
+            start + ((self.length - start) % self.moduli),
+            where(elapsed < self.length, self.length, NEVER))
+        change = minimum(on, where(self.pulsed, off, NEVER))
+        if len(change) == 0 or change.min() >= NEVER: return None
+        return int((self.onset + change).min())
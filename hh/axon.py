@@ -4,14 +4,15 @@
 #     neurotransmitters into and out of the synaptic cleft.
 
 from math import exp
-from collections import deque
 
 from molecule import Transporters
 from environment import betav
 
 class Axon:
     def __init__(self, transporter=Transporters.GLUTAMATE, reuptake_rate=0.5,
-                    capacity=1.0, replenish_rate=0.1, delay=None, verbose=False):
+                    capacity=1.0, replenish_rate=0.1, delay=None,
+                    environment=None, source_id=None, source_threshold=None,
+                    verbose=False):
         """
         Axons keep track of activation and release neurotransmitters over
             time.  Neurotransmitters are regenerated via reuptake and
@@ -23,6 +24,10 @@ class Axon:
         |capacity| is the neurotransmitter capacity in the axon vesicles.
         |replenish_rate| controls the regeneration of neurotransmitter 
             over time.  Higher values increase rate of restoration.
+        |delay| specifies how long it takes the axon to respond.  Delayed
+            voltages of the presynaptic soma |source_id| are read from the
+            delay line of the neuron |environment|, and are ignored if they
+            are below the |source_threshold| of the presynaptic neuron.
         """
         # Initialize as pool cluster
         self.protein = transporter
@@ -35,14 +40,13 @@ class Axon:
         self.replenish_rate = replenish_rate
         baseline_voltage = -65.0
 
-        self.delay = delay
-        if delay:
-            self.voltage_queue = deque()
-            for _ in xrange(delay):
-                self.voltage_queue.appendleft(baseline_voltage)
-        else:
-            self.voltage_queue = None
-            self.voltage = baseline_voltage
+        self.voltage = baseline_voltage
+
+        self.delay = delay or 0
+        self.environment = environment
+        self.source_threshold = source_threshold
+        if self.delay:
+            self.column = environment.delay_line.register(source_id, self.delay)
 
         self.verbose = verbose
         self.releasing = False
@@ -66,12 +70,10 @@ class Axon:
         Returns whether the axon is stable (not releasing). This is used by the
             neuron to determine if the synapse should be activated.
         """
-        # If there is a delay, use the queue.
-        if self.delay is not None:
-            # Add voltage to queue
-            self.voltage_queue.appendleft(voltage)
-            # Remove voltage from queue
-            voltage = self.voltage_queue.pop()
+        # If there is a delay, read the voltage from the delay line.
+        if self.delay:
+            voltage = self.environment.delay_line.get(self.column, self.delay)
+            if voltage < self.source_threshold: voltage = None
 
         if voltage:
             self.voltage = voltage
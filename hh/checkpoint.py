@@ -0,0 +1,67 @@
+# Checkpoint
+#
+# A checkpoint saves all of the dynamic state of a neuron factory into a
+#     single binary file, so that a simulation can be resumed later, or
+#     several experiments can be branched from one warmed up state.
+#     Restoring a checkpoint rebuilds the factory as it was, without
+#     constructing the network or stepping it again.
+#
+# The file starts with a magic string and a format version, followed by the
+#     pickled factory and the states of the random number generators.
+#     Without workers, the factory keeps its environments and delay line in
+#     numpy arrays, and the external activations and bound concentrations
+#     in ctypes values (see shared.py), which all pickle by value.  The
+#     exception is the constant driver, which keeps the bound method for its
+#     current phase.  Bound methods are saved by name as persistent ids, and
+#     looked up on the restored driver.
+#
+# Factories with worker processes cannot be checkpointed, because the state
+#     of their neurons lives in the workers.
+
+import cPickle, random
+import numpy.random
+from types import MethodType
+
+MAGIC = "NEUROTRANSMISSION CHECKPOINT"
+VERSION = 1
+
+def persistent_id(obj):
+    """
+    Saves bound methods as their instance and name.
+    """
+    if isinstance(obj, MethodType) and obj.im_self is not None:
+        return (obj.im_self, obj.im_func.__name__)
+
+def persistent_load(pid):
+    instance, name = pid
+    return getattr(instance, name)
+
+def checkpoint(factory, path):
+    """
+    Saves the state of the neuron |factory| to the file at |path|.
+    """
+    if getattr(factory, "multithreaded", False):
+        raise ValueError("Cannot checkpoint a factory with workers")
+    with open(path, "wb") as f:
+        f.write("%s %d\n" % (MAGIC, VERSION))
+        pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump((factory, random.getstate(), numpy.random.get_state()))
+
+def restore(path):
+    """
+    Restores a neuron factory from the checkpoint file at |path|.
+    The random number generators are restored as well.
+    """
+    with open(path, "rb") as f:
+        header = f.readline().split()
+        if " ".join(header[:-1]) != MAGIC:
+            raise ValueError("%s is not a checkpoint" % path)
+        if int(header[-1]) != VERSION:
+            raise ValueError("Unsupported checkpoint version %s" % header[-1])
+        unpickler = cPickle.Unpickler(f)
+        unpickler.persistent_load = persistent_load
+        factory, random_state, numpy_state = unpickler.load()
+    random.setstate(random_state)
+    numpy.random.set_state(numpy_state)
+    return factory
@@ -0,0 +1,80 @@
+# Delay Line
+#
+# The delay line holds a history of presynaptic voltages, so that axons with a
+#     delay can read the voltage from |delay| steps of their neuron ago with a
+#     single array lookup, rather than each keeping its own queue.
+#
+# A neuron steps its axons on each timestep on which it is stepped, and pushes
+#     its voltage into the delay line first.  The history of each source
+#     (presynaptic soma) is a ring buffer, indexed by the number of pushes of
+#     that source modulo the depth of the buffer, which is one more than the
+#     longest registered delay.  While a neuron is not stepped, nothing is
+#     pushed, so its history is frozen, like the queues of individual axons
+#     were.  Memory grows with the number of source neurons, not the number
+#     of synapses.
+#
+# Sources must be registered before the delay line is initialized.  With
+#     worker processes, the buffer and the push counts are then moved into
+#     shared memory, so that the worker process stepping a neuron pushes and
+#     reads its history.
+
+from numpy import full, zeros
+from shared import shared_copy
+
+class DelayLine:
+    def __init__(self, baseline=-70.0):
+        """
+        Creates an empty delay line.
+        Values that have not been pushed yet are the |baseline| voltage.
+        """
+        self.baseline = baseline
+        self.sources = []
+        self.columns = dict()
+        self.depth = 1
+        self.buffer = None
+
+    def register(self, source_id, delay=0):
+        """
+        Registers a reader of |source_id| with the given |delay|.
+        Returns the column of the source in the buffer.
+        """
+        if self.buffer is not None:
+            raise RuntimeError("Cannot register with an initialized delay line")
+        if delay < 0: raise ValueError
+        self.depth = max(self.depth, delay+1)
+        try: return self.columns[source_id]
+        except KeyError:
+            column = len(self.sources)
+            self.columns[source_id] = column
+            self.sources.append(source_id)
+            return column
+
+    def initialize(self):
+        """
+        Allocates the buffer and push counts.
+        """
+        width = len(self.sources)
+        self.buffer = full((self.depth, width), self.baseline)
+        self.heads = zeros(width, dtype=int)
+
+    def share(self):
+        """
+        Moves the buffer and push counts into shared memory.
+        """
+        self.buffer = shared_copy(self.buffer)
+        self.heads = shared_copy(self.heads)
+
+    def push(self, column, value):
+        """
+        Pushes the current |value| of the source in |column|.
+        """
+        head = self.heads[column] + 1
+        self.heads[column] = head
+        self.buffer[head % self.depth, column] = value
+
+    def get(self, column, delay):
+        """
+        Returns the value of the source in |column| from |delay| pushes ago.
+            Both may be arrays.
+        """
+        return self.buffer[(self.heads[column] - delay) % self.depth, column]
@@ -12,15 +12,30 @@
 #     After registering, the neuron should stabilize its voltage and set it.
 #
 # An array is kept for previous and next values to avoid race conditions.
-#     When a timestep is run, the buffers shift.
+#     Both are rows of one array, and a shared index selects which row holds
+#     the previous values, so that a timestep swaps the buffers by flipping
+#     the index.  Worker processes see the swap without copying anything.
 # Values are retrieved from the pervious array and set to the next array.
 #
-# All concentration/voltage and dirty values are thread safe.
-# To speed them up, the locks are disabled.  There should be no instances of
-#     multiple threads trying to change a value.
+# Writes also mark their slot in a dirty array.  After the swap, only the
+#     dirty slots are copied back into the next buffer, which still holds
+#     their old values.  The dirty array is a flag per slot rather than a
+#     list of indices so that processes can mark slots without a lock.
+#
+# All concentration/voltage and dirty values are thread safe once shared
+#     with worker processes (see shared.py).  To speed them up, the locks are
+#     disabled.  There should be no instances of multiple threads trying to
+#     change a value.
+#
+# The neuron environment also holds the delay line, which keeps a history of
+#     the voltages that delayed sources (presynaptic somas) passed to their
+#     axons.
 
 from random import betavariate
-from multiprocessing import Value, Array
+from ctypes import c_byte
+from numpy import array, empty, zeros, ones, flatnonzero, int8
+from delay_line import DelayLine
+from shared import shared_copy, shared_value
 
 def betav(maximum, noise=0.5, rate=1.0):
     if rate < 0.0 or noise < 0.0: raise ValueError
@@ -31,46 +46,59 @@ def betav(maximum, noise=0.5, rate=1.0):
 
 class SynapseEnvironment:
     def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+        self.noise = noise
+
+        self.initial_concentrations = []
 
-        self.prev_concentrations = []
-        self.next_concentrations = []
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
 
     def initialize(self):
-        # Create thread safe arrays.
-        self.prev_concentrations = Array('d', self.prev_concentrations, lock=False)
-        self.next_concentrations = Array('d', self.next_concentrations, lock=False)
-        self.dirty = Value('b', True, lock=False)
-        
+        size = len(self.initial_concentrations)
+        self.concentrations = empty((2, size))
+        self.concentrations[:] = self.initial_concentrations
+        self.dirty = ones(size, dtype=int8)
+        self.prev = c_byte(0)
+
+    def share(self):
+        """
+        Moves the buffers into shared memory, for worker processes.
+        """
+        try: self.dirty
+        except: self.initialize()
+        self.concentrations = shared_copy(self.concentrations)
+        self.dirty = shared_copy(self.dirty)
+        self.prev = shared_value(self.prev)
+
     def register(self, baseline_concentration):
-        pool_id = len(self.prev_concentrations)
-        self.prev_concentrations.append(baseline_concentration)
-        self.next_concentrations.append(baseline_concentration)
+        pool_id = len(self.initial_concentrations)
+        self.initial_concentrations.append(baseline_concentration)
         return pool_id
 
     def get_concentration(self, pool_id):
         try: self.dirty
         except: self.initialize()
-        return self.prev_concentrations[pool_id]
+        return self.concentrations.item(self.prev.value, pool_id)
 
     def set_concentration(self, pool_id, new_concentration):
-        try: self.dirty.value = True
+        try: self.dirty
         except: self.initialize()
-        self.next_concentrations[pool_id] = new_concentration
+        self.dirty[pool_id] = True
+        self.concentrations[1 - self.prev.value, pool_id] = new_concentration
 
     def add_concentration(self, pool_id, molecules):
-        try: self.dirty.value = True
+        try: self.dirty
         except: self.initialize()
-        self.next_concentrations[pool_id] += molecules
+        self.dirty[pool_id] = True
+        self.concentrations[1 - self.prev.value, pool_id] += molecules
 
     def remove_concentration(self, pool_id, molecules):
-        try: self.dirty.value = True
+        try: self.dirty
         except: self.initialize()
-        self.next_concentrations[pool_id] -= molecules
-        self.next_concentrations[pool_id] = \
-            max(0.0, self.next_concentrations[pool_id])
+        self.dirty[pool_id] = True
+        row = 1 - self.prev.value
+        self.concentrations[row, pool_id] = \
+            max(0.0, self.concentrations.item(row, pool_id) - molecules)
 
     def step(self):
         """
@@ -79,52 +107,97 @@ class SynapseEnvironment:
         """
         try: self.dirty
         except: self.initialize()
-        if self.dirty.value:
-            self.dirty.value = False
-            for i in xrange(len(self.prev_concentrations)):
-                self.prev_concentrations[i]=self.next_concentrations[i]
+        dirty = flatnonzero(self.dirty)
+        if len(dirty) > 0:
+            # Swap the buffers, and copy the dirty slots back into the next
+            #     buffer, which still holds their old values.
+            prev = self.prev.value
+            self.prev.value = 1 - prev
+            self.concentrations[prev, dirty] = \
+                self.concentrations[1 - prev, dirty]
+            self.dirty[dirty] = False
             return False
         else: return True
 
 class NeuronEnvironment:
     def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+        self.noise = noise
 
-        self.prev_voltages = []
-        self.next_voltages = []
-        self.dirty = Value('b', True, lock=False)
+        self.size = 0
+        self.voltages = empty((2, 0))
+        self.dirty = zeros(0, dtype=int8)
+        self.prev = c_byte(0)
+        self.delay_line = DelayLine(baseline=-65.0)
+
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
 
     def initialize(self):
-        # Create thread safe arrays.
-        self.prev_voltages = Array('d', self.prev_voltages, lock=False)
-        self.next_voltages = Array('d', self.next_voltages, lock=False)
+        # Trim the buffers to the registered neurons.
+        self.voltages = self.voltages[:, :self.size].copy()
+        self.dirty = self.dirty[:self.size].copy()
+        self.delay_line.initialize()
+
+    def share(self):
+        """
+        Moves the buffers into shared memory, for worker processes.
+        """
+        self.voltages = shared_copy(self.voltages)
+        self.dirty = shared_copy(self.dirty)
+        self.prev = shared_value(self.prev)
+        self.delay_line.share()
+
+    def resize(self, capacity):
+        """
+        Reallocates the buffers to hold |capacity| voltages.
+        """
+        voltages = empty((2, capacity))
+        voltages[:, :self.size] = self.voltages[:, :self.size]
+        self.voltages = voltages
+        dirty = zeros(capacity, dtype=int8)
+        dirty[:self.size] = self.dirty[:self.size]
+        self.dirty = dirty
 
     def register(self, baseline_voltage=0.0):
-        neuron_id = len(self.prev_voltages)
-        self.prev_voltages.append(baseline_voltage)
-        self.next_voltages.append(baseline_voltage)
+        neuron_id = self.size
+        if neuron_id == self.voltages.shape[1]:
+            self.resize(max(16, 2 * neuron_id))
+        self.size += 1
+        self.voltages[:, neuron_id] = baseline_voltage
+        self.dirty[neuron_id] = True
         return neuron_id
 
     def get_voltage(self, neuron_id):
-        return self.prev_voltages[neuron_id]
+        return self.voltages.item(self.prev.value, neuron_id)
+
+    def get_voltages(self, neuron_ids):
+        return self.voltages[self.prev.value, neuron_ids]
 
     def set_voltage(self, neuron_id, new_voltage):
-        self.next_voltages[neuron_id] = new_voltage
+        self.dirty[neuron_id] = True
+        self.voltages[1 - self.prev.value, neuron_id] = new_voltage
 
     def adjust_voltage(self, neuron_id, delta):
-        self.dirty.value = True
-        self.next_voltages[neuron_id] += delta
+        self.dirty[neuron_id] = True
+        self.voltages[1 - self.prev.value, neuron_id] += delta
+
+    def adjust_voltages(self, neuron_ids, deltas):
+        self.dirty[neuron_ids] = True
+        self.voltages[1 - self.prev.value, neuron_ids] += deltas
 
     def step(self):
         """
         Cycles the environment.
         Returns whether the environment is stable (not dirty, no changes)
         """
-        if self.dirty.value:
-            self.dirty.value = False
-            for i in xrange(len(self.prev_voltages)):
-                self.prev_voltages[i]=self.next_voltages[i]
-            return False
-        else: return True
+        dirty = flatnonzero(self.dirty[:self.size])
+        if len(dirty) > 0:
+            # Swap the buffers, and copy the dirty slots back into the next
+            #     buffer, which still holds their old values.
+            prev = self.prev.value
+            self.prev.value = 1 - prev
+            self.voltages[prev, dirty] = self.voltages[1 - prev, dirty]
+            self.dirty[dirty] = False
+            stable = False
+        else: stable = True
+        return stable
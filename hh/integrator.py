@@ -0,0 +1,121 @@
+# Adaptive Integrator
+#
+# By default, a soma takes a single forward Euler step per timestep, with a
+#     timestep of 1 / resolution.  Euler steps are only accurate while the
+#     voltage changes slowly, so the resolution has to be high enough for the
+#     upstroke of a spike, even though most somas spend most timesteps near
+#     their stable voltage.
+#
+# An adaptive integrator instead crosses each timestep in as many substeps as
+#     the soma needs to stay within a tolerance.  Each substep is taken with
+#     Heun's method, and its difference from a forward Euler step of the same
+#     size estimates the error (an embedded Runge-Kutta pair of orders 2 and
+#     1).  A substep with too large an error is retried with a smaller size,
+#     and the size of the next substep is adjusted from the error.  Somas keep
+#     the size of their last substep, and start the next timestep with it,
+#     so that a spiking soma does not retry a whole timestep first.  A soma at
+#     rest crosses a timestep in one substep, while a spiking soma takes many
+#     small ones, so the resolution of a factory using an adaptive integrator
+#     can be lowered without losing the shape of its spikes.
+#
+# Errors are measured against a scale for each state variable, the change of
+#     that variable which is worth the tolerance.  Voltages are scaled in mV,
+#     and gating variables (which range from 0 to 1 while the voltage ranges
+#     over about 100 mV) by a hundredth.
+#
+# The integrator counts the substeps it takes in a histogram, with the number
+#     of timesteps that were crossed in each number of substeps, along with
+#     the number of rejected substeps.  Somas integrated in worker processes
+#     are counted by the copy of the integrator in their worker.
+
+from numpy import array, zeros, full, arange, maximum, minimum, sqrt, \
+                  absolute, bincount, flatnonzero
+
+class AdaptiveIntegrator:
+    def __init__(self, tolerance=0.01, max_substeps=1000):
+        """
+        Creates an integrator that keeps the estimated error of each substep
+            within |tolerance| (in mV of voltage), and takes at most about
+            |max_substeps| substeps per timestep.
+        """
+        self.tolerance = tolerance
+        self.max_substeps = max_substeps
+        self.counts = zeros(2, dtype=int)
+        self.rejected = 0
+
+    def integrate(self, derivative, state, scales, duration, sizes=None):
+        """
+        Advances |state|, a list of arrays with an element for each soma, by
+            |duration|.  |derivative|(state, somas) returns the rates of
+            change of a state holding only the given |somas|, which are
+            positions in the arrays.
+        |scales| are the error scales of the state variables.
+        |sizes| is an array of the substep sizes to start with for each soma,
+            which is updated with the sizes to start the next timestep with.
+            By default, each soma starts with the whole timestep.
+        Returns the new state, and an array of the substeps taken by each
+            soma.
+        """
+        state = [array(values, dtype=float) for values in state]
+        size = len(state[0])
+        duration = float(duration)
+        smallest = duration / self.max_substeps
+        remaining = full(size, duration)
+        if sizes is None: sizes = full(size, duration)
+        starts = minimum(sizes, duration)
+        substeps = zeros(size, dtype=int)
+        somas = arange(size)
+
+        while len(somas) > 0:
+            current = [values[somas] for values in state]
+            h = starts[somas]
+            first = derivative(current, somas)
+            euler = [values + h*rate for values,rate in zip(current, first)]
+            second = derivative(euler, somas)
+            heun = [values + 0.5*h*(a+b)
+                        for values,a,b in zip(current, first, second)]
+
+            error = zeros(len(somas))
+            for a,b,scale in zip(heun, euler, scales):
+                error = maximum(error, absolute(a-b) / scale)
+            error /= self.tolerance
+
+            # Substeps that are already as small as allowed are accepted.
+            accepted = flatnonzero((error <= 1.0) | (h <= smallest))
+            self.rejected += len(somas) - len(accepted)
+            accepted_somas = somas[accepted]
+            for values,new in zip(state, heun):
+                values[accepted_somas] = new[accepted]
+            remaining[accepted_somas] -= h[accepted]
+            substeps[accepted_somas] += 1
+
+            # The error of the pair shrinks with the square of the substep.
+            factor = minimum(5.0, maximum(0.2, 0.9 / sqrt(maximum(error, 1e-10))))
+            h = maximum(smallest, h * factor)
+            sizes[somas] = h
+            left = remaining[somas]
+            h = minimum(h, left)
+            finishing = h >= left * (1.0 - 1e-9)
+            h[finishing] = left[finishing]
+            starts[somas] = h
+            somas = somas[remaining[somas] > 0.0]
+
+        self.count(substeps)
+        return state, substeps
+
+    def count(self, substeps):
+        """
+        Adds timesteps crossed in the given numbers of |substeps| to the
+            histogram.
+        """
+        counts = bincount(substeps, minlength=len(self.counts))
+        counts[:len(self.counts)] += self.counts
+        self.counts = counts
+
+    def mean_substeps(self):
+        """
+        Returns the mean number of substeps per timestep.
+        """
+        timesteps = self.counts.sum()
+        if timesteps == 0: return 0.0
+        return float((self.counts * arange(len(self.counts))).sum()) / timesteps
@@ -6,6 +6,7 @@
 
 from enum import enum
 from math import exp
+from numpy import zeros
 
 #################
 """  ENZYMES  """
@@ -115,6 +116,40 @@ Transporters = enum(
 )
 
 
+#########################
+""" AFFINITY MATRICES """
+#########################
+
+def affinity_matrix(proteins, mol_ids):
+    """
+    Compiles the affinities of |proteins| (receptors or transporters) for the
+        molecules in |mol_ids| into a dense matrix, with a row per protein
+        and a column per molecule.  Molecules that do not interact with a
+        protein have zero affinity.
+    """
+    columns = dict((mol_id, i) for i,mol_id in enumerate(mol_ids))
+    matrix = zeros((len(proteins), len(mol_ids)))
+    for row,protein in enumerate(proteins):
+        for mol_id,affinity in protein.affinities.iteritems():
+            if mol_id in columns: matrix[row, columns[mol_id]] = affinity
+    return matrix
+
+def receptor_masks(receptors, mol_ids):
+    """
+    Returns boolean matrices of the agonists and antagonists of |receptors|
+        among the molecules in |mol_ids|, laid out like affinity_matrix.
+    """
+    columns = dict((mol_id, i) for i,mol_id in enumerate(mol_ids))
+    agonists = zeros((len(receptors), len(mol_ids)), dtype=bool)
+    antagonists = zeros((len(receptors), len(mol_ids)), dtype=bool)
+    for row,receptor in enumerate(receptors):
+        for mol_id in receptor.agonists:
+            if mol_id in columns: agonists[row, columns[mol_id]] = True
+        for mol_id in receptor.antagonists:
+            if mol_id in columns: antagonists[row, columns[mol_id]] = True
+    return agonists, antagonists
+
+
 ##################
 """ METABOLISM """
 ##################
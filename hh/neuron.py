@@ -1,11 +1,12 @@
 # Neuron Model
 
-from multiprocessing import Value
+from ctypes import c_double
 from enum import enum
 from soma import Soma
 from synapse import Synapse
 from molecule import Transporters, Receptors
 from photoreceptor import PhotoreceptorSoma
+from shared import shared_value
 
 NeuronTypes = enum(
     PHOTORECEPTOR = 0,
@@ -28,11 +29,21 @@ class Neuron:
 
         # Inputs
         self.dendrites = []
-        self.external_activation = Value('d', 0.0)
+        self.external_activation = c_double(0.0)
         self.internal_activation = 0.0
         self.gap_junctions = []
         self.active_gap_junctions = False
 
+        # Array of gap currents, indexed by neuron_id.
+        # This is set by the neuron factory when it computes the gap currents
+        #     of the neurons it steps itself (single threaded).
+        self.gap_currents = None
+
+        # Column of the soma in the delay line, if it has delayed axons.
+        # This is set by the neuron factory, and the voltage is pushed
+        #     whenever the axons are stepped.
+        self.delay_column = None
+
         # Outputs
         self.axons = []
         self.synapses = []
@@ -41,13 +52,40 @@ class Neuron:
         self.soma_stable = True
         self.synapses_stable = []
 
+    def share(self):
+        """
+        Moves the external activation, the bound concentrations of the
+            dendrites and the environments of the output synapses into
+            shared memory, for worker processes.
+        """
+        self.external_activation = shared_value(self.external_activation)
+        for dendrite in self.dendrites: dendrite.share()
+        for synapse in self.synapses: synapse.environment.share()
+
     def external_activate(self, delta):
         self.external_activation.value += delta
 
     def internal_activate(self, delta):
         self.internal_activation += delta
 
-    def step(self, resolution=100):
+    def step(self, resolution=100, integrator=None, table=None):
+        tokens, activation = self.activate()
+
+        # Activate the soma
+        if activation is not None:
+            self.soma_stable = self.soma.step(activation,
+                resolution=resolution, integrator=integrator, table=table)
+
+        return self.finish(tokens)
+
+    def activate(self):
+        """
+        Runs everything in a timestep except the soma: gap junctions,
+            dendrites, axons, and synapses.
+        Returns the set of activated neuron ids, and the activation that the
+            soma should be stepped with (None if the soma can be skipped).
+        The soma must then be stepped by the caller before calling finish().
+        """
         # Keep track of activated neurons.
         tokens = set()
 
@@ -55,10 +93,15 @@ class Neuron:
 
         # Check gap junctions if active
         if self.active_gap_junctions:
-            gap_current = 0
-            for other,conductance in self.gap_junctions:
-                df = conductance*(other.soma.get_voltage() - soma_voltage)
-                gap_current += df
+            if self.gap_currents is None:
+                gap_current = 0
+                for other,conductance in self.gap_junctions:
+                    df = conductance*(other.soma.get_voltage() - soma_voltage)
+                    gap_current += df
+            else:
+                gap_current = self.gap_currents.item(self.neuron_id)
+                # As with the loop, the last partner is woken.
+                other = self.gap_junctions[-1][0]
 
             # Destabilize soma if new current is significantly different
             if abs(gap_current - self.soma.gap_current) > 0.001:
@@ -73,12 +116,10 @@ class Neuron:
 
         activation = self.external_activation.value + self.internal_activation
 
-        # Activate the soma
-        if activation != 0.0 or not self.soma_stable:
-            self.soma_stable = self.soma.step(activation, resolution=resolution)
-
         # Activate the axons
         # If they are releasing, their synapse should be activated
+        if self.delay_column is not None:
+            self.environment.delay_line.push(self.delay_column, soma_voltage)
         if soma_voltage < self.axon_threshold: soma_voltage = None
         for i,axon in enumerate(self.axons):
             if not axon.step(voltage = soma_voltage):
@@ -92,6 +133,16 @@ class Neuron:
                 self.synapses_stable[i] = s
                 if not s: tokens.add(self.synapses[i].postsynaptic_id)
 
+        if activation != 0.0 or not self.soma_stable:
+            return tokens, activation
+        else:
+            return tokens, None
+
+    def finish(self, tokens):
+        """
+        Completes a timestep started with activate(), once the soma has been
+            stepped and |soma_stable| updated.
+        """
         # Add self if not stable
         if not self.soma_stable or not all(self.synapses_stable): tokens.add(self.neuron_id)
 
@@ -118,7 +169,10 @@ class Neuron:
                     replenish_rate=0.1,
                     reuptake_rate=0.5,
                     capacity=1.0,
-                    delay=axon_delay)
+                    delay=axon_delay,
+                    environment=presynaptic.environment,
+                    source_id=presynaptic.neuron_id,
+                    source_threshold=presynaptic.axon_threshold)
         dendrite = synapse.create_dendrite(
                     receptor=receptor,
                     density=0.25,
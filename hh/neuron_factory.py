@@ -8,18 +8,50 @@
 # 
 # Probes can be added to any component to take measurements of voltage, current,
 #     or concentration over the course of the simulation.
+#
+# With multiple threads, each worker process steps one partition of the
+#     neurons (see partition.py).  By default, neurons are partitioned by
+#     cutting the graph of synapses and gap junctions, so that few values
+#     cross processes.  The factory moves the environments and the inputs of
+#     the neurons into shared memory before starting the workers (see
+#     shared.py).  Without workers, all of the state of the factory is
+#     private memory, so a forked copy of the factory (see sweep.py) is kept
+#     apart from the original by copy-on-write.
+#
+# When the factory steps neurons itself (single threaded), Hodgkin-Huxley
+#     somas are cycled together by a SomaPopulation rather than one by one,
+#     and the gap currents of the stepped neurons are computed together by a
+#     GapJunctionMatrix, with one sparse Laplacian product.
+#
+# Somas take one forward Euler step per timestep of 1 / resolution.  A factory
+#     given an adaptive integrator (see integrator.py) integrates each
+#     timestep in as many substeps as each soma needs instead, which keeps
+#     spikes accurate at a lower resolution.  The integrator counts the
+#     substeps, and each soma keeps its own total in |substeps| (or the soma
+#     population does, for the somas it cycles).  A factory given a rate table
+#     (see rate_table.py) reads the gating rates of its somas from it.
+#
+# While no neuron is active and nothing is dirty, a single threaded factory
+#     skips ahead to the next time at which a driver changes its neuron.
+#     Drivers tell the factory when that is (next_change), and record the
+#     skipped timesteps in bulk (skip), as probes do.
 
 from multiprocessing import Array, Process
-from math import ceil
+from numpy import array, zeros
 from environment import NeuronEnvironment
+from soma import Soma, SomaPopulation
+from gap_junction_matrix import GapJunctionMatrix
 from neuron import Neuron, NeuronTypes
 from molecule import Transporters, Receptors, Molecule_IDs
+from partition import partition, PartitionTypes
 
 class NeuronFactory:
-    def __init__(self, num_threads=1):
+    def __init__(self, num_threads=1, partition_type=PartitionTypes.GRAPH,
+                    resolution=100, integrator=None, rate_table=None):
         self.neuron_environment = NeuronEnvironment()
         self.neurons = []
         self.synapses = []
+        self.grids = []
 
         self.drivers = {}
         self.neuron_drivers = {}
@@ -28,6 +60,10 @@ class NeuronFactory:
         self.concentration_probes = {}
 
         self.num_threads = num_threads
+        self.partition_type = partition_type
+        self.resolution = resolution
+        self.integrator = integrator
+        self.rate_table = rate_table
         self.time = 0
         self.stable_count = 0
         self.stable = False
@@ -36,24 +72,50 @@ class NeuronFactory:
         self.neuron_environment.initialize()
         self.num_threads = min(self.num_threads, len(self.neurons))
 
+        # Neurons with delayed axons push their voltage when stepped.
+        delay_columns = self.neuron_environment.delay_line.columns
+        for neuron in self.neurons:
+            neuron.delay_column = delay_columns.get(neuron.neuron_id)
+
         if self.num_threads == 1:
             self.multithreaded = False
             self.prev_active = [False] * len(self.neurons)
             self.next_active = [False] * len(self.neurons)
+
+            # Gather Hodgkin-Huxley somas into a population.
+            # Other somas (photoreceptors) are stepped individually.
+            somas = [neuron.soma for neuron in self.neurons
+                        if isinstance(neuron.soma, Soma)]
+            self.somas = SomaPopulation(somas, self.neuron_environment)
+            self.soma_indices = [-1] * len(self.neurons)
+            for i,soma in enumerate(somas):
+                self.soma_indices[soma.neuron_id] = i
+
+            # Gap currents are computed by the factory.
+            self.gap_matrix = GapJunctionMatrix(
+                self.neurons, self.neuron_environment)
+            self.gap_currents = zeros(len(self.neurons))
+            for neuron in self.neurons:
+                neuron.gap_currents = self.gap_currents
         else:
             self.multithreaded = True
+            # Move the state read and written by the workers into shared
+            #     memory.
+            self.neuron_environment.share()
+            for neuron in self.neurons: neuron.share()
+
             # Create the boolean buffers
             self.prev_active = Array('b', [False] * len(self.neurons), lock=False)
             self.next_active = Array('b', [False] * len(self.neurons), lock=False)
-            length = int(ceil(float(len(self.neurons)) / self.num_threads))
 
             # Create workers
+            # Each worker steps one partition of the neurons.
+            self.partitions = self.partition_neurons()
             self.workers = []
-            for i in xrange(self.num_threads):
-                start_index,stop_index = (i * length, min(len(self.neurons), (i+1)*length))
+            for neuron_ids in self.partitions:
                 self.workers.append(Process(
                     target=self.work,
-                    args=(start_index, stop_index)))
+                    args=(neuron_ids,)))
 
         # Activate drivers
         # Drivers do not step the neuron, but modify it to prepare for
@@ -67,6 +129,20 @@ class NeuronFactory:
         if self.multithreaded:
             for worker in self.workers: worker.start()
 
+    def partition_neurons(self):
+        """
+        Splits the neurons between the workers according to the partition
+            type.  Returns a list of neuron ids for each worker.
+        """
+        edges = [(neuron.neuron_id, synapse.postsynaptic_id)
+                    for neuron in self.neurons
+                        for synapse in neuron.synapses] \
+              + [(neuron.neuron_id, other.neuron_id)
+                    for neuron in self.neurons
+                        for other,_ in neuron.gap_junctions]
+        return partition(self.partition_type, len(self.neurons),
+            self.num_threads, edges, self.grids)
+
     def close(self):
         if self.multithreaded:
             for worker in self.workers: worker.terminate()
@@ -76,14 +152,17 @@ class NeuronFactory:
         try: self.prev_active
         except: self.initialize()
 
-        for _ in xrange(count):
+        stop = self.time + count
+        while self.time < stop:
+            # Skip quiescent timesteps.
+            skip = self.quiescent_steps(stop)
+            if skip > 0:
+                self.skip(skip)
+                continue
+
             # If no other threads, do it yourself
             if not self.multithreaded:
-                tokens = set()
-                for i in xrange(len(self.neurons)):
-                    if self.prev_active[i]:
-                       tokens.update( self.neurons[i].step())
-                       self.prev_active[i] = False
+                tokens = self.step_neurons()
                 for token in tokens:
                     self.next_active[token] = True
 
@@ -123,11 +202,85 @@ class NeuronFactory:
                 self.prev_active[i] = self.next_active[i]
                 self.next_active[i] = False
 
-    def work(self, start_index, stop_index):
+    def quiescent_steps(self, stop):
+        """
+        Returns the number of timesteps from now until |stop| in which nothing
+            happens: no neuron is active, no voltage is dirty, and no driver
+            changes its neuron.  Drivers are driven at the end of each
+            timestep, so the last quiescent timestep is the one before the
+            earliest change.
+        """
+        if self.multithreaded: return 0
+        if any(self.prev_active): return 0
+        environment = self.neuron_environment
+        if environment.dirty[:environment.size].any(): return 0
+
+        end = stop
+        for driver in self.neuron_drivers.itervalues():
+            change = driver.next_change(self.time + 1)
+            if change is not None: end = min(end, change - 1)
+        return max(0, end - self.time)
+
+    def skip(self, count):
+        """
+        Skips |count| quiescent timesteps, recording them in bulk.
+        """
+        for neuron,probe in self.neuron_probes.iteritems():
+            probe.record(neuron.soma, count)
+        for component,probe in self.concentration_probes.iteritems():
+            probe.record(component, count)
+        for driver in self.neuron_drivers.itervalues():
+            driver.skip(count)
+        self.time += count
+        self.stable_count += count
+        self.stable = True
+
+    def step_neurons(self):
+        """
+        Steps the active neurons, cycling their Hodgkin-Huxley somas
+            together.  Returns the set of neuron ids to activate next.
+        """
+        tokens = set()
+        pending = []
+        active = array([i for i in xrange(len(self.neurons))
+                            if self.prev_active[i]], dtype=int)
+        self.gap_currents[active] = self.gap_matrix.gap_current(
+            active, self.neuron_environment.get_voltages(active))
+
+        for i in active.tolist():
+            self.prev_active[i] = False
+            neuron = self.neurons[i]
+            neuron_tokens, activation = neuron.activate()
+            if activation is None:
+                tokens.update(neuron.finish(neuron_tokens))
+            elif self.soma_indices[i] < 0:
+                neuron.soma_stable = neuron.soma.step(activation,
+                    resolution=self.resolution, integrator=self.integrator,
+                    table=self.rate_table)
+                tokens.update(neuron.finish(neuron_tokens))
+            else:
+                pending.append((neuron, neuron_tokens, activation))
+
+        if len(pending) > 0:
+            somas = [neuron.soma for neuron,_,_ in pending]
+            stable = self.somas.step(
+                array([self.soma_indices[soma.neuron_id] for soma in somas]),
+                array([activation for _,_,activation in pending]),
+                array([soma.gap_current for soma in somas]),
+                array([soma.iapp for soma in somas]),
+                resolution=self.resolution, integrator=self.integrator,
+                table=self.rate_table)
+            for (neuron,neuron_tokens,_),soma_stable in zip(pending, stable.tolist()):
+                neuron.soma_stable = soma_stable
+                tokens.update(neuron.finish(neuron_tokens))
+        return tokens
+
+    def work(self, neuron_ids):
         while True:
-            for neuron_id in xrange(start_index, stop_index):
+            for neuron_id in neuron_ids:
                 if self.prev_active[neuron_id]:
-                    for i in self.neurons[neuron_id].step():
+                    for i in self.neurons[neuron_id].step(self.resolution,
+                            self.integrator, self.rate_table):
                         self.next_active[i] = True
                     self.prev_active[neuron_id] = False
 
@@ -153,6 +306,7 @@ class NeuronFactory:
             for j in xrange(width):
                 row.append(self.create_neuron(base_current, neuron_type))
             output.append(row)
+        self.grids.append(output)
         return output
 
     def create_synapse(self, pre_neuron, post_neuron,
@@ -227,6 +381,16 @@ class ConstantDriver:
         neuron.external_activate(self.activation)
         return True
 
+    def next_change(self, time):
+        """
+        Returns the first time from |time| at which driving changes the neuron.
+        """
+        if self.drive == self.predelay: return max(time, self.delay)
+        return time
+
+    def skip(self, count):
+        pass
+
 class CurrentPulseDriver:
     def __init__(self, current=0.0, period=1000, length=500,
                         delay=0, record=False):
@@ -251,6 +415,23 @@ class CurrentPulseDriver:
         if self.on: return True
         else: return False
 
+    def next_change(self, time):
+        """
+        Returns the first time from |time| at which driving changes the neuron:
+            every time while the pulse is on, and otherwise when it turns on
+            or off.
+        """
+        if self.on: return time
+        time -= self.delay
+        start = max(time, 0)
+        change = start + (-start % self.period)
+        if 0 <= self.length < self.period:
+            change = min(change, time + ((self.length - time) % self.period))
+        return self.delay + change
+
+    def skip(self, count):
+        if self.record: self.data.extend([-0.3] * count)
+
 class ActivationPulseDriver:
     def __init__(self, activation=0.0, period=1000, length=1,
                     delay=0, decrement=None, record=False):
@@ -276,17 +457,33 @@ class ActivationPulseDriver:
             if self.record: self.data.append(-0.4)
             return False
 
+    def next_change(self, time):
+        """
+        Returns the first time from |time| within a pulse, or None if pulses
+            no longer change the neuron and are not recorded.
+        """
+        if self.length <= 0: return None
+        if self.activation == 0.0 and not self.record: return None
+        time -= self.delay
+        start = max(time, 0)
+        phase = start % self.period
+        if phase < self.length: return self.delay + start
+        return self.delay + start + self.period - phase
+
+    def skip(self, count):
+        if self.record: self.data.extend([-0.4] * count)
+
 class VoltageProbe:
     def __init__(self):
         self.data = []
 
-    def record(self, component):
-        self.data.append(component.get_scaled_voltage())
+    def record(self, component, count=1):
+        self.data.extend([component.get_scaled_voltage()] * count)
 
 class ConcentrationProbe:
     def __init__(self, mol_id):
         self.data = []
         self.mol_id = mol_id
 
-    def record(self, component):
-        self.data.append(component.get_concentration(self.mol_id))
+    def record(self, component, count=1):
+        self.data.extend([component.get_concentration(self.mol_id)] * count)
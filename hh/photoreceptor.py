@@ -9,6 +9,8 @@
 # http://www.math.pitt.edu/~bard/bardware/hh-c.ode
 
 from math import exp
+from numpy import array
+from soma import hodgkin_huxley, SCALES
 
 class PhotoreceptorSoma:
     def __init__(self, environment=None):
@@ -20,6 +22,8 @@ class PhotoreceptorSoma:
         self.stable_voltage = -40.1323467956
         self.neuron_id = environment.register(self.stable_voltage)
         self.stable_count = 0
+        self.substeps = 0
+        self.substep_size = float("inf")
         self.reset(reset_voltage=False)
 
     def get_voltage(self):
@@ -56,13 +60,15 @@ class PhotoreceptorSoma:
         self.vk=-77.0
         self.vl=-54.4
 
-    def step(self, light_activation=0.0, resolution=100, silent=False):
+    def step(self, light_activation=0.0, resolution=100, silent=False,
+                integrator=None, table=None):
         time_coefficient = 1.0 / resolution
 
         voltage = self.get_voltage()
         self.light_level += (light_activation - self.light_level) / 1000
         self.m = self.base_conductance - self.light_level
-        self.cycle(time_coefficient, voltage)
+        if integrator is None: self.cycle(time_coefficient, voltage, table)
+        else: self.integrate(integrator, time_coefficient, voltage, table)
 
         if silent: return
 
@@ -73,16 +79,19 @@ class PhotoreceptorSoma:
         self.prev_voltage = voltage
         return self.stable_count > 10 and self.iapp == 0.0
 
-    def cycle(self, time_coefficient, voltage):
-        ah   = 0.07*exp(-(voltage+65.0)/20.0)
-        bh   = 1.0/( 1.0 + exp(-(voltage+35.0)/10.0) )
-        hinf = ah/(ah+bh)
-        tauh = 1/(ah+bh)
+    def cycle(self, time_coefficient, voltage, table=None):
+        if table is not None:
+            _, _, hinf, tauh, ninf, taun = table.lookup_scalar(voltage)
+        else:
+            ah   = 0.07*exp(-(voltage+65.0)/20.0)
+            bh   = 1.0/( 1.0 + exp(-(voltage+35.0)/10.0) )
+            hinf = ah/(ah+bh)
+            tauh = 1/(ah+bh)
 
-        an   = 0.01*(voltage + 55.0)/(1.0 - exp(-(voltage + 55.0)/10.0))
-        bn   = 0.125*exp(-(voltage + 65.0)/80.0)
-        ninf = an/(an+bn)
-        taun = 1.0/(an+bn)
+            an   = 0.01*(voltage + 55.0)/(1.0 - exp(-(voltage + 55.0)/10.0))
+            bn   = 0.125*exp(-(voltage + 65.0)/80.0)
+            ninf = an/(an+bn)
+            taun = 1.0/(an+bn)
 
         ina = self.gnabar * (self.m**3) * self.h * (voltage-self.vna)
         ik  = self.gkbar * (self.n**4) * (voltage-self.vk)
@@ -92,5 +101,28 @@ class PhotoreceptorSoma:
         self.h +=  time_coefficient*(hinf - self.h)/tauh
         self.n +=  time_coefficient*(ninf - self.n)/taun
 
+    def integrate(self, integrator, time_coefficient, voltage, table=None):
+        """
+        Integrates the voltage and gating variables over a timestep with the
+            adaptive |integrator|.  The conductance m is set by the light
+            level, and is held over the timestep.
+        """
+        parameters = (self.cm, self.gnabar, self.gkbar, self.gl,
+                      self.vna, self.vk, self.vl)
+
+        def derivative(state, somas):
+            rates = hodgkin_huxley(state, 0.0, parameters, table)
+            rates[1] = 0.0 * rates[1]
+            return rates
+
+        sizes = array([self.substep_size])
+        state, substeps = integrator.integrate(derivative,
+            [[voltage], [self.m], [self.h], [self.n]], SCALES, time_coefficient,
+            sizes)
+        self.substep_size = sizes.item(0)
+        self.adjust_voltage(state[0].item(0) - voltage)
+        self.h, self.n = (state[2].item(0), state[3].item(0))
+        self.substeps += substeps.item(0)
+
     def get_scaled_voltage(self):
         return (self.get_voltage()-self.stable_voltage)/100
@@ -0,0 +1,105 @@
+# Rate Table
+#
+# The gating variables of a Hodgkin-Huxley soma relax towards steady states,
+#     with time constants, that depend only on the voltage.  Computing them
+#     takes six exponentials per soma per timestep.  A rate table computes
+#     them once, on a grid of voltages with a fixed spacing, and looks them
+#     up by linear interpolation between the two nearest grid voltages.
+#     Each grid voltage keeps the six values and their slopes to the next
+#     grid voltage, so that a lookup reads them all in one gather.
+#
+# Interpolation errors shrink with the square of the spacing, and are largest
+#     halfway between grid voltages, so accuracy() measures them there,
+#     against the exact functions.  Voltages outside of the table are read
+#     as the nearest end of the table.
+#
+# The rate functions of m and n divide by zero at -40 mV and -55 mV, where
+#     they have removable singularities.  Grid voltages on a singularity are
+#     computed a millionth of a mV away from it.
+
+from numpy import arange, vstack, zeros, diff, absolute, clip, isin
+from numpy import exp as np_exp
+
+NAMES = ("minf", "taum", "hinf", "tauh", "ninf", "taun")
+
+def steady_states(voltage):
+    """
+    Returns arrays of the steady states and time constants of the gating
+        variables at each of the |voltage|s, in the order of NAMES.
+    """
+    am   = 0.1*(voltage+40.0)/( 1.0 - np_exp(-(voltage+40.0)/10.0) )
+    bm   = 4.0*np_exp(-(voltage+65.0)/18.0)
+    ah   = 0.07*np_exp(-(voltage+65.0)/20.0)
+    bh   = 1.0/( 1.0 + np_exp(-(voltage+35.0)/10.0) )
+    an   = 0.01*(voltage + 55.0)/(1.0 - np_exp(-(voltage + 55.0)/10.0))
+    bn   = 0.125*np_exp(-(voltage + 65.0)/80.0)
+    return (am/(am+bm), 1.0/(am+bm),
+            ah/(ah+bh), 1.0/(ah+bh),
+            an/(an+bn), 1.0/(an+bn))
+
+class RateTable:
+    def __init__(self, spacing=0.01, low=-120.0, high=80.0):
+        """
+        Tabulates the rate functions from |low| to |high| mV, with grid
+            voltages |spacing| mV apart.
+        """
+        self.spacing = float(spacing)
+        self.low = float(low)
+        size = int(round((high - low) / self.spacing)) + 1
+        self.high = self.low + (size - 1) * self.spacing
+        self.last = size - 1
+
+        voltages = self.low + arange(size) * self.spacing
+        singular = isin(voltages.round(9), (-40.0, -55.0))
+        voltages[singular] += 1e-6
+
+        # The six values are followed by their slopes, which are zero at the
+        #     last grid voltage.
+        values = vstack(steady_states(voltages))
+        slopes = zeros(values.shape)
+        slopes[:, :-1] = diff(values, axis=1)
+        self.table = vstack((values, slopes))
+        self.rows = [tuple(row) for row in self.table.T.tolist()]
+
+    def lookup(self, voltage):
+        """
+        Returns arrays of the interpolated steady states and time constants at
+            each of the |voltage|s, in the order of NAMES.
+        """
+        position = (voltage - self.low) / self.spacing
+        clip(position, 0.0, self.last, out=position)
+        index = position.astype(int)
+        rows = self.table.take(index, axis=1)
+        values = rows[6:]
+        values *= position - index
+        values += rows[:6]
+        return values
+
+    def lookup_scalar(self, voltage):
+        """
+        Returns the interpolated steady states and time constants at a single
+            |voltage|, as a tuple of floats in the order of NAMES.
+        """
+        position = (voltage - self.low) / self.spacing
+        if position < 0.0: position = 0.0
+        elif position > self.last: position = self.last
+        index = int(position)
+        f = position - index
+        r = self.rows[index]
+        return (r[0] + f*r[6], r[1] + f*r[7], r[2] + f*r[8],
+                r[3] + f*r[9], r[4] + f*r[10], r[5] + f*r[11])
+
+    def accuracy(self):
+        """
+        Returns a dictionary of the maximum absolute and relative errors of
+            each tabulated function, keyed by name, measured halfway between
+            grid voltages.
+        """
+        voltages = self.low + (arange(self.last) + 0.5) * self.spacing
+        voltages = voltages[~isin(voltages.round(9), (-40.0, -55.0))]
+        report = dict()
+        for name,exact,tabulated in zip(NAMES,
+                steady_states(voltages), self.lookup(voltages)):
+            error = absolute(tabulated - exact)
+            report[name] = (error.max(), (error / absolute(exact)).max())
+        return report
@@ -0,0 +1,29 @@
+# Shared Memory
+#
+# Factories with worker processes keep the state that their workers read and
+#     write in shared memory made by multiprocessing, and work on it through
+#     numpy views.  Components allocate their buffers as plain numpy arrays,
+#     and their values as ctypes values, and a factory moves them into shared
+#     memory with share() before it starts its workers.  Factories without
+#     workers share nothing, so forked copies of them (see sweep.py) are kept
+#     apart by copy-on-write.
+
+from multiprocessing import Array, Value
+from numpy import frombuffer
+
+typecodes = { 'float64' : 'd', 'int8' : 'b', 'int64' : 'l' }
+
+def shared_copy(array):
+    """
+    Returns a copy of the numpy |array| in shared memory.
+    """
+    shared = Array(typecodes[array.dtype.name], array.size, lock=False)
+    copy = frombuffer(shared, dtype=array.dtype).reshape(array.shape)
+    copy[:] = array
+    return copy
+
+def shared_value(value):
+    """
+    Returns a copy of the ctypes |value| in shared memory.
+    """
+    return Value(value._type_, value.value, lock=False)
@@ -2,13 +2,64 @@
 #
 # Adapted from Hodgkin-Huxley model implementation by G. Bard Ermentrout
 # http://www.math.pitt.edu/~bard/bardware/hh-c.ode
+#
+# A SomaPopulation holds the gating variables and conductance parameters of
+#     many somas in arrays, and cycles them together in one batched kernel.
+#
+# Somas take one forward Euler step per timestep, unless they are stepped with
+#     an adaptive integrator (see integrator.py), which integrates the same
+#     equations (hodgkin_huxley below) in as many substeps as they need.
+#     Either way, the steady states and time constants of the gating
+#     variables can be read from a rate table (see rate_table.py) instead
+#     of being computed.
 
 from math import exp
+from numpy import array, flatnonzero, absolute
+from numpy import exp as np_exp
+
+# Error scales of the voltage and the gating variables m, h, and n.
+SCALES = (1.0, 0.01, 0.01, 0.01)
+
+def hodgkin_huxley(state, current, parameters, table=None):
+    """
+    Returns the rates of change of the |state| of somas, which is a list of
+        arrays of their voltages and gating variables m, h, and n, given
+        their applied |current| and their conductance |parameters|
+        (cm, gnabar, gkbar, gl, vna, vk, vl).
+    The gating rates are read from the rate |table|, if given.
+    """
+    voltage, m, h, n = state
+    cm, gnabar, gkbar, gl, vna, vk, vl = parameters
+
+    ina = gnabar * (m**3) * h * (voltage-vna)
+    ik  = gkbar * (n**4) * (voltage-vk)
+    il  = gl * (voltage-vl)
+
+    if table is not None:
+        minf, taum, hinf, tauh, ninf, taun = table.lookup(voltage)
+        return [(current - ina - ik - il) / cm,
+                (minf - m)/taum,
+                (hinf - h)/tauh,
+                (ninf - n)/taun]
+
+    am   = 0.1*(voltage+40.0)/( 1.0 - np_exp(-(voltage+40.0)/10.0) )
+    bm   = 4.0*np_exp(-(voltage+65.0)/18.0)
+    ah   = 0.07*np_exp(-(voltage+65.0)/20.0)
+    bh   = 1.0/( 1.0 + np_exp(-(voltage+35.0)/10.0) )
+    an   = 0.01*(voltage + 55.0)/(1.0 - np_exp(-(voltage + 55.0)/10.0))
+    bn   = 0.125*np_exp(-(voltage + 65.0)/80.0)
+
+    return [(current - ina - ik - il) / cm,
+            am - (am+bm)*m,
+            ah - (ah+bh)*h,
+            an - (an+bn)*n]
 
 class Soma:
     def __init__(self, base_current=0.0, environment=None):
         self.iapp = base_current
         self.stable_count = 0
+        self.substeps = 0
+        self.substep_size = float("inf")
         self.environment = environment
         self.stable_voltage = -64.9997224337
         self.neuron_id = environment.register(self.stable_voltage)
@@ -48,11 +99,13 @@ class Soma:
         self.vk=-77.0
         self.vl=-54.4
 
-    def step(self, ligand_activation=0.0, resolution=100, silent=False):
+    def step(self, ligand_activation=0.0, resolution=100, silent=False,
+                integrator=None, table=None):
         voltage = self.get_voltage()
         time_coefficient = 1.0 / resolution
         self.m += ligand_activation
-        self.cycle(time_coefficient, voltage)
+        if integrator is None: self.cycle(time_coefficient, voltage, table)
+        else: self.integrate(integrator, time_coefficient, voltage, table)
         if silent: return
 
         if voltage > 0.0 and self.firing is False:
@@ -69,25 +122,29 @@ class Soma:
 
         return self.stable_count > 10 and self.iapp == 0.0
 
-    def cycle(self, time_coefficient, voltage):
+    def cycle(self, time_coefficient, voltage, table=None):
         """
         Cycles the voltage and currents.
         Voltage is a parameter to avoid accessing the voltage cache.
+        The gating rates are read from the rate |table|, if given.
         """
-        am   = 0.1*(voltage+40.0)/( 1.0 - exp(-(voltage+40.0)/10.0) )
-        bm   = 4.0*exp(-(voltage+65.0)/18.0)
-        minf = am/(am+bm)
-        taum = 1.0/(am+bm)
+        if table is not None:
+            minf, taum, hinf, tauh, ninf, taun = table.lookup_scalar(voltage)
+        else:
+            am   = 0.1*(voltage+40.0)/( 1.0 - exp(-(voltage+40.0)/10.0) )
+            bm   = 4.0*exp(-(voltage+65.0)/18.0)
+            minf = am/(am+bm)
+            taum = 1.0/(am+bm)
 
-        ah   = 0.07*exp(-(voltage+65.0)/20.0)
-        bh   = 1.0/( 1.0 + exp(-(voltage+35.0)/10.0) )
-        hinf = ah/(ah+bh)
-        tauh = 1/(ah+bh)
+            ah   = 0.07*exp(-(voltage+65.0)/20.0)
+            bh   = 1.0/( 1.0 + exp(-(voltage+35.0)/10.0) )
+            hinf = ah/(ah+bh)
+            tauh = 1/(ah+bh)
 
-        an   = 0.01*(voltage + 55.0)/(1.0 - exp(-(voltage + 55.0)/10.0))
-        bn   = 0.125*exp(-(voltage + 65.0)/80.0)
-        ninf = an/(an+bn)
-        taun = 1.0/(an+bn)
+            an   = 0.01*(voltage + 55.0)/(1.0 - exp(-(voltage + 55.0)/10.0))
+            bn   = 0.125*exp(-(voltage + 65.0)/80.0)
+            ninf = an/(an+bn)
+            taun = 1.0/(an+bn)
 
         ina = self.gnabar * (self.m**3) * self.h * (voltage-self.vna)
         ik  = self.gkbar * (self.n**4) * (voltage-self.vk)
@@ -98,5 +155,164 @@ class Soma:
         self.n +=  time_coefficient*(ninf - self.n)/taun
         self.m +=  time_coefficient*(minf - self.m)/taum
 
+    def integrate(self, integrator, time_coefficient, voltage, table=None):
+        """
+        Integrates the voltage and gating variables over a timestep with the
+            adaptive |integrator|.
+        """
+        parameters = (self.cm, self.gnabar, self.gkbar, self.gl,
+                      self.vna, self.vk, self.vl)
+        current = self.gap_current + self.iapp
+        sizes = array([self.substep_size])
+        state, substeps = integrator.integrate(
+            lambda state, somas: hodgkin_huxley(state, current, parameters,
+                table),
+            [[voltage], [self.m], [self.h], [self.n]], SCALES, time_coefficient,
+            sizes)
+        self.substep_size = sizes.item(0)
+        self.adjust_voltage(state[0].item(0) - voltage)
+        self.m, self.h, self.n = (state[1].item(0), state[2].item(0),
+                                  state[3].item(0))
+        self.substeps += substeps.item(0)
+
     def get_scaled_voltage(self):
         return min(0.2, (self.get_voltage()-self.stable_voltage)/100)
+
+class SomaPopulation:
+    def __init__(self, somas, environment=None):
+        """
+        Builds a population from a list of |somas|.
+        The gating variables and parameters of each soma are copied into
+            arrays, and the population owns that state from then on.  Use
+            store() to copy it back into the soma objects.
+        Voltages stay in the |environment|.
+        """
+        self.somas = somas
+        self.environment = environment
+        self.neuron_ids = array([soma.neuron_id for soma in somas], dtype=int)
+
+        def gather(attr, dtype=float):
+            return array([getattr(soma, attr) for soma in somas], dtype=dtype)
+
+        self.h = gather("h")
+        self.n = gather("n")
+        self.m = gather("m")
+        self.cm = gather("cm")
+        self.gnabar = gather("gnabar")
+        self.gkbar = gather("gkbar")
+        self.gl = gather("gl")
+        self.vna = gather("vna")
+        self.vk = gather("vk")
+        self.vl = gather("vl")
+        self.stable_voltage = gather("stable_voltage")
+        self.stable_count = gather("stable_count", int)
+        self.firing = gather("firing", bool)
+        self.substeps = gather("substeps", int)
+        self.substep_sizes = gather("substep_size")
+
+    def __len__(self):
+        return len(self.somas)
+
+    def store(self):
+        """
+        Copies the population state back into the soma objects.
+        """
+        for i,soma in enumerate(self.somas):
+            soma.h = float(self.h[i])
+            soma.n = float(self.n[i])
+            soma.m = float(self.m[i])
+            soma.stable_count = int(self.stable_count[i])
+            soma.firing = bool(self.firing[i])
+            soma.substeps = int(self.substeps[i])
+            soma.substep_size = float(self.substep_sizes[i])
+
+    def step(self, indices, ligand_activation, gap_current, iapp,
+                resolution=100, silent=False, integrator=None, table=None):
+        """
+        Batched version of Soma.step for the somas at |indices|.
+        |ligand_activation|, |gap_current| and |iapp| are arrays aligned
+            with |indices|.
+        Returns a boolean array of the stability of the stepped somas.
+        """
+        neuron_ids = self.neuron_ids[indices]
+        voltage = array(self.environment.get_voltages(neuron_ids), dtype=float)
+        time_coefficient = 1.0 / resolution
+        self.m[indices] += ligand_activation
+        if integrator is None:
+            self.cycle(indices, time_coefficient, voltage, gap_current + iapp,
+                table)
+        else:
+            self.integrate(integrator, indices, time_coefficient, voltage,
+                gap_current + iapp, table)
+        if silent: return
+
+        firing = self.firing[indices]
+        for _ in flatnonzero((voltage > 0.0) & ~firing):
+            print("SPIKE")
+        firing[voltage > 0.0] = True
+        firing[voltage < 0.0] = False
+        self.firing[indices] = firing
+
+        stable_count = self.stable_count[indices] + 1
+        stable_count[(ligand_activation != 0.0) |
+            (absolute(voltage - self.stable_voltage[indices]) >= 0.001)] = 0
+        self.stable_count[indices] = stable_count
+
+        return (stable_count > 10) & (iapp == 0.0)
+
+    def cycle(self, indices, time_coefficient, voltage, current, table=None):
+        """
+        Batched version of Soma.cycle.
+        """
+        h, n, m = (self.h[indices], self.n[indices], self.m[indices])
+
+        if table is not None:
+            minf, taum, hinf, tauh, ninf, taun = table.lookup(voltage)
+        else:
+            am   = 0.1*(voltage+40.0)/( 1.0 - np_exp(-(voltage+40.0)/10.0) )
+            bm   = 4.0*np_exp(-(voltage+65.0)/18.0)
+            minf = am/(am+bm)
+            taum = 1.0/(am+bm)
+
+            ah   = 0.07*np_exp(-(voltage+65.0)/20.0)
+            bh   = 1.0/( 1.0 + np_exp(-(voltage+35.0)/10.0) )
+            hinf = ah/(ah+bh)
+            tauh = 1/(ah+bh)
+
+            an   = 0.01*(voltage + 55.0)/(1.0 - np_exp(-(voltage + 55.0)/10.0))
+            bn   = 0.125*np_exp(-(voltage + 65.0)/80.0)
+            ninf = an/(an+bn)
+            taun = 1.0/(an+bn)
+
+        ina = self.gnabar[indices] * (m**3) * h * (voltage-self.vna[indices])
+        ik  = self.gkbar[indices] * (n**4) * (voltage-self.vk[indices])
+        il  = self.gl[indices] * (voltage-self.vl[indices])
+
+        self.environment.adjust_voltages(self.neuron_ids[indices],
+            (time_coefficient*( current - ina - ik - il ) / self.cm[indices]).tolist())
+        self.h[indices] = h + time_coefficient*(hinf - h)/tauh
+        self.n[indices] = n + time_coefficient*(ninf - n)/taun
+        self.m[indices] = m + time_coefficient*(minf - m)/taum
+
+    def integrate(self, integrator, indices, time_coefficient, voltage, current,
+                    table=None):
+        """
+        Integrates the somas at |indices| over a timestep with the adaptive
+            |integrator|, instead of cycling them.
+        """
+        parameters = [values[indices] for values in (self.cm, self.gnabar,
+            self.gkbar, self.gl, self.vna, self.vk, self.vl)]
+
+        def derivative(state, somas):
+            return hodgkin_huxley(state, current[somas],
+                [values[somas] for values in parameters], table)
+
+        sizes = self.substep_sizes[indices]
+        state, substeps = integrator.integrate(derivative,
+            [voltage, self.m[indices], self.h[indices], self.n[indices]],
+            SCALES, time_coefficient, sizes)
+        self.substep_sizes[indices] = sizes
+        self.environment.adjust_voltages(self.neuron_ids[indices],
+            (state[0] - voltage).tolist())
+        self.m[indices], self.h[indices], self.n[indices] = state[1:]
+        self.substeps[indices] += substeps
@@ -0,0 +1,125 @@
+import argparse
+
+from plot import plot
+from numpy import array
+
+from environment import NeuronEnvironment
+from soma import Soma, SomaPopulation
+from integrator import AdaptiveIntegrator
+from rate_table import RateTable, NAMES
+
+def soma_population(currents=[-2.0, 0.0, 5.0, 10.0, 25.0], tolerance=1e-9):
+    # Two identical sets of somas, one stepped individually and one stepped
+    #     as a population.
+    scalar_environment = NeuronEnvironment()
+    batched_environment = NeuronEnvironment()
+    scalar_somas = [Soma(current, scalar_environment) for current in currents]
+    batched_somas = [Soma(current, batched_environment) for current in currents]
+    scalar_environment.initialize()
+    batched_environment.initialize()
+    population = SomaPopulation(batched_somas, batched_environment)
+
+    # Adaptive integrators, if tested, are separate to count separately.
+    scalar_integrator = batched_integrator = None
+    if args.adaptive is not None:
+        scalar_integrator = AdaptiveIntegrator(args.adaptive)
+        batched_integrator = AdaptiveIntegrator(args.adaptive)
+    table = None if args.table is None else RateTable(args.table)
+
+    indices = array(range(len(currents)))
+    ligand_activation = array([0.0] * len(currents))
+    gap_current = array([0.0] * len(currents))
+    iapp = array(currents)
+
+    scalar_data = [[] for _ in currents]
+    batched_data = [[] for _ in currents]
+    max_difference = 0.0
+    for _ in xrange(args.iterations):
+        for soma in scalar_somas:
+            soma.step(silent=True, integrator=scalar_integrator, table=table)
+        population.step(indices, ligand_activation, gap_current, iapp,
+            silent=True, integrator=batched_integrator, table=table)
+        scalar_environment.step()
+        batched_environment.step()
+
+        for i in xrange(len(currents)):
+            scalar = scalar_somas[i].get_voltage()
+            batched = batched_somas[i].get_voltage()
+            scalar_data[i].append(scalar)
+            batched_data[i].append(batched)
+            max_difference = max(max_difference, abs(scalar - batched))
+
+    print("Maximum voltage difference: %g" % max_difference)
+    if batched_integrator is not None:
+        print("Mean substeps per timestep: %f" %
+            batched_integrator.mean_substeps())
+        print("Substeps of each soma: %s" % population.substeps.tolist())
+        if (scalar_integrator.counts.tolist() != batched_integrator.counts.tolist()):
+            raise ValueError("Population took different substeps")
+    if max_difference > tolerance:
+        raise ValueError("Population diverged from scalar somas")
+
+    if not args.silent:
+        data = []
+        for i,current in enumerate(currents):
+            data.append(("Scalar %f" % current, scalar_data[i]))
+            data.append(("Population %f" % current, batched_data[i]))
+        plot(data, title="Soma population")
+
+def rate_table_accuracy(currents=[-2.0, 0.0, 5.0, 10.0, 25.0]):
+    # Reports the errors of the tabulated rates, and how far populations
+    #     stepped with the table drift from populations with exact rates.
+    table = RateTable(args.table)
+    for name in NAMES:
+        absolute, relative = table.accuracy()[name]
+        print("%s: maximum error %g (relative %g)" % (name, absolute, relative))
+
+    exact_environment = NeuronEnvironment()
+    table_environment = NeuronEnvironment()
+    exact = SomaPopulation([Soma(current, exact_environment)
+        for current in currents], exact_environment)
+    tabulated = SomaPopulation([Soma(current, table_environment)
+        for current in currents], table_environment)
+    exact_environment.initialize()
+    table_environment.initialize()
+
+    indices = array(range(len(currents)))
+    zero = array([0.0] * len(currents))
+    iapp = array(currents)
+    max_difference = 0.0
+    for _ in xrange(args.iterations):
+        exact.step(indices, zero, zero, iapp, silent=True)
+        tabulated.step(indices, zero, zero, iapp, silent=True, table=table)
+        exact_environment.step()
+        table_environment.step()
+        max_difference = max(max_difference, abs(
+            array(exact_environment.get_voltages(exact.neuron_ids)) -
+            array(table_environment.get_voltages(tabulated.neuron_ids))).max())
+    print("Maximum voltage difference from exact rates: %g" % max_difference)
+
+def main():
+    soma_population()
+    if args.table is not None: rate_table_accuracy()
+
+def set_options():
+    """
+    Retrieve the user-entered arguments for the program.
+    """
+    parser = argparse.ArgumentParser(description = 
+    """Tests that batched somas match individually stepped somas.""")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = 
+    """print table""")
+    parser.add_argument("-s", "--silent", action = "store_true", help = 
+    """do not display graphs""")
+    parser.add_argument("-i", "--iterations", type = int, default = 5000, help = 
+    """table""")
+    parser.add_argument("-a", "--adaptive", type = float, default = None, help = 
+    """integrate adaptively with the given tolerance""")
+    parser.add_argument("-t", "--table", type = float, default = None, help = 
+    """read gating rates from a table with the given spacing in mV""")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = set_options()
+    main()
@@ -1,27 +1,109 @@
 import argparse
+from numpy import allclose
 
 from plot import plot
 
 from simulation import simulate_synapse
 from synapse import Synapse
+from molecule import Molecule_IDs, Receptor, Receptors, Transporter, \
+                     affinity_matrix, receptor_masks
+from sweep import sweep
+
+def metabolize(syn, r):
+    syn.set_enzyme_concentration(r)
+    record_components = [(
+        "metabolize %s" % str(r),
+        syn.synaptic_cleft)]
+    return simulate_synapse(syn, record_components=record_components, iterations=1000)
 
 def synaptic_cleft_metabolize(rs=[0.01, 0.1, 0.5, 1.0, 2.0]):
+    syn = Synapse(verbose=args.verbose)
+    syn.synaptic_cleft.set_concentration(1.0)
+
+    results = dict(sweep(syn, metabolize, rs))
     data = []
+    for r in rs: data += results[r]
+    if not args.silent:
+        plot(data, title="Metabolize (enzyme concentration)") #, file_name="metabolize.jpg")
 
-    for r in rs:
-        syn = Synapse(verbose=args.verbose)
-        syn.set_enzyme_concentration(r)
-        syn.synaptic_cleft.set_concentration(1.0)
+# Concentrations of the two molecule synapse of complex_bind after the given
+#     number of steps: glutamate and GABA in the cleft, bound AMPA, GABA and
+#     NMDA receptors, and the axon.
+COMPLEX_BIND_REFERENCE = [
+    (2, [0.4638809054193669, 0.3982608695652174, 0.11647058823529412,
+         0.09509433962264154, 0.050769230769230775, 0.6338968723584109]),
+    (10, [0.24944483594192635, 0.38452569154370725, 0.036546949917037885,
+         0.12245874321963296, 0.013561677506633556, 0.8360635069815955]),
+]
 
-        record_components = [(
-            "metabolize %s" % str(r),
-            syn.synaptic_cleft)]
+def two_molecule_synapse():
+    syn = Synapse(active_molecules=[Molecule_IDs.GLUTAMATE, Molecule_IDs.GABA],
+        verbose=args.verbose)
+    syn.set_enzyme_concentration(0.5)
+    syn.synaptic_cleft.set_concentration(0.6, Molecule_IDs.GLUTAMATE)
+    syn.synaptic_cleft.set_concentration(0.4, Molecule_IDs.GABA)
 
-        data += simulate_synapse(syn, record_components=record_components, iterations=1000)
-    if not args.silent:
-        plot(data, title="Metabolize (enzyme concentration)") #, file_name="metabolize.jpg")
+    # GABA inhibits the transporter, so that the axon competes for both
+    #     molecules, but only takes up glutamate.
+    transporter = Transporter(Molecule_IDs.GLUTAMATE)
+    transporter.add_reuptake_inhibitor(Molecule_IDs.GABA, 0.5)
+    axon = syn.create_axon(transporter=transporter, replenish_rate=0.0,
+        verbose=args.verbose)
+    axon.set_concentration(0.5)
+
+    for receptor in (Receptors.AMPA, Receptors.GABA, Receptors.NMDA):
+        syn.create_dendrite(receptor=receptor, density=0.5,
+            verbose=args.verbose)
+    return syn
+
+def concentrations(syn):
+    cleft = syn.synaptic_cleft
+    return [cleft.get_concentration(Molecule_IDs.GLUTAMATE),
+            cleft.get_concentration(Molecule_IDs.GABA)] \
+        + [dendrite.get_concentration() for dendrite in syn.dendrites] \
+        + [syn.axon.get_concentration()]
+
+def complex_bind():
+    mol_ids = [Molecule_IDs.GLUTAMATE, Molecule_IDs.GABA]
+    receptors = [Receptors.AMPA, Receptors.GABA, Receptors.NMDA]
+    if affinity_matrix(receptors, mol_ids).tolist() != \
+            [[0.8, 0.0], [0.0, 0.9], [0.4, 0.0]]:
+        raise AssertionError("Affinity matrix does not match the receptors")
+    blocked = Receptor(Molecule_IDs.GLUTAMATE, 0.8, None)
+    blocked.add_antagonist(Molecule_IDs.GABA, 0.3)
+    agonists, antagonists = receptor_masks([Receptors.AMPA, blocked], mol_ids)
+    if agonists.tolist() != [[True, False], [True, False]] \
+            or antagonists.tolist() != [[False, False], [False, True]]:
+        raise AssertionError("Receptor masks do not match the receptors")
+
+    syn = two_molecule_synapse()
+    time = 0
+    for steps,expected in COMPLEX_BIND_REFERENCE:
+        while time < steps:
+            syn.step()
+            time += 1
+        if not allclose(concentrations(syn), expected, rtol=0, atol=1e-12):
+            raise AssertionError("Concentrations after %d steps do not match" % steps)
+
+    # The compiled binding is rebuilt when a dendrite is added, or the axon
+    #     is replaced.
+    cleft = syn.synaptic_cleft
+    dendrite = syn.create_dendrite(receptor=Receptors.AMPA, density=0.25)
+    cleft.bind(syn.dendrites, syn.axon)
+    if cleft.binding[0] != len(syn.dendrites) or dendrite.get_concentration() == 0.0:
+        raise AssertionError("Binding was not compiled for the new dendrite")
+    old_axon = syn.axon
+    old_concentration = old_axon.get_concentration()
+    axon = syn.create_axon(replenish_rate=0.0)
+    axon.set_concentration(0.0)
+    cleft.bind(syn.dendrites, syn.axon)
+    if cleft.binding[1] is not axon or axon.get_concentration() == 0.0 \
+            or old_axon.get_concentration() != old_concentration:
+        raise AssertionError("Binding was not compiled for the new axon")
+    print("Two molecule binding matches the reference.")
 
 def main():
+    complex_bind()
     synaptic_cleft_metabolize()
 
 def set_options():
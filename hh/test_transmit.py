@@ -1,4 +1,8 @@
 import argparse
+from collections import deque
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from plot import plot
 
@@ -6,6 +10,7 @@ from synapse import Synapse
 from neuron import Neuron
 from soma import Soma
 from neuron_factory import NeuronFactory, ActivationPulseDriver
+from checkpoint import checkpoint, restore
 
 def transmit(strength=0.25, delays=[None, 100]):
     data = []
@@ -40,9 +45,86 @@ def transmit(strength=0.25, delays=[None, 100]):
             data.append(neuron_factory.get_probe_data(name))
         plot(data, title="Synaptic transmission")
 
+class QueueAxon:
+    def __init__(self, axon, delay, baseline=-65.0):
+        """
+        Steps an undelayed |axon| through a queue of |delay| voltages, as
+            delayed axons did before the delay line.
+        """
+        self.axon = axon
+        self.queue = deque([baseline] * delay)
+
+    def step(self, voltage=None):
+        self.queue.appendleft(voltage)
+        return self.axon.step(voltage=self.queue.pop())
+
+def long_delay(strength=0.25, delay=4000):
+    # The delay outlasts the activity of the presynaptic neuron, so its spike
+    #     is held until the neuron is stepped again.  The post neuron must
+    #     match one behind an axon with a queue.
+    data = []
+    for queued in (False, True):
+        neuron_factory = NeuronFactory()
+        pre_neuron = neuron_factory.create_neuron()
+        name = "post delay: %d%s" % (delay, " (queue)" if queued else "")
+        post_neuron = neuron_factory.create_neuron(probe_name=name)
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            axon_delay=None if queued else delay)
+        if queued:
+            pre_neuron.axons[0] = QueueAxon(pre_neuron.axons[0], delay)
+        neuron_factory.register_driver(pre_neuron,
+            ActivationPulseDriver(activation=strength, period=6000, length=1, decrement=0.01))
+        neuron_factory.step(args.iterations)
+        data.append(neuron_factory.get_probe_data(name))
+
+    if data[0][1] != data[1][1]:
+        raise AssertionError("Delay line does not match the axon queue")
+    print("Delay line matches the axon queue.")
+    if not args.silent:
+        plot(data, title="Long delay")
+
+def resume(strength=0.25, delay=300):
+    # The driver decays its activation with each pulse, and hands it to the
+    #     soma through a shared value, so both must come back as they were.
+    #     The spikes pending in the delay line are read by the axon through
+    #     the environment, which must be the restored one.
+    data = []
+    for interrupted in (False, True):
+        neuron_factory = NeuronFactory()
+        pre_neuron = neuron_factory.create_neuron(probe_name="pre")
+        post_neuron = neuron_factory.create_neuron(probe_name="post")
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            axon_delay=delay)
+        neuron_factory.register_driver(pre_neuron,
+            ActivationPulseDriver(activation=strength, period=500, length=1, decrement=0.01))
+        neuron_factory.step(args.iterations / 2)
+
+        if interrupted:
+            directory = mkdtemp()
+            try:
+                path = join(directory, "transmit.checkpoint")
+                checkpoint(neuron_factory, path)
+                neuron_factory = restore(path)
+            finally: rmtree(directory)
+            environment = neuron_factory.neuron_environment
+            if neuron_factory.synapses[0].axon.environment is not environment:
+                raise AssertionError("Axon does not read the restored delay line")
+            if not environment.delay_line.buffer.any():
+                raise AssertionError("No spike is pending at the checkpoint")
+
+        neuron_factory.step(args.iterations - args.iterations / 2)
+        data.append([neuron_factory.get_probe_data(name)[1]
+            for name in ("pre", "post")])
+
+    if data[0] != data[1]:
+        raise AssertionError("Restored run does not match")
+    print("Restored run matches the uninterrupted run.")
+
 def main():
     #transmit(strength = 0.25)
     transmit(strength = 0.25, delays=[None])
+    long_delay()
+    if args.checkpoint: resume()
     #transmit(strength = 0.1, delays=[None])
 
 def set_options():
@@ -57,6 +139,9 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 10000, help = 
     """table""")
+    parser.add_argument("-c", "--checkpoint", action = "store_true", help = 
+    """checkpoint halfway through, and compare the restored run with an
+    uninterrupted one""")
 
     return parser.parse_args()
 
@@ -3,8 +3,9 @@
 # Models a receptor pool of a postsynaptic neuron, to which neurotransmitters
 #     from the synaptic cleft bind, modifying the membrane potential of the cell.
 
-from multiprocessing import Value
+from ctypes import c_double
 from molecule import Receptors
+from shared import shared_value
 
 class Dendrite:
     def __init__(self, receptor=Receptors.AMPA, density=1.0,
@@ -22,9 +23,16 @@ class Dendrite:
         self.density = density
         self.affinities = receptor.affinities
         self.strength = strength
-        self.bound = Value('d', 0.0)
+        self.bound = c_double(0.0)
         self.verbose = verbose
 
+    def share(self):
+        """
+        Moves the bound concentration into shared memory, for worker
+            processes.
+        """
+        self.bound = shared_value(self.bound)
+
     def get_concentration(self, mol_id=None):
         """
         NEEDS TO BE THREAD SAFE
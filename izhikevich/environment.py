@@ -15,12 +15,15 @@
 #     When a timestep is run, the buffers shift.
 # Values are retrieved from the pervious array and set to the next array.
 #
-# All concentration/voltage and dirty values are thread safe.
-# To speed them up, the locks are disabled.  There should be no instances of
-#     multiple threads trying to change a value.
+# All concentration/voltage and dirty values are thread safe once shared
+#     with worker processes (see shared.py).  To speed them up, the locks are
+#     disabled.  There should be no instances of multiple threads trying to
+#     change a value.  Until then, they are kept in lists, and are stored as
+#     floats, as they would be in shared memory.
 
 from random import betavariate
-from multiprocessing import Value, Array
+from ctypes import c_byte
+from shared import shared_list, shared_value
 
 def betav(maximum, noise=0.5, rate=1.0):
     if rate < 0.0 or noise < 0.0: raise ValueError
@@ -31,23 +34,31 @@ def betav(maximum, noise=0.5, rate=1.0):
 
 class SynapseEnvironment:
     def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+        self.noise = noise
 
         self.prev_concentrations = []
         self.next_concentrations = []
 
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
+
     def initialize(self):
-        # Create thread safe arrays.
-        self.prev_concentrations = Array('d', self.prev_concentrations, lock=False)
-        self.next_concentrations = Array('d', self.next_concentrations, lock=False)
-        self.dirty = Value('b', True, lock=False)
-        
+        self.dirty = c_byte(True)
+
+    def share(self):
+        """
+        Moves the concentrations into shared memory, for worker processes.
+        """
+        try: self.dirty
+        except: self.initialize()
+        self.prev_concentrations = shared_list(self.prev_concentrations)
+        self.next_concentrations = shared_list(self.next_concentrations)
+        self.dirty = shared_value(self.dirty)
+
     def register(self, baseline_concentration):
         pool_id = len(self.prev_concentrations)
-        self.prev_concentrations.append(baseline_concentration)
-        self.next_concentrations.append(baseline_concentration)
+        self.prev_concentrations.append(float(baseline_concentration))
+        self.next_concentrations.append(float(baseline_concentration))
         return pool_id
 
     def get_concentration(self, pool_id):
@@ -58,7 +69,7 @@ class SynapseEnvironment:
     def set_concentration(self, pool_id, new_concentration):
         try: self.dirty.value = True
         except: self.initialize()
-        self.next_concentrations[pool_id] = new_concentration
+        self.next_concentrations[pool_id] = float(new_concentration)
 
     def add_concentration(self, pool_id, molecules):
         try: self.dirty.value = True
@@ -88,23 +99,27 @@ class SynapseEnvironment:
 
 class NeuronEnvironment:
     def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+        self.noise = noise
 
         self.prev_voltages = []
         self.next_voltages = []
-        self.dirty = Value('b', True, lock=False)
+        self.dirty = c_byte(True)
 
-    def initialize(self):
-        # Create thread safe arrays.
-        self.prev_voltages = Array('d', self.prev_voltages, lock=False)
-        self.next_voltages = Array('d', self.next_voltages, lock=False)
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
+
+    def share(self):
+        """
+        Moves the voltages into shared memory, for worker processes.
+        """
+        self.prev_voltages = shared_list(self.prev_voltages)
+        self.next_voltages = shared_list(self.next_voltages)
+        self.dirty = shared_value(self.dirty)
 
     def register(self, baseline_voltage=0.0):
         neuron_id = len(self.prev_voltages)
-        self.prev_voltages.append(baseline_voltage)
-        self.next_voltages.append(baseline_voltage)
+        self.prev_voltages.append(float(baseline_voltage))
+        self.next_voltages.append(float(baseline_voltage))
         return neuron_id
 
     def get_voltage(self, neuron_id):
@@ -112,7 +127,7 @@ class NeuronEnvironment:
 
     def set_voltage(self, neuron_id, new_voltage):
         self.dirty.value = True
-        self.next_voltages[neuron_id] = new_voltage
+        self.next_voltages[neuron_id] = float(new_voltage)
 
     def adjust_voltage(self, neuron_id, delta):
         self.dirty.value = True
@@ -1,11 +1,12 @@
 # Neuron Model
 
-from multiprocessing import Value
+from ctypes import c_double
 from enum import enum
 from soma import Soma
 from synapse import Synapse
 from molecule import Transporters, Receptors
 from photoreceptor import PhotoreceptorSoma
+from shared import shared_value
 
 NeuronTypes = enum(
     PHOTORECEPTOR = 0,
@@ -28,7 +29,7 @@ class Neuron:
 
         # Inputs
         self.dendrites = []
-        self.external_activation = Value('d', 0.0)
+        self.external_activation = c_double(0.0)
         self.internal_activation = 0.0
         self.gap_junctions = []
         self.active_gap_junctions = False
@@ -41,6 +42,16 @@ class Neuron:
         self.soma_stable = False
         self.synapses_stable = []
 
+    def share(self):
+        """
+        Moves the external activation, the bound concentrations of the
+            dendrites and the environments of the output synapses into
+            shared memory, for worker processes.
+        """
+        self.external_activation = shared_value(self.external_activation)
+        for dendrite in self.dendrites: dendrite.share()
+        for synapse in self.synapses: synapse.environment.share()
+
     def external_activate(self, delta):
         self.external_activation.value += delta
 
@@ -8,18 +8,28 @@
 # 
 # Probes can be added to any component to take measurements of voltage, current,
 #     or concentration over the course of the simulation.
+#
+# With multiple threads, each worker process steps one partition of the
+#     neurons (see partition.py).  By default, neurons are partitioned by
+#     cutting the graph of synapses and gap junctions, so that few values
+#     cross processes.  The factory moves the environments and the inputs of
+#     the neurons into shared memory before starting the workers (see
+#     shared.py).  Without workers, all of the state of the factory is
+#     private memory, so a forked copy of the factory (see sweep.py) is kept
+#     apart from the original by copy-on-write.
 
 from multiprocessing import Array, Process
-from math import ceil
 from environment import NeuronEnvironment
 from neuron import Neuron, NeuronTypes
 from molecule import Transporters, Receptors, Molecule_IDs
+from partition import partition, PartitionTypes
 
 class NeuronFactory:
-    def __init__(self, num_threads=1):
+    def __init__(self, num_threads=1, partition_type=PartitionTypes.GRAPH):
         self.neuron_environment = NeuronEnvironment()
         self.neurons = []
         self.synapses = []
+        self.grids = []
 
         self.drivers = {}
         self.neuron_drivers = {}
@@ -28,10 +38,10 @@ class NeuronFactory:
         self.concentration_probes = {}
 
         self.num_threads = num_threads
+        self.partition_type = partition_type
         self.time = 0
 
     def initialize(self):
-        self.neuron_environment.initialize()
         self.num_threads = min(self.num_threads, len(self.neurons))
 
         if self.num_threads == 1:
@@ -39,17 +49,22 @@ class NeuronFactory:
             self.active = [True] * len(self.neurons)
         else:
             self.multithreaded = True
+            # Move the state read and written by the workers into shared
+            #     memory.
+            self.neuron_environment.share()
+            for neuron in self.neurons: neuron.share()
+
             # Create the boolean buffers
             self.active = Array('b', [True] * len(self.neurons), lock=False)
-            length = int(ceil(float(len(self.neurons)) / self.num_threads))
 
             # Create workers
+            # Each worker steps one partition of the neurons.
+            self.partitions = self.partition_neurons()
             self.workers = []
-            for i in xrange(self.num_threads):
-                start_index,stop_index = (i * length, min(len(self.neurons), (i+1)*length))
+            for neuron_ids in self.partitions:
                 self.workers.append(Process(
                     target=self.work,
-                    args=(start_index, stop_index)))
+                    args=(neuron_ids,)))
 
         # Activate drivers
         # Drivers do not step the neuron, but modify it to prepare for
@@ -61,6 +76,20 @@ class NeuronFactory:
         if self.multithreaded:
             for worker in self.workers: worker.start()
 
+    def partition_neurons(self):
+        """
+        Splits the neurons between the workers according to the partition
+            type.  Returns a list of neuron ids for each worker.
+        """
+        edges = [(neuron.neuron_id, synapse.postsynaptic_id)
+                    for neuron in self.neurons
+                        for synapse in neuron.synapses] \
+              + [(neuron.neuron_id, other.neuron_id)
+                    for neuron in self.neurons
+                        for other,_ in neuron.gap_junctions]
+        return partition(self.partition_type, len(self.neurons),
+            self.num_threads, edges, self.grids)
+
     def close(self):
         if self.multithreaded:
             for worker in self.workers: worker.terminate()
@@ -103,9 +132,9 @@ class NeuronFactory:
             for i in xrange(len(self.active)):
                 self.active[i] = True
 
-    def work(self, start_index, stop_index):
+    def work(self, neuron_ids):
         while True:
-            for neuron_id in xrange(start_index, stop_index):
+            for neuron_id in neuron_ids:
                 if self.active[neuron_id]:
                     self.neurons[neuron_id].step()
                     self.active[neuron_id] = False
@@ -132,6 +161,7 @@ class NeuronFactory:
             for j in xrange(width):
                 row.append(self.create_neuron(base_current, neuron_type))
             output.append(row)
+        self.grids.append(output)
         return output
 
     def create_synapse(self, pre_neuron, post_neuron,
@@ -0,0 +1,105 @@
+# Partitioning
+#
+# Assigns neurons to worker processes.  Neurons connected by synapses or gap
+#     junctions should be stepped by the same worker, so that the values one
+#     worker writes are mostly read by the same worker, and only values at
+#     the boundaries between partitions are shared between processes.
+#
+# Contiguous partitioning splits the neurons into ranges of neuron ids.
+#
+# Graph partitioning orders the neurons with the reverse Cuthill-McKee
+#     algorithm, which places connected neurons close together in the order,
+#     and cuts the order into parts of equal size.  Disconnected groups of
+#     neurons are never split unless they must be for balance.
+#
+# Grid partitioning splits the grids made by create_neuron_grid into spatial
+#     tiles.  Cells at the same relative position in different grids belong
+#     to the same tile, so layers connected point to point are not cut.
+#     Neurons outside of grids join the part holding most of their
+#     neighbors, or the smallest part if they have none.
+
+from math import ceil
+from numpy import ones, zeros
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from enum import enum
+
+PartitionTypes = enum(
+    CONTIGUOUS = 0,
+    GRAPH = 1,
+    GRID = 2
+)
+
+def partition(partition_type, size, parts, edges=[], grids=[]):
+    """
+    Partitions |size| neurons into |parts| sorted lists of neuron ids, using
+        the given |partition_type|.
+    |edges| are pairs of connected neuron ids, and |grids| are the grids of
+        neurons made by create_neuron_grid.
+    """
+    if partition_type == PartitionTypes.CONTIGUOUS:
+        return partition_contiguous(size, parts)
+    elif partition_type == PartitionTypes.GRAPH:
+        return partition_graph(size, parts, edges)
+    elif partition_type == PartitionTypes.GRID:
+        return partition_grid(size, parts, edges, grids)
+    else: raise ValueError
+
+def partition_contiguous(size, parts):
+    length = int(ceil(float(size) / parts))
+    return [range(i * length, min(size, (i+1) * length)) for i in xrange(parts)]
+
+def connectivity(size, edges):
+    """
+    Builds the symmetric adjacency matrix of |size| neurons from |edges|.
+    """
+    rows = [a for a,b in edges] + [b for a,b in edges]
+    columns = [b for a,b in edges] + [a for a,b in edges]
+    return csr_matrix((ones(len(rows)), (rows, columns)), shape=(size, size))
+
+def partition_graph(size, parts, edges):
+    order = reverse_cuthill_mckee(connectivity(size, edges), symmetric_mode=True)
+    bounds = [size * i // parts for i in xrange(parts + 1)]
+    return [sorted(order[bounds[i]:bounds[i+1]].tolist()) for i in xrange(parts)]
+
+def tile_shape(height, width, parts):
+    """
+    Returns the number of tile rows and columns to split a |height| by |width|
+        grid into |parts| tiles that are as close to square as possible.
+    """
+    best = None
+    for rows in xrange(1, parts + 1):
+        if parts % rows: continue
+        columns = parts // rows
+        aspect = abs(float(height) / rows - float(width) / columns)
+        if best is None or aspect < best[0]: best = (aspect, rows, columns)
+    return best[1:]
+
+def partition_grid(size, parts, edges, grids):
+    owners = -ones(size, dtype=int)
+    if len(grids) > 0:
+        # Tile the largest grid, and map other grids onto its tiles.
+        height, width = max((len(grid), len(grid[0])) for grid in grids)
+        tile_rows, tile_columns = tile_shape(height, width, parts)
+        for grid in grids:
+            for i,row in enumerate(grid):
+                for j,neuron in enumerate(row):
+                    owners[neuron.neuron_id] = \
+                        (i * tile_rows // len(grid)) * tile_columns \
+                        + (j * tile_columns // len(row))
+
+    # Assign remaining neurons by their neighbors.
+    counts = [(owners == part).sum() for part in xrange(parts)]
+    graph = connectivity(size, edges)
+    for neuron_id in (owners < 0).nonzero()[0].tolist():
+        neighbors = owners[graph.indices[
+            graph.indptr[neuron_id]:graph.indptr[neuron_id+1]]]
+        neighbors = neighbors[neighbors >= 0]
+        if len(neighbors) > 0:
+            votes = zeros(parts, dtype=int)
+            for part in neighbors.tolist(): votes[part] += 1
+            part = votes.argmax()
+        else: part = counts.index(min(counts))
+        owners[neuron_id] = part
+        counts[part] += 1
+    return [(owners == part).nonzero()[0].tolist() for part in xrange(parts)]
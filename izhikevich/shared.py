@@ -0,0 +1,22 @@
+# Shared Memory
+#
+# Factories with worker processes keep the state that their workers read and
+#     write in shared memory made by multiprocessing.  Components keep their
+#     values in lists, and their flags and values as ctypes values, and a
+#     factory moves them into shared memory with share() before it starts
+#     its workers.  Factories without workers share nothing, so forked
+#     copies of them (see sweep.py) are kept apart by copy-on-write.
+
+from multiprocessing import Array, Value
+
+def shared_list(values):
+    """
+    Returns a copy of the list of float |values| in shared memory.
+    """
+    return Array('d', values, lock=False)
+
+def shared_value(value):
+    """
+    Returns a copy of the ctypes |value| in shared memory.
+    """
+    return Value(value._type_, value.value, lock=False)
@@ -1,4 +1,7 @@
 import argparse
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from plot import plot
 
@@ -6,6 +9,7 @@ from synapse import Synapse
 from neuron import Neuron
 from soma import Soma
 from neuron_factory import NeuronFactory, ActivationPulseDriver
+from checkpoint import checkpoint, restore
 
 def transmit(strength=0.25, delays=[None, 100]):
     data = []
@@ -41,9 +45,46 @@ def transmit(strength=0.25, delays=[None, 100]):
             data.append(neuron_factory.get_probe_data(name))
         plot(data, title="Synaptic transmission")
 
+def resume(strength=100, delay=90):
+    # The checkpoint is taken while a spike is still queued in the axon, so
+    #     the restored queue must deliver it on time.  The synaptic cleft
+    #     must also keep binding and metabolizing through its own methods.
+    data = []
+    for interrupted in (False, True):
+        neuron_factory = NeuronFactory()
+        pre_neuron = neuron_factory.create_neuron(probe_name="pre")
+        post_neuron = neuron_factory.create_neuron(probe_name="post")
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            axon_delay=delay, dendrite_strength=25)
+        neuron_factory.register_driver(pre_neuron,
+            ActivationPulseDriver(activation=strength, period=100, length=1, delay=25))
+        neuron_factory.step(args.iterations / 2)
+
+        if interrupted:
+            if not any(neuron_factory.neurons[0].axons[0].spike_queue):
+                raise AssertionError("No spike is queued at the checkpoint")
+            directory = mkdtemp()
+            try:
+                path = join(directory, "transmit.checkpoint")
+                checkpoint(neuron_factory, path)
+                neuron_factory = restore(path)
+            finally: rmtree(directory)
+            cleft = neuron_factory.synapses[0].synaptic_cleft
+            if cleft.bind.im_self is not cleft:
+                raise AssertionError("Synaptic cleft is bound to another cleft")
+
+        neuron_factory.step(args.iterations - args.iterations / 2)
+        data.append([neuron_factory.get_probe_data(name)[1]
+            for name in ("pre", "post")])
+
+    if data[0] != data[1]:
+        raise AssertionError("Restored run does not match")
+    print("Restored run matches the uninterrupted run.")
+
 def main():
     #transmit(strength = -0.5)
     transmit(strength = 100, delays=[None])
+    if args.checkpoint: resume()
     #transmit(strength = 0.1, delays=[None])
 
 def set_options():
@@ -58,6 +99,9 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 1000, help = 
     """table""")
+    parser.add_argument("-c", "--checkpoint", action = "store_true", help = 
+    """checkpoint halfway through, and compare the restored run with an
+    uninterrupted one""")
 
     return parser.parse_args()
 
@@ -3,30 +3,13 @@
 # Models the axon of a presynaptic neurons, which pumps and reuptakes
 #     neurotransmitters into and out of the synaptic cleft.
 
-from collections import deque
-from sys import maxint
-from scipy.stats import erlang
 from molecule import Transporters
 
-er = erlang(2)
-
-def erlang_generator():
-    """
-    Creates an erlang generator.
-    """
-    prev = 0.0
-
-    for x in xrange(1, maxint):
-        curr = er.cdf(x)
-        diff = curr - prev
-        if diff < 0.001: break
-        prev = curr
-        yield diff
-
 class Axon:
     def __init__(self, synaptic_cleft, transporter=Transporters.GLUTAMATE,
                         reuptake_rate=0.5, capacity=1.0, replenish_rate=0.1,
-                        delay=0, spiking=True, verbose=False):
+                        delay=0, spiking=True, environment=None,
+                        source_id=None, verbose=False):
         """
         Axons keep track of activation and release neurotransmitters over
             time.  Neurotransmitters are regenerated via reuptake and
@@ -39,8 +22,9 @@ class Axon:
         |capacity| is the neurotransmitter capacity in the axon vesicles.
         |replenish_rate| controls the regeneration of neurotransmitter 
             over time.  Higher values increase rate of restoration.
-        |delay| specifies how long it takes the axon to respond, and sets
-            the size of a queue.
+        |delay| specifies how long it takes the axon to respond.  Delayed
+            voltages of the presynaptic soma |source_id| are read from the
+            delay line of the |environment|.
 
         Axons respond directly to the voltage of the neuron, and have both a
             threshold minimum voltage for activity, and a ceiling for voltage.
@@ -63,17 +47,17 @@ class Axon:
         self.replenish_rate = replenish_rate
 
         if spiking:
-            self.release_generator = None
+            self.accumulator = environment.release_accumulator
+            self.release_column = self.accumulator.register()
             self.release_function = self.spike_release
         else:
             self.release_function = self.graded_release
 
-        if delay:
-            self.delay_queue = deque()
-            for _ in xrange(delay):
-                self.delay_queue.appendleft(-70.0)
-        else:
-            self.delay_queue = None
+        self.delay = delay or 0
+        self.environment = environment
+        self.source_id = source_id
+        if self.delay:
+            self.column = environment.delay_line.register(source_id, self.delay)
 
         self.verbose = verbose
 
@@ -93,35 +77,22 @@ class Axon:
         """
         Cycles the axon.
         """
-        # If there is a delay, use the queue.
-        try:
-            self.delay_queue.appendleft(voltage)
-            # Remove voltage from queue.
-            voltage = self.delay_queue.pop()
-        except AttributeError: pass
+        # If there is a delay, read the voltage from the delay line.
+        if self.delay:
+            voltage = self.environment.delay_line.get(self.column, self.delay)
 
         stable = self.replenish()
         stable &= self.release(voltage)
         return self.synaptic_cleft.step() & stable
 
     def spike_release(self, voltage):
-        # If the voltage exceeds the threshold for spiking, create a release
-        #     generator (erlang distribution).  Return the first call.
+        # If the voltage exceeds the threshold for spiking, add the release
+        #     kernel (erlang distribution) into the accumulator.
         if voltage > 30:
-            gen = erlang_generator()
-            self.release_generator = gen
-            return next(gen)
+            self.accumulator.spike(self.release_column)
 
-        # Otherwise, attempt to access the release generator, and return the
-        #     results of the next() call.  If that fails, the release is
-        #     complete for the previous spike, and 0.0 can be returned.
-        else:
-            try:
-                return next(self.release_generator)
-            except TypeError: return 0.0
-            except StopIteration:
-                self.release_generator = None
-                return 0.0
+        # Return the pending release for this timestep.
+        return self.accumulator.get(self.release_column)
 
     def graded_release(self, voltage):
         threshold = -150.0
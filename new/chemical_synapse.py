@@ -38,6 +38,12 @@ class ChemicalSynapse:
         for dendrite in self.dendrites:
             dendrite.activate(neuron)
 
+    def activation_env_ids(self):
+        """
+        Returns the environment ids read when activating dendrites.
+        """
+        return [dendrite.env_id for dendrite in self.dendrites]
+
     def set_probe(self, probe):
         self.probe = probe
 
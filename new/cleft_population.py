@@ -0,0 +1,265 @@
+# Cleft Population
+#
+# The cleft population steps many single molecule chemical synapses at once.
+#     The state of their axons and synaptic clefts is kept in flat arrays,
+#     indexed by cleft, and the dendrites of all clefts are kept in flat
+#     arrays grouped by cleft, like the rows of a sparse matrix.
+#
+# Stepping a set of clefts performs the same computations as stepping each
+#     synapse (axon replenishing and release, binding to the axon and
+#     dendrites, and metabolism), vectorized across the set.  Each cleft
+#     follows the same branches as SynapticCleft.simple_bind and
+#     metabolize_molecule, so the results are identical.
+#
+# Once built, the population owns the state of its synapses.  Use store()
+#     to copy it back into the synapse objects (eg for probes).
+
+from numpy import array, zeros, ones, arange, repeat, cumsum, bincount, \
+                  where, minimum, concatenate
+
+def ranges(indptr, rows):
+    """
+    Returns the positions of the entries of |rows|, given the row pointers
+        |indptr| of a grouped array, along with the number of entries of
+        each row.
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    total = counts.sum()
+    if total == 0: return zeros(0, dtype=int), counts
+    offsets = arange(total) - repeat(cumsum(counts) - counts, counts)
+    return repeat(starts, counts) + offsets, counts
+
+class CleftPopulation:
+    def __init__(self, synapses, environment):
+        """
+        Gathers the state of the single molecule chemical |synapses|.
+        Voltages, dendrite activations, delays, and pending releases are
+            kept in the |environment|.
+        """
+        self.environment = environment
+        self.synapses = synapses
+        axons = [synapse.axon for synapse in synapses]
+        clefts = [synapse.synaptic_cleft for synapse in synapses]
+
+        # Axons
+        self.source_ids = array([axon.source_id for axon in axons], dtype=int)
+        self.delays = array([axon.delay for axon in axons], dtype=int)
+        self.delay_columns = array(
+            [axon.column if axon.delay else 0 for axon in axons], dtype=int)
+        self.spiking = array(
+            [axon.release_function == axon.spike_release for axon in axons],
+            dtype=bool)
+        self.release_columns = array(
+            [axon.release_column if spiking else 0
+                for axon,spiking in zip(axons, self.spiking)], dtype=int)
+        self.capacity = array([axon.capacity for axon in axons], dtype=float)
+        self.density = array([axon.density for axon in axons], dtype=float)
+        self.axon_concentration = array(
+            [axon.concentration for axon in axons], dtype=float)
+        self.replenish_rate = array(
+            [axon.replenish_rate for axon in axons], dtype=float)
+        self.axon_affinity = array(
+            [axon.affinities[axon.native_mol_id] for axon in axons], dtype=float)
+
+        # Synaptic clefts
+        # Single molecule clefts metabolize with the first enzyme.
+        self.mol_ids = [cleft.active_molecules[0] for cleft in clefts]
+        self.concentration = array([cleft.concentrations[mol_id]
+            for cleft,mol_id in zip(clefts, self.mol_ids)], dtype=float)
+        self.enzyme = array([cleft.enzymes[0] for cleft in clefts], dtype=float)
+        self.metab_k = 1.0 - array(
+            [cleft.metab_rate for cleft in clefts], dtype=float)
+        self.stable = array([cleft.stable for cleft in clefts], dtype=bool)
+
+        # Dendrites
+        # Dendrites without receptors do not bind, but are still cleared when
+        #     the cleft is empty.
+        # When no axon transporters are available, the dendrites bind using
+        #     the affinity of the last dendrite with receptors.
+        indptr, env_ids, counts, affinities = ([0], [], [], [])
+        last_affinity = []
+        for cleft,mol_id in zip(clefts, self.mol_ids):
+            affinity = 0.0
+            for dendrite in cleft.dendrites:
+                env_ids.append(dendrite.env_id)
+                if dendrite.density == 0.0:
+                    counts.append(0.0)
+                    affinities.append(0.0)
+                else:
+                    affinity = dendrite.affinities[mol_id]
+                    counts.append(dendrite.density * affinity)
+                    affinities.append(affinity)
+            last_affinity.append(affinity)
+            indptr.append(len(env_ids))
+        self.dendrite_indptr = array(indptr, dtype=int)
+        self.dendrite_env_ids = array(env_ids, dtype=int)
+        self.dendrite_counts = array(counts, dtype=float)
+        self.receptive = self.dendrite_counts != 0.0
+        self.last_affinity = array(last_affinity, dtype=float)
+
+    def step(self, indices):
+        """
+        Steps the synapses at the sorted |indices|.
+        Returns an array of whether each of them is stable.
+        """
+        environment = self.environment
+
+        # Read voltages, from the delay line for delayed axons.
+        voltage = environment.get_many(self.source_ids[indices])
+        delays = self.delays[indices]
+        delayed = delays > 0
+        if delayed.any():
+            voltage[delayed] = environment.delay_line.get(
+                self.delay_columns[indices[delayed]], delays[delayed])
+
+        stable = self.replenish(indices)
+        stable &= self.release(indices, voltage)
+
+        # Stable clefts are not stepped, and report instability.
+        cleft_stable = self.stable[indices]
+        stepped = indices[~cleft_stable]
+        result = zeros(len(indices), dtype=bool)
+        if len(stepped) > 0:
+            done = self.bind(stepped) & self.metabolize(stepped)
+            self.stable[stepped] = done
+            result[~cleft_stable] = done
+        return result & stable
+
+    def replenish(self, indices):
+        """
+        Replenishes the axons at |indices| that are not at capacity.
+        Returns an array of whether each axon is stable (at capacity).
+        """
+        capacity = self.capacity[indices]
+        concentration = self.axon_concentration[indices]
+        rate = self.replenish_rate[indices]
+        missing = capacity - concentration
+
+        full = (missing <= 0.0) | (rate == 0.0)
+        snap = ~full & (missing < 0.001)
+        grow = ~(full | snap)
+        concentration = where(snap, capacity, concentration)
+        concentration = where(grow, concentration + rate * missing, concentration)
+        self.axon_concentration[indices] = concentration
+        return ~grow
+
+    def release(self, indices, voltage):
+        """
+        Releases neurochemical from the axons at |indices| into their clefts,
+            given the presynaptic |voltage| of each.
+        Returns an array of whether each axon is stable (no release).
+        """
+        release = zeros(len(indices))
+
+        # Spiking axons release from the accumulator.
+        spiking = self.spiking[indices]
+        if spiking.any():
+            accumulator = self.environment.release_accumulator
+            columns = self.release_columns[indices[spiking]]
+            spikes = voltage[spiking] > 30
+            if spikes.any(): accumulator.spike_many(columns[spikes])
+            release[spiking] = accumulator.get_many(columns)
+
+        # Graded axons release in proportion to the voltage.
+        graded = ~spiking
+        if graded.any():
+            threshold = -150.0
+            maximum = -82.0
+            graded_voltage = minimum(maximum, voltage[graded])
+            release[graded] = where(voltage[graded] < threshold, 0.0,
+                (graded_voltage - threshold) / (maximum - threshold))
+
+        released = minimum(self.axon_concentration[indices], release)
+        releasing = released != 0.0
+        if releasing.any():
+            targets = indices[releasing]
+            self.axon_concentration[targets] -= released[releasing]
+            self.concentration[targets] += released[releasing]
+            self.stable[targets] = False
+        return ~releasing
+
+    def bind(self, indices):
+        """
+        Binds molecules in the clefts at |indices| to axon transporters and
+            dendrite receptors.
+        Returns an array of whether nothing was bound to the dendrites.
+        """
+        environment = self.environment
+        concentration = self.concentration[indices]
+        result = zeros(len(indices), dtype=bool)
+
+        # Empty clefts clear their dendrites, and are unstable.
+        empty = concentration <= 0.0
+        if empty.any():
+            positions, _ = ranges(self.dendrite_indptr, indices[empty])
+            environment.set_many(self.dendrite_env_ids[positions],
+                zeros(len(positions)))
+        full = ~empty
+        if not full.any(): return result
+        indices = indices[full]
+        concentration = concentration[full]
+        positions, counts = ranges(self.dendrite_indptr, indices)
+        owners = repeat(arange(len(indices)), counts)
+        protein_counts = self.dendrite_counts[positions]
+        total_protein_count = bincount(owners, weights=protein_counts,
+            minlength=len(indices))
+        squared = concentration**2
+
+        # Axon reuptake
+        axon_concentration = self.axon_concentration[indices]
+        available = minimum(self.density[indices],
+            self.capacity[indices] - axon_concentration)
+        reuptake = available > 0.0
+        affinity = where(reuptake, self.axon_affinity[indices],
+            self.last_affinity[indices])
+        if reuptake.any():
+            axon_affinity = affinity[reuptake]
+            protein_count = available[reuptake] * axon_affinity
+            total = total_protein_count[reuptake] + protein_count
+            total_protein_count[reuptake] = total
+            k = (1 - (axon_affinity * (protein_count / total)))
+            bound = protein_count * squared[reuptake] \
+                / (concentration[reuptake] + k)
+            targets = indices[reuptake]
+            self.axon_concentration[targets] = axon_concentration[reuptake] + bound
+            self.concentration[targets] -= bound
+
+        # Dendrites
+        receptive = self.receptive[positions]
+        positions = positions[receptive]
+        owners = owners[receptive]
+        protein_counts = protein_counts[receptive]
+        k = (1 - (affinity[owners] * (protein_counts / total_protein_count[owners])))
+        bound = protein_counts * squared[owners] / (concentration[owners] + k)
+        environment.set_many(self.dendrite_env_ids[positions], bound)
+
+        total_bound = bincount(owners, weights=bound, minlength=len(indices))
+        result[full] = total_bound == 0.0
+        return result
+
+    def metabolize(self, indices):
+        """
+        Metabolizes the molecules in the clefts at |indices|.
+        Returns an array of whether each cleft is stable.
+        """
+        concentration = self.concentration[indices]
+        present = concentration > 0.0
+        trace = present & (concentration < 0.0001)
+        active = present & ~trace
+        destroyed = where(trace, concentration, 0.0)
+        destroyed[active] = self.enzyme[indices[active]] * concentration[active] \
+            / (concentration[active] + self.metab_k[indices[active]])
+        self.concentration[indices] = concentration - destroyed
+        return ~active
+
+    def store(self):
+        """
+        Copies the state of the population back into the synapse objects.
+        """
+        for i,synapse in enumerate(self.synapses):
+            axon = synapse.axon
+            cleft = synapse.synaptic_cleft
+            axon.concentration = float(self.axon_concentration[i])
+            cleft.concentrations[self.mol_ids[i]] = float(self.concentration[i])
+            cleft.stable = bool(self.stable[i])
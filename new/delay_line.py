@@ -0,0 +1,114 @@
+# Delay Line
+#
+# The delay line holds a history of presynaptic voltages, so that axons and
+#     synapses with a delay can read the voltage from |delay| timesteps ago
+#     with a single array lookup, rather than each keeping its own queue.
+#
+# The history of each source (presynaptic soma) is a column of a ring buffer
+#     with one row per timestep, and is as deep as the longest registered
+#     delay.  When the environment steps, it records the voltages of all of
+#     the sources into the row of the new timestep at once, along with
+#     whether their neurons were stepped, which the neurons mark when they
+#     step.  Memory grows with the number of source neurons, not the number
+#     of synapses.
+#
+# Delayed synapses see their source as it was |delay| timesteps ago: they are
+#     stepped by the neuron factory |delay| timesteps after each timestep on
+#     which their neuron was stepped, and on every timestep on which they
+#     are still unstable, like undelayed synapses are stepped with their
+#     neuron (see neuron_factory.py).  A delayed synapse therefore depends
+#     only on the history of its source, which is what lets groups of
+#     neurons run ahead of each other (see lookahead.py).
+#
+# Sources must be registered before the delay line is initialized.  With
+#     worker processes, the buffers and the head are then moved into shared
+#     memory, like the release accumulator.  Workers that run ahead of the
+#     main process (see lookahead.py) detach the delay line, keeping private
+#     copies, and copy in the history of sources stepped by other workers.
+
+from ctypes import c_long
+from numpy import array, arange, full, zeros, int8
+from shared import shared_copy, shared_value
+
+class DelayLine:
+    def __init__(self, baseline=-70.0):
+        """
+        Creates an empty delay line.
+        Values from before the first timestep are the |baseline| voltage.
+        """
+        self.baseline = baseline
+        self.sources = []
+        self.columns = dict()
+        self.depth = 1
+        self.buffer = None
+
+    def register(self, source_id, delay=0):
+        """
+        Registers a reader of |source_id| with the given |delay|.
+        Returns the column of the source in the buffer.
+        """
+        if self.buffer is not None:
+            raise RuntimeError("Cannot register with an initialized delay line")
+        if delay < 0: raise ValueError
+        self.depth = max(self.depth, delay+1)
+        try: return self.columns[source_id]
+        except KeyError:
+            column = len(self.sources)
+            self.columns[source_id] = column
+            self.sources.append(source_id)
+            return column
+
+    def initialize(self):
+        """
+        Allocates the buffers and head.
+        """
+        self.sources = array(self.sources, dtype=int)
+        width = len(self.sources)
+        self.head = c_long(0)
+        self.buffer = full((self.depth, width), self.baseline)
+        self.stepped = zeros((self.depth, width), dtype=int8)
+
+    def share(self):
+        """
+        Moves the buffers and head into shared memory.
+        """
+        self.head = shared_value(self.head)
+        self.buffer = shared_copy(self.buffer)
+        self.stepped = shared_copy(self.stepped)
+
+    def detach(self):
+        """
+        Replaces the shared buffers and head with private copies.
+        """
+        self.head = c_long(self.head.value)
+        self.buffer = self.buffer.copy()
+        self.stepped = self.stepped.copy()
+
+    def advance(self, values):
+        """
+        Moves to the next timestep, and records the voltages of the sources
+            from the environment |values|.
+        """
+        head = (self.head.value + 1) % self.depth
+        self.head.value = head
+        self.buffer[head] = values[self.sources]
+        self.stepped[head] = False
+
+    def mark(self, column):
+        """
+        Marks the source in |column| as stepped on the current timestep.
+        """
+        self.stepped[self.head.value, column] = True
+
+    def get(self, column, delay):
+        """
+        Returns the value of the source in |column| from |delay| timesteps
+            ago.  Both may be arrays.
+        """
+        return self.buffer[(self.head.value - delay) % self.depth, column]
+
+    def rows(self, count):
+        """
+        Returns the rows of the last |count| timesteps, oldest first.
+        """
+        return (self.head.value + arange(1 - count, 1)) % self.depth
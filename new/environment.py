@@ -12,16 +12,39 @@
 #     After registering, the neuron should stabilize its voltage and set it.
 #
 # An array is kept for previous and next values to avoid race conditions.
-#     When a timestep is run, the buffers shift.
+#     Both are rows of one array, and a shared index selects which row holds
+#     the previous values, so that a timestep swaps the buffers by flipping
+#     the index.  Worker processes see the swap without copying anything.
 # Values are retrieved from the pervious array and set to the next array.
 #
-# All concentration/voltage and dirty values are thread safe.
-# To speed them up, the locks are disabled.  There should be no instances of
-#     multiple threads trying to change a value.
+# Writes also mark their slot in a dirty array.  After the swap, only the
+#     dirty slots are copied back into the next buffer, which still holds
+#     their old values.  The dirty array is a flag per slot rather than a
+#     list of indices so that processes can mark slots without a lock.
+#     The env_ids copied by the last step are kept in |changed|, so that
+#     readers of those values can be woken.
+#
+# All concentration/voltage and dirty values are thread safe once shared
+#     with worker processes (see shared.py).  To speed them up, the locks are
+#     disabled.  There should be no instances of multiple threads trying to
+#     change a value.
+#
+# The environment also holds the delay line, which keeps a history of the
+#     voltages of delayed sources (presynaptic somas), recorded as each
+#     timestep starts, and the release accumulator, which holds the pending
+#     releases of spiking components.
+#
+# Recorded voltages are kept in a recording (see recording.py), which records
+#     a row of all recorded env_ids at each timestep.  Spikes of spiking
+#     env_ids are kept as events by a spike recorder.
 
 from random import betavariate
-from multiprocessing import Value, Array, Manager
-manager = Manager()
+from ctypes import c_byte
+from numpy import empty, zeros, flatnonzero, int8
+from delay_line import DelayLine
+from release import ReleaseAccumulator
+from recording import Recording, SpikeRecorder
+from shared import shared_copy, shared_value
 
 def betav(maximum, noise=0.5, rate=1.0):
     if rate < 0.0 or noise < 0.0: raise ValueError
@@ -32,47 +55,115 @@ def betav(maximum, noise=0.5, rate=1.0):
 
 class Environment:
     def __init__(self, noise=0.0):
-        def beta(maximum, rate=1.0):
-            return betav(maximum, noise=noise, rate=rate)
-        self.beta = beta
+        self.noise = noise
 
-        self.prev_values = []
-        self.next_values = []
-        self.dirty = Value('b', True, lock=False)
-        self.records = dict()
-        self.spikes = dict()
+        self.size = 0
+        self.values = empty((2, 0))
+        self.dirty = zeros(0, dtype=int8)
+        self.changed = zeros(0, dtype=int)
+        self.prev = c_byte(0)
+        self.records = Recording()
+        self.spikes = SpikeRecorder()
+        self.delay_line = DelayLine()
+        self.release_accumulator = ReleaseAccumulator()
+
+    def beta(self, maximum, rate=1.0):
+        return betav(maximum, noise=self.noise, rate=rate)
 
     def initialize(self):
-        # Create thread safe arrays.
-        self.prev_values = Array('d', self.prev_values, lock=False)
-        self.next_values = Array('d', self.next_values, lock=False)
+        # Trim the buffers to the registered env_ids.
+        self.values = self.values[:, :self.size].copy()
+        self.dirty = self.dirty[:self.size].copy()
+        self.delay_line.initialize()
+        self.release_accumulator.initialize()
+        self.records.initialize()
 
-        for key in self.records:
-            self.records[key] = manager.list()
-        for key in self.spikes:
-            self.spikes[key] = manager.list()
+    def share(self):
+        """
+        Moves the buffers into shared memory, for worker processes.
+        """
+        self.values = shared_copy(self.values)
+        self.dirty = shared_copy(self.dirty)
+        self.prev = shared_value(self.prev)
+        self.delay_line.share()
+        self.release_accumulator.share()
+
+    def detach(self):
+        """
+        Replaces the shared buffers with private copies, for a worker that
+            steps ahead of the other processes.
+        """
+        self.values = self.values.copy()
+        self.dirty = self.dirty.copy()
+        self.prev = c_byte(self.prev.value)
+        self.records.detach()
+        self.spikes.drain()
+        self.delay_line.detach()
+        self.release_accumulator.detach()
+
+    def resize(self, capacity):
+        """
+        Reallocates the buffers to hold |capacity| values.
+        """
+        values = empty((2, capacity))
+        values[:, :self.size] = self.values[:, :self.size]
+        self.values = values
+        dirty = zeros(capacity, dtype=int8)
+        dirty[:self.size] = self.dirty[:self.size]
+        self.dirty = dirty
 
     def register(self, initial=0.0, record=False, spiking=False):
-        env_id = len(self.prev_values)
-        self.prev_values.append(initial)
-        self.next_values.append(initial)
+        env_id = self.size
+        if env_id == self.values.shape[1]:
+            self.resize(max(16, 2 * env_id))
+        self.size += 1
+        self.values[:, env_id] = initial
+        self.dirty[env_id] = True
         if record:
             if spiking:
-                self.spikes[env_id] = True
+                self.spikes.register(env_id)
             else:
-                self.records[env_id] = True
+                self.records.register(env_id)
         return env_id
 
+    def get_record(self, env_id):
+        """
+        Returns a list of the recorded values of |env_id|.
+        Spiking env_ids are recorded as 1 when spiking and 0 otherwise.
+        """
+        if env_id in self.spikes: return self.spikes.dense(env_id)
+        return self.records.get(env_id)
+
+    def reserve(self, count):
+        """
+        Ensures that the recording has room for |count| more timesteps.
+        """
+        self.records.reserve(count)
+
     def get(self, env_id):
-        return self.prev_values[env_id]
+        return self.values.item(self.prev.value, env_id)
+
+    def get_many(self, env_ids):
+        return self.values[self.prev.value, env_ids]
 
     def set(self, env_id, new_voltage):
-        self.dirty.value = True
-        self.next_values[env_id] = new_voltage
+        # Only values that change are marked dirty, so that components
+        #     which set every timestep do not wake their readers.
+        row = 1 - self.prev.value
+        if self.values.item(row, env_id) != new_voltage:
+            self.dirty[env_id] = True
+            self.values[row, env_id] = new_voltage
+
+    def set_many(self, env_ids, new_values):
+        row = 1 - self.prev.value
+        changed = self.values[row, env_ids] != new_values
+        self.dirty[env_ids[changed]] = True
+        self.values[row, env_ids] = new_values
 
     def adjust(self, env_id, delta):
-        self.dirty.value = True
-        self.next_values[env_id] += delta
+        if delta != 0.0:
+            self.dirty[env_id] = True
+            self.values[1 - self.prev.value, env_id] += delta
 
     def step(self):
         """
@@ -80,14 +171,24 @@ class Environment:
         Returns whether the environment is stable (not dirty, no changes)
         """
         # Record any env_ids that have been set to record.
-        for env_id in self.records:
-            self.records[env_id].append(self.prev_values[env_id])
-        for env_id in self.spikes:
-            self.spikes[env_id].append(1 if self.prev_values[env_id] >= 30.0 else 0)
-
-        if self.dirty.value:
-            self.dirty.value = False
-            for i in xrange(len(self.prev_values)):
-                self.prev_values[i]=self.next_values[i]
-            return False
-        else: return True
+        prev = self.prev.value
+        if len(self.records.env_ids) > 0:
+            self.records.record(self.values[prev, self.records.env_ids])
+        self.spikes.record(self.values[prev])
+
+        dirty = flatnonzero(self.dirty[:self.size])
+        if len(dirty) > 0:
+            # Swap the buffers, and copy the dirty slots back into the next
+            #     buffer, which still holds their old values.
+            self.prev.value = 1 - prev
+            self.values[prev, dirty] = self.values[1 - prev, dirty]
+            self.dirty[dirty] = False
+            stable = False
+        else: stable = True
+        self.changed = dirty
+
+        # Move pending releases to the next timestep, and record the history
+        #     of delayed sources.
+        self.release_accumulator.advance()
+        self.delay_line.advance(self.values[self.prev.value])
+        return stable
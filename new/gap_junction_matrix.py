@@ -0,0 +1,62 @@
+# Gap Junction Matrix
+#
+# The gap junction matrix computes the gap current of many neurons at once.
+# Rows and columns are neurons, and values are the conductances of the
+#     junctions between them.  Every junction is stored in both directions,
+#     so the matrix is symmetric.
+#
+# The gap current of neuron i is the product of row i of the graph Laplacian
+#     with the voltage vector: the sum of g_ij * (v_j - v_i) over partners.
+#     It is evaluated in that form, one term per junction, rather than as
+#     (G v)_i - (sum_j g_ij) v_i, to avoid cancellation between large terms.
+#     Entries of each row keep the order in which junctions were created.
+
+from numpy import array, arange, repeat, bincount, zeros, cumsum
+from scipy.sparse import csr_matrix
+
+def row_entries(matrix, rows):
+    """
+    Returns the positions of the entries of |rows| in the data and indices
+        arrays of a csr |matrix|, in order, and the number of entries in
+        each row.  This avoids building a sliced matrix.
+    """
+    starts = matrix.indptr[rows]
+    counts = matrix.indptr[rows+1] - starts
+    ends = cumsum(counts)
+    positions = arange(ends[-1] if len(ends) else 0) \
+        + repeat(starts - (ends - counts), counts)
+    return positions, counts
+
+class GapJunctionMatrix:
+    def __init__(self, neurons, environment):
+        """
+        Builds the matrix from the gap junctions of |neurons|, which must
+            be ordered by neuron_id.
+        Voltages are read from the |environment|.
+        """
+        self.environment = environment
+        self.env_ids = array([neuron.soma.env_id for neuron in neurons], dtype=int)
+
+        indptr, indices, data = ([0], [], [])
+        for neuron in neurons:
+            for other,conductance in neuron.gap_junctions:
+                indices.append(other.neuron_id)
+                data.append(conductance)
+            indptr.append(len(indices))
+        self.matrix = csr_matrix(
+            (array(data, dtype=float), array(indices, dtype=int), indptr),
+            shape=(len(neurons), len(neurons)))
+
+    def gap_current(self, rows, voltage):
+        """
+        Computes the gap current of the neurons in |rows|, given an array of
+            the |voltage| of each of them.
+        """
+        positions, counts = row_entries(self.matrix, rows)
+        if len(positions) == 0: return zeros(len(rows))
+        partner_voltage = self.environment.get_many(
+            self.env_ids[self.matrix.indices[positions]])
+        difference = partner_voltage - repeat(voltage, counts)
+        return bincount(repeat(arange(len(rows)), counts),
+            weights=self.matrix.data[positions] * difference,
+            minlength=len(rows))
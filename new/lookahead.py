@@ -0,0 +1,71 @@
+# Lookahead
+#
+# Groups of neurons that only interact through delayed synapses do not need
+#     to be stepped in lockstep.  A delayed synapse sees its presynaptic
+#     neuron as it was |delay| timesteps ago (see delay_line.py), so if every
+#     synapse between groups has a delay of at least k, each group can step
+#     a window of k timesteps on its own, knowing the history of the other
+#     groups up to the start of the window.  After each window, the groups
+#     exchange the history that their neurons added to the delay line,
+#     rather than synchronizing on every timestep.  This holds for any
+#     synapses between groups, including feedback between layers.
+#
+# By default, the groups are the grids made by create_neuron_grid (eg the
+#     photoreceptor and ganglion layers), and every other neuron starts in
+#     a group of its own.  Neurons connected by gap junctions, or by synapses
+#     with a delay shorter than the minimum window, must be stepped
+#     together, so their groups are merged.
+#
+# The merged groups are assigned to partitions of about equal size, one for
+#     each worker, largest first.  The window is the minimum delay of the
+#     synapses between workers.
+
+from numpy import arange
+from scipy.sparse.csgraph import connected_components
+from partition import connectivity
+
+def lookahead_partition(size, parts, edges, groups=[], minimum=2):
+    """
+    Partitions |size| neurons into at most |parts| sorted lists of neuron ids
+        that can be stepped apart, starting from the given |groups|.
+    |edges| are (presynaptic id, postsynaptic id, delay) triples, with a
+        delay of zero for gap junctions.
+    Returns the partitions and the window, which is None if no synapses
+        cross between partitions.
+    """
+    partitions = assign_groups(merge_groups(size, edges, groups, minimum), parts)
+    owners = arange(size)
+    for i,neuron_ids in enumerate(partitions):
+        owners[neuron_ids] = i
+    delays = [delay for a,b,delay in edges if owners[a] != owners[b]]
+    if len(delays) == 0: return partitions, None
+    return partitions, min(delays)
+
+def merge_groups(size, edges, groups=[], minimum=2):
+    """
+    Merges the |groups| joined by |edges| with a delay below |minimum|.
+    Returns a list of sorted lists of neuron ids.
+    """
+    labels = arange(size)
+    for group in groups:
+        labels[group] = group[0]
+    tight = [(labels[a], labels[b]) for a,b,delay in edges if delay < minimum]
+    _, components = connected_components(
+        connectivity(size, tight), directed=False)
+    merged = dict()
+    for neuron_id,component in enumerate(components[labels].tolist()):
+        merged.setdefault(component, []).append(neuron_id)
+    return sorted(merged.values())
+
+def assign_groups(groups, parts):
+    """
+    Assigns |groups| to at most |parts| partitions, each group in turn to the
+        smallest partition, starting with the largest group.
+    Returns the non-empty partitions, as sorted lists of neuron ids.
+    """
+    partitions = [[] for _ in xrange(parts)]
+    for group in sorted(groups, key=len, reverse=True):
+        smallest = min(partitions, key=len)
+        smallest += group
+    return sorted(sorted(neuron_ids) for neuron_ids in partitions
+        if len(neuron_ids) > 0)
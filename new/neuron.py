@@ -1,11 +1,12 @@
 # Neuron Model
 
-from multiprocessing import Value
+from ctypes import c_double
 from enum import enum
 from soma import Soma, SOMA_TYPES
 from chemical_synapse import ChemicalSynapse
 from simple_synapse import SimpleSynapse
 from molecule import Molecules, Transporters, Receptors
+from shared import shared_value
 
 NeuronTypes = enum(
     PHOTORECEPTOR = 0,
@@ -41,25 +42,48 @@ class Neuron:
         self.in_synapses = []
         self.out_synapses = []
 
+        # Output synapses stepped by the neuron itself.
+        # The neuron factory steps synapses with a delay on its own (see
+        #     delay_line.py), and steps single molecule chemical synapses
+        #     together, in a cleft population, and sets the indices of those
+        #     belonging to this neuron in |cleft_indices|.
+        self.stepped_synapses = self.out_synapses
+        self.cleft_indices = None
+
+        # Column of the soma in the delay line, if it has delayed synapses.
+        # This is set by the neuron factory, and the soma is marked as stepped
+        #     whenever the output synapses are stepped.
+        self.delay_column = None
+
         # Gap junctions
         self.gap_junctions = []
         self.active_gap_junctions = False
 
+        # Array of gap currents, indexed by neuron_id.
+        # This is set by the neuron factory, which computes the gap currents
+        #     of the neurons it steps before stepping them.
+        self.gap_currents = None
+
         # Currents
         self.current = base_current
         self.base_current = base_current
         self.ligand_current = 0.0
-        self.external_current = Value('d', 0.0)
+        # The external current is set by drivers, which run in the main
+        #     process, so it is shared with workers by share().
+        self.external_current = c_double(0.0)
 
         # Active flags
         self.stable = False
         self.synapses_stable = []
 
     def get_record(self):
-        if self.spiking:
-            return self.environment.spikes[self.soma.env_id]
-        else:
-            return self.environment.records[self.soma.env_id]
+        return self.environment.get_record(self.soma.env_id)
+
+    def share(self):
+        """
+        Moves the external current into shared memory, for worker processes.
+        """
+        self.external_current = shared_value(self.external_current)
 
     def set_external_current(self, current):
         self.external_current.value = current
@@ -90,6 +114,11 @@ class Neuron:
         return gap_current
 
     def step(self, time):
+        """
+        Steps the neuron.
+        Returns whether it was unstable, in which case its output synapses
+            in a cleft population must be stepped as well.
+        """
         soma_voltage = self.soma.get_voltage()
         old_current = self.current
 
@@ -99,7 +128,10 @@ class Neuron:
 
         # Add gap current.
         if self.active_gap_junctions:
-            new_current += self.activate_gap_junctions(soma_voltage)
+            if self.gap_currents is None:
+                new_current += self.activate_gap_junctions(soma_voltage)
+            else:
+                new_current += self.gap_currents[self.neuron_id]
 
         # Add ligand current.
         new_current += self.activate_dendrites()
@@ -115,18 +147,23 @@ class Neuron:
         # If unstable, perform computations.
         if not self.stable:
             # Activate the output synapses
-            output_stable = all([synapse.step(soma_voltage) for synapse in self.out_synapses])
+            if self.delay_column is not None:
+                self.environment.delay_line.mark(self.delay_column)
+            output_stable = all([synapse.step(soma_voltage) for synapse in self.stepped_synapses])
             # Activate the soma
             self.stable = self.soma.step(new_current) & output_stable
+            return True
+        return False
 
     @staticmethod
     def create_synapse(presynaptic, postsynaptic, enzyme_concentration=1.0,
             transporter=Transporters.GLUTAMATE, receptor=Receptors.AMPA,
-            axon_delay=0, dendrite_strength=0.0015):
+            axon_delay=0, dendrite_strength=0.0015, chemical=False):
+        if chemical:
+            return Neuron.create_chemical_synapse(presynaptic, postsynaptic, enzyme_concentration,
+                transporter, receptor, axon_delay, dendrite_strength)
         return Neuron.create_simple_synapse(presynaptic, postsynaptic, enzyme_concentration,
             transporter, receptor, axon_delay, dendrite_strength)
-        #return Neuron.create_chemical_synapse(presynaptic, postsynaptic, enzyme_concentration,
-        #    transporter, receptor, axon_delay, dendrite_strength)
 
     @staticmethod
     def create_simple_synapse(presynaptic, postsynaptic, enzyme_concentration=1.0,
@@ -134,7 +171,7 @@ class Neuron:
             axon_delay=0, dendrite_strength=0.0015):
         synapse =  SimpleSynapse(postsynaptic.neuron_id, receptor, 
             presynaptic.spiking, axon_delay, dendrite_strength,
-            presynaptic.environment)
+            presynaptic.environment, presynaptic.soma.env_id)
 
         presynaptic.out_synapses.append(synapse)
         postsynaptic.in_synapses.append(synapse)
@@ -156,7 +193,9 @@ class Neuron:
                     reuptake_rate=0.5,
                     capacity=10.0,
                     delay=axon_delay,
-                    spiking = presynaptic.spiking)
+                    spiking = presynaptic.spiking,
+                    environment = presynaptic.environment,
+                    source_id = presynaptic.soma.env_id)
         dendrite = synapse.create_dendrite(
                     receptor=receptor,
                     density=0.25,
@@ -5,45 +5,184 @@
 #     components it holds.
 #
 # Drivers can be added to activate particular neurons at each timestep.
+#     They return the next time they need to be driven, or None if they are
+#     done, and are only called at those times.
+#
+# Each timestep only steps the neurons whose inputs may have changed:
+#     unstable neurons, neurons whose drivers ran, and neurons that read a
+#     value that changed in the environment (their own voltage, the voltage
+#     of gap junction partners, and the activation of input synapses).
+#     A stable neuron whose inputs have not changed would do nothing when
+#     stepped, so quiescent neurons cost nothing per timestep.
+#
+# The gap currents of the neurons to step are computed together, with one
+#     sparse Laplacian product, and shared with the neurons (and workers)
+#     through an array.
+#
+# Without workers, all of the state of the factory is private memory, so a
+#     forked copy of the factory (see sweep.py) is kept apart from the
+#     original by copy-on-write.  With workers, the factory moves the
+#     environment, the gap currents and the external currents into shared
+#     memory before starting them (see shared.py).
+#
+# Synapses with a delay are stepped by the factory rather than by their
+#     neuron: |delay| timesteps after each timestep on which their neuron
+#     was stepped, and then on every timestep while they are unstable (see
+#     delay_line.py).  They are kept in a schedule by timestep, like the
+#     drivers.
+#
+# Without workers, single molecule chemical synapses are stepped together in
+#     a cleft population, after the neurons that own them.  The state of the
+#     population is stored back into the synapses at the end of each call
+#     to step().
+#
+# With workers, each worker process owns a partition of the neurons (see
+#     partition.py).  By default, neurons are partitioned by cutting the graph
+#     of synapses and gap junctions, so that few values cross processes.
+#     Workers block on a pipe until the factory sends them a timestep, so
+#     idle workers do not use any CPU, and close() stops them cleanly.
+#
+# With lookahead, workers step groups of neurons that only interact through
+#     delayed synapses (see lookahead.py), in windows of timesteps instead of
+#     waiting for the factory every timestep.  All workers step each window
+#     at the same time, on private copies of the environment buffers.
+#     Synapses between workers are stepped by the worker of the
+#     postsynaptic neuron.  After each window, every worker publishes the
+#     delay line history of its neurons that other workers read, and before
+#     the next window, copies in the history of the neurons it reads, and
+#     schedules their synapses on the timesteps on which they were stepped.
+#     The window is no longer than the delay of any synapse between workers,
+#     so this history is always in time.  Drivers run in the workers, so
+#     drivers registered after initialization are sent to them, and the
+#     workers send back the values recorded in each window.
 
-from multiprocessing import Array, Process
-from math import ceil
+from multiprocessing import Process, Pipe
+from numpy import ones, zeros, array, arange, concatenate, \
+                  cumsum, logical_and, int8
+from scipy.sparse import csr_matrix, diags
 from environment import Environment
+from gap_junction_matrix import GapJunctionMatrix
+from cleft_population import CleftPopulation
+from chemical_synapse import ChemicalSynapse
+from partition import partition, PartitionTypes
+from lookahead import lookahead_partition
 from neuron import Neuron, NeuronTypes
 from molecule import Transporters, Receptors, Molecule_IDs
+from shared import shared_copy
 
 class NeuronFactory:
-    def __init__(self, num_threads=1):
+    def __init__(self, num_threads=1, partition_type=PartitionTypes.GRAPH,
+            lookahead=False):
         self.environment = Environment()
         self.neurons = []
         self.synapses = []
+        self.grids = []
 
         self.drivers = {}
         self.neuron_drivers = {}
 
+        self.driver_schedule = dict()
+
         self.num_threads = num_threads
+        self.partition_type = partition_type
+        self.lookahead = lookahead
         self.time = 0
 
     def initialize(self):
         self.environment.initialize()
         self.num_threads = min(self.num_threads, len(self.neurons))
 
+        # Rows are environment ids, and columns are the neurons that read
+        #     them when computing their current.
+        rows, columns = ([], [])
+        for neuron in self.neurons:
+            readers = [neuron.soma.env_id] \
+                + [other.soma.env_id for other,_ in neuron.gap_junctions]
+            for synapse in neuron.in_synapses:
+                readers += synapse.activation_env_ids()
+            rows += readers
+            columns += [neuron.neuron_id] * len(readers)
+        self.readers = csr_matrix((ones(len(rows)), (rows, columns)),
+            shape=(self.environment.size, len(self.neurons)))
+
+        # Gap currents are computed by the factory.
+        self.gap_matrix = GapJunctionMatrix(self.neurons, self.environment)
+        self.soma_env_ids = array(
+            [neuron.soma.env_id for neuron in self.neurons], dtype=int)
+        self.gap_currents = zeros(len(self.neurons))
+
+        # Neurons with delayed synapses mark themselves in the delay line when
+        #     stepped.
+        delay_columns = self.environment.delay_line.columns
+        for neuron in self.neurons:
+            neuron.delay_column = delay_columns.get(neuron.soma.env_id)
+
+        # Delayed synapses are stepped by the factory, and their indices are
+        #     kept for each presynaptic neuron.  Those in a cleft population
+        #     have their index in it in |delayed_clefts|, and others -1.
+        self.delayed = []
+        self.delayed_ids = [[] for _ in self.neurons]
+        for neuron in self.neurons:
+            neuron.stepped_synapses = []
+            for synapse in neuron.out_synapses:
+                if synapse_delay(synapse):
+                    self.delayed_ids[neuron.neuron_id].append(len(self.delayed))
+                    self.delayed.append(synapse)
+                else: neuron.stepped_synapses.append(synapse)
+        self.delays = [synapse_delay(synapse) for synapse in self.delayed]
+        self.delayed_clefts = -ones(len(self.delayed), dtype=int)
+        self.release_schedule = dict()
+
+        # Neurons are unstable until they have been stepped.
+        self.unstable = range(len(self.neurons))
+        self.woken = set()
+
+        self.ahead = False
+
         if self.num_threads == 1:
             self.multithreaded = False
-            self.active = [True] * len(self.neurons)
+            self.build_clefts()
         else:
             self.multithreaded = True
-            # Create the boolean buffers
-            self.active = Array('b', [True] * len(self.neurons), lock=False)
-            length = int(ceil(float(len(self.neurons)) / self.num_threads))
+
+            # Move the state read and written by the workers into shared
+            #     memory.
+            self.environment.share()
+            self.gap_currents = shared_copy(self.gap_currents)
+            for neuron in self.neurons: neuron.share()
+
+            # Partition the neurons, and keep the worker of each neuron to
+            #     split the active neurons between the workers.
+            # Lookahead needs at least two groups that can be stepped apart.
+            if self.lookahead:
+                self.partitions, self.window = self.partition_lookahead()
+                self.ahead = len(self.partitions) > 1
+            if self.ahead:
+                self.num_threads = len(self.partitions)
+                self.allocate_exchange()
+            else:
+                self.partitions = self.partition_neurons()
+            self.owners = zeros(len(self.neurons), dtype=int)
+            for i,neuron_ids in enumerate(self.partitions):
+                self.owners[neuron_ids] = i
 
             # Create workers
+            # Each worker is connected to the factory by a pipe.
             self.workers = []
+            self.connections = []
             for i in xrange(self.num_threads):
-                start_index,stop_index = (i * length, min(len(self.neurons), (i+1)*length))
-                self.workers.append(Process(
-                    target=self.work,
-                    args=(start_index, stop_index)))
+                connection, worker_connection = Pipe()
+                if self.ahead:
+                    worker = Process(target=self.work_ahead,
+                        args=(worker_connection, self.partitions[i]))
+                else:
+                    worker = Process(target=self.work, args=(worker_connection,))
+                worker.daemon = True
+                self.workers.append(worker)
+                self.connections.append(connection)
+
+        for neuron in self.neurons:
+            neuron.gap_currents = self.gap_currents
 
         # Activate drivers
         self.drive()
@@ -52,22 +191,137 @@ class NeuronFactory:
         if self.multithreaded:
             for worker in self.workers: worker.start()
 
+    def build_clefts(self):
+        """
+        Gathers the single molecule chemical synapses into a cleft population.
+        Verbose synapses are left to their neurons.
+        """
+        def batched(synapse):
+            if not isinstance(synapse, ChemicalSynapse): return False
+            cleft = synapse.synaptic_cleft
+            return len(cleft.active_molecules) == 1 \
+                and not (cleft.verbose or synapse.axon.verbose)
+
+        synapses = []
+        for neuron in self.neurons:
+            members = [synapse for synapse in neuron.stepped_synapses if batched(synapse)]
+            if len(members) == 0: continue
+            neuron.cleft_indices = arange(len(synapses), len(synapses) + len(members))
+            neuron.stepped_synapses = \
+                [synapse for synapse in neuron.stepped_synapses if not batched(synapse)]
+            synapses += members
+        for index,synapse in enumerate(self.delayed):
+            if batched(synapse):
+                self.delayed_clefts[index] = len(synapses)
+                synapses.append(synapse)
+
+        if len(synapses) > 0:
+            self.clefts = CleftPopulation(synapses, self.environment)
+        else: self.clefts = None
+
+    def step_clefts(self, stepped):
+        """
+        Steps the cleft population synapses of the neurons with ids in
+            |stepped|, and destabilizes neurons with unstable synapses.
+        """
+        neurons = [self.neurons[i] for i in stepped
+            if self.neurons[i].cleft_indices is not None]
+        if len(neurons) == 0: return
+
+        counts = array([len(neuron.cleft_indices) for neuron in neurons])
+        stable = self.clefts.step(
+            concatenate([neuron.cleft_indices for neuron in neurons]))
+        stable = logical_and.reduceat(stable, cumsum(counts) - counts)
+        for neuron,synapses_stable in zip(neurons, stable):
+            if not synapses_stable: neuron.stable = False
+
+    def partition_neurons(self):
+        """
+        Splits the neurons between the workers according to the partition
+            type.  Returns a list of neuron ids for each worker.
+        """
+        edges = [(neuron.neuron_id, synapse.postsynaptic_id)
+                    for neuron in self.neurons
+                        for synapse in neuron.out_synapses] \
+              + [(neuron.neuron_id, other.neuron_id)
+                    for neuron in self.neurons
+                        for other,_ in neuron.gap_junctions]
+        return partition(self.partition_type, len(self.neurons),
+            self.num_threads, edges, self.grids)
+
+    def partition_lookahead(self):
+        """
+        Splits the neurons into groups that can be stepped apart, starting
+            from the grids.  Returns a list of neuron ids for each worker, and
+            the number of timesteps that workers can run ahead, or None if
+            they never need to exchange history.
+        """
+        edges = [(neuron.neuron_id, synapse.postsynaptic_id, synapse_delay(synapse))
+                    for neuron in self.neurons
+                        for synapse in neuron.out_synapses] \
+              + [(neuron.neuron_id, other.neuron_id, 0)
+                    for neuron in self.neurons
+                        for other,_ in neuron.gap_junctions]
+        groups = [[neuron.neuron_id for row in grid for neuron in row]
+                    for grid in self.grids]
+        return lookahead_partition(len(self.neurons), self.num_threads,
+            edges, groups)
+
+    def allocate_exchange(self):
+        """
+        Allocates the shared arrays through which lookahead workers exchange
+            the delay line history of their neurons: the voltage of each
+            source at each timestep of a window, and whether it was stepped.
+            Windows take turns in two slots, so that a worker can publish a
+            window while other workers are still reading the previous one.
+        """
+        rows = self.window or 0
+        width = len(self.environment.delay_line.sources)
+        self.exchange = shared_copy(zeros((2, rows, width)))
+        self.exchange_stepped = shared_copy(zeros((2, rows, width), dtype=int8))
+
     def close(self):
+        # Tell the workers to stop, and wait for them to exit.
         if self.multithreaded:
-            for worker in self.workers: worker.terminate()
+            for connection in self.connections: connection.send(None)
+            for worker in self.workers: worker.join()
+            for connection in self.connections: connection.close()
 
     def drive(self):
         # Activate drivers
         # Drivers do not step the neuron, but modify it to prepare for
-        #     a timestep.  If True is returned, the neuron should be
-        #     stepped during this timestep.
-        for neuron,driver in self.neuron_drivers.iteritems():
-            driver.drive(neuron, self.time)
+        #     a timestep.  They return the next time they should be driven,
+        #     and the neurons they drive are stepped in the next timestep.
+        for neuron in self.driver_schedule.pop(self.time, ()):
+            next_time = self.neuron_drivers[neuron].drive(neuron, self.time)
+            if next_time is not None:
+                self.schedule_driver(neuron, max(next_time, self.time+1))
+            self.woken.add(neuron.neuron_id)
+
+    def schedule_driver(self, neuron, time):
+        self.driver_schedule.setdefault(time, set()).add(neuron)
+
+    def wake(self):
+        """
+        Returns the sorted ids of the neurons to step this timestep.
+        """
+        changed = self.environment.changed
+        self.woken.update(self.unstable)
+        self.woken.update(self.readers[changed].indices.tolist())
+        active = sorted(self.woken)
+        self.woken = set()
+        return active
 
     def step(self, count=1):
         # Hacky way of initializing without placing burden on caller.
-        try: self.active
+        try: self.unstable
         except: self.initialize()
+        self.environment.reserve(count)
+
+        # Lookahead workers step on their own, one window at a time.
+        if self.ahead:
+            self.step_ahead(count)
+            return
 
         for _ in xrange(count):
             # Step the environment.
@@ -75,24 +329,192 @@ class NeuronFactory:
             self.time += 1
             if True or self.time % 100 == 0: print(self.time)
 
-            # Activate neurons and wait for workers.
+            active = self.wake()
+            self.compute_gap_currents(active)
+
+            # Send each worker its share of the active neurons, and wait for
+            #     the ones that remain unstable.
             if self.multithreaded:
-                for i in xrange(len(self.active)):
-                    self.active[i] = True
-                while any(x == True for x in self.active): pass
+                active = array(active, dtype=int)
+                owners = self.owners[active]
+                for i,connection in enumerate(self.connections):
+                    connection.send((self.time, active[owners == i].tolist()))
+                self.unstable = []
+                for connection in self.connections:
+                    self.unstable += connection.recv()
             # If no other threads, do it yourself
             else:
-                for neuron in self.neurons: neuron.step(self.time)
+                neurons = self.neurons
+                stepped = [i for i in active if neurons[i].step(self.time)]
+                if self.clefts is not None: self.step_clefts(stepped)
+                self.step_delayed(stepped)
+                self.unstable = [i for i in active if not neurons[i].stable]
 
             # Activate drivers
             self.drive()
 
-    def work(self, start_index, stop_index):
+        if not self.multithreaded and self.clefts is not None:
+            self.clefts.store()
+
+    def step_ahead(self, count):
+        """
+        Steps the lookahead workers through |count| timesteps, in windows.
+            Every worker steps each window, and replies with the values it
+            recorded, before the next window is sent.
+        """
+        records, spikes = (self.environment.records, self.environment.spikes)
+        window = self.window or max(count, 1)
+        for start in xrange(0, count, window):
+            steps = min(window, count - start)
+            for connection in self.connections:
+                connection.send(('step', steps))
+            replies = [connection.recv() for connection in self.connections]
+            records.merge(steps, [reply[0] for reply in replies])
+            spikes.merge(steps, [reply[1] for reply in replies])
+        self.time += count
+
+    def step_delayed(self, stepped):
+        """
+        Schedules the delayed synapses of the neurons with ids in |stepped|,
+            and steps the delayed synapses due this timestep.  Those that are
+            unstable are due again on the next timestep.
+        """
+        schedule = self.release_schedule
+        for i in stepped:
+            for index in self.delayed_ids[i]:
+                schedule.setdefault(self.time + self.delays[index], set()).add(index)
+        due = schedule.pop(self.time, None)
+        if due is None: return
+
+        due = array(sorted(due), dtype=int)
+        clefts = self.delayed_clefts[due]
+        batched = clefts >= 0
+        unstable = [index for index in due[~batched].tolist()
+            if not self.delayed[index].step(None)]
+        if batched.any():
+            stable = self.clefts.step(clefts[batched])
+            unstable += due[batched][~stable].tolist()
+        if len(unstable) > 0:
+            schedule.setdefault(self.time + 1, set()).update(unstable)
+
+    def schedule_inbound(self, slot, steps):
+        """
+        Copies the delay line history of the last |steps| timesteps that other
+            workers published in |slot| into the delay line, and schedules
+            the inbound synapses of the sources stepped in it.
+        """
+        delay_line = self.environment.delay_line
+        rows = delay_line.rows(steps)[:, None]
+        delay_line.buffer[rows, self.incoming] = \
+            self.exchange[slot, :steps][:, self.incoming]
+        stepped = self.exchange_stepped[slot, :steps][:, self.incoming]
+        delay_line.stepped[rows, self.incoming] = stepped
+        schedule = self.release_schedule
+        for row,i in zip(*stepped.nonzero()):
+            time = self.time - steps + 1 + row
+            for index in self.inbound_synapses[i]:
+                schedule.setdefault(time + self.delays[index], set()).add(index)
+
+    def compute_gap_currents(self, active):
+        """
+        Computes the gap currents of the neurons with ids in |active|.
+        """
+        rows = array(active, dtype=int)
+        voltage = self.environment.get_many(self.soma_env_ids[rows])
+        self.gap_currents[rows] = self.gap_matrix.gap_current(rows, voltage)
+
+    def work(self, connection):
+        """
+        Worker loop.  Blocks until the factory sends a timestep and the ids of
+            the neurons to step, steps them, and replies with the ids of
+            those that are unstable.  Exits when the factory sends None.
+        """
+        neurons = self.neurons
+        while True:
+            command = connection.recv()
+            if command is None: break
+            self.time, active = command
+            self.step_delayed([i for i in active if neurons[i].step(self.time)])
+            connection.send([i for i in active if not neurons[i].stable])
+        connection.close()
+
+    def work_ahead(self, connection, neuron_ids):
+        """
+        Lookahead worker loop.  Steps the neurons with the given ids by
+            themselves, on private copies of the environment buffers, for
+            each window of timesteps that the factory sends.  Before each
+            window, reads the history of other workers published after the
+            previous one, and after it, publishes the history that other
+            workers read, and replies.  Exits when the factory sends None.
+        """
+        owned = set(neuron_ids)
+        neurons = self.neurons
+        environment = self.environment
+        delay_line = environment.delay_line
+        environment.detach()
+        records, spikes = (environment.records, environment.spikes)
+        record_columns = [records.columns[neurons[i].soma.env_id]
+            for i in neuron_ids if neurons[i].soma.env_id in records]
+
+        # Only neurons of this worker are woken, and delayed synapses are
+        #     stepped by the worker of their postsynaptic neuron.
+        mask = zeros(len(neurons))
+        mask[neuron_ids] = 1.0
+        self.readers = (self.readers * diags(mask)).tocsr()
+        self.readers.eliminate_zeros()
+        outgoing, incoming = (set(), dict())
+        for neuron_id,indices in enumerate(self.delayed_ids):
+            inside = neuron_id in owned
+            column = neurons[neuron_id].delay_column
+            for index in indices:
+                if inside == (self.delayed[index].postsynaptic_id in owned):
+                    continue
+                if inside: outgoing.add(column)
+                else: incoming.setdefault(column, []).append(index)
+            self.delayed_ids[neuron_id] = [index for index in indices
+                if inside and self.delayed[index].postsynaptic_id in owned]
+        outgoing = array(sorted(outgoing), dtype=int)
+        self.incoming = array(sorted(incoming), dtype=int)
+        self.inbound_synapses = [incoming[column]
+            for column in self.incoming.tolist()]
+
+        # Step only the neurons of this worker, by itself.
+        self.multithreaded = False
+        self.ahead = False
+        self.clefts = None
+        self.unstable = [i for i in self.unstable if i in owned]
+        self.woken = set(i for i in self.woken if i in owned)
+        for time,scheduled in self.driver_schedule.items():
+            self.driver_schedule[time] = \
+                set(neuron for neuron in scheduled if neuron.neuron_id in owned)
+
+        # Windows are published in alternate slots.
+        published = None
         while True:
-            for neuron_id in xrange(start_index, stop_index):
-                if self.active[neuron_id]:
-                    self.neurons[neuron_id].step(self.time)
-                    self.active[neuron_id] = False
+            command = connection.recv()
+            if command is None: break
+            if command[0] == 'driver':
+                _, neuron_id, driver = command
+                self.neuron_drivers[neurons[neuron_id]] = driver
+                self.schedule_driver(neurons[neuron_id], self.time+1)
+                continue
+
+            _, steps = command
+            if published is not None and len(self.incoming) > 0:
+                self.schedule_inbound(*published)
+            NeuronFactory.step(self, steps)
+            slot = 0 if published is None else 1 - published[0]
+            if len(outgoing) > 0:
+                rows = delay_line.rows(steps)[:, None]
+                self.exchange[slot, :steps][:, outgoing] = \
+                    delay_line.buffer[rows, outgoing]
+                self.exchange_stepped[slot, :steps][:, outgoing] = \
+                    delay_line.stepped[rows, outgoing]
+            published = (slot, steps)
+            connection.send((
+                (record_columns, records.drain(record_columns)),
+                spikes.drain()))
+        connection.close()
 
     def create_neuron(self, base_current=0.0,
             neuron_type=NeuronTypes.GANGLION, record=False):
@@ -114,6 +536,7 @@ class NeuronFactory:
             for j in xrange(width):
                 row.append(self.create_neuron(base_current, neuron_type, record=record))
             output.append(row)
+        self.grids.append(output)
         return output
 
     def connect_grids(self, grid1, grid2,
@@ -136,7 +559,8 @@ class NeuronFactory:
 
     def create_synapse(self, pre_neuron, post_neuron,
             transporter=Transporters.GLUTAMATE, receptor=Receptors.AMPA,
-            enzyme_concentration=1.0, axon_delay=0, dendrite_strength=25):
+            enzyme_concentration=1.0, axon_delay=0, dendrite_strength=25,
+            chemical=False):
         # If single molecule is true, the synapse will save time and space by
         #     assuming that only one molecule will move through it.  This means
         #     that the proteins must use the same native molecule, and no
@@ -150,7 +574,8 @@ class NeuronFactory:
         synapse = Neuron.create_synapse(pre_neuron, post_neuron,
             transporter=transporter, receptor=receptor,
             enzyme_concentration=enzyme_concentration,
-            axon_delay=axon_delay, dendrite_strength=dendrite_strength)
+            axon_delay=axon_delay, dendrite_strength=dendrite_strength,
+            chemical=chemical)
         self.synapses.append(synapse)
         return synapse
 
@@ -161,5 +586,21 @@ class NeuronFactory:
         self.neuron_drivers[neuron] = driver
         self.drivers[name] = driver
 
+        # Drivers run at the end of each timestep once initialized.
+        try: self.unstable
+        except: self.schedule_driver(neuron, self.time)
+        else:
+            if self.ahead:
+                self.connections[self.owners[neuron.neuron_id]].send(
+                    ('driver', neuron.neuron_id, driver))
+            else: self.schedule_driver(neuron, self.time+1)
+
     def get_driver_data(self, name):
         return (name, self.drivers[name].data)
+
+def synapse_delay(synapse):
+    """
+    Returns the axon delay of a simple or chemical |synapse|.
+    """
+    if isinstance(synapse, ChemicalSynapse): return synapse.axon.delay
+    return synapse.delay
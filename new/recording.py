@@ -0,0 +1,257 @@
+# Recording
+#
+# A recording holds the values of a set of env_ids at every timestep, in an
+#     array with one row per timestep and one column per recorded env_id.
+#     Recording a timestep copies a whole row at once, instead of appending
+#     each value to its own list.
+#
+# Env_ids must be registered before the recording is initialized.  The array
+#     is then allocated ahead of time.  The neuron factory reserves rows for
+#     the timesteps of each call to step(), and if a recording runs out of
+#     rows anyway, it is reallocated with twice as many.  Only the process
+#     that steps the environment records, so the array is never shared.
+#
+# Workers that step the environment on their own (see lookahead.py) detach
+#     the recording, and drain the rows they record to send them to the
+#     main process, which merges them into its recording.
+#
+# Spikes are sparse, so the spike recorder only keeps spike events, as arrays
+#     of their times and env_ids.  When the spikes are first queried, the
+#     events are sorted by env_id, and the offset of the first spike of
+#     each env_id is kept as an index, so that the spike times of an env_id
+#     are a slice.  Firing rates and rasters are computed from the index.
+#     Lookahead workers drain their spike events in the same way.
+
+from numpy import array, empty, zeros, full, arange, repeat, diff, bincount, \
+                  concatenate, lexsort, searchsorted, float64, int32
+
+class Recording:
+    def __init__(self, dtype=float64, capacity=1024):
+        """
+        Creates an empty recording of values of the given |dtype|, with room
+            for |capacity| timesteps once initialized.
+        """
+        self.dtype = dtype
+        self.capacity = capacity
+        self.env_ids = []
+        self.columns = dict()
+        self.length = 0
+        self.buffer = None
+
+    def __contains__(self, env_id):
+        return env_id in self.columns
+
+    def register(self, env_id):
+        """
+        Registers |env_id| to be recorded.
+        """
+        if self.buffer is not None:
+            raise RuntimeError("Cannot register with an initialized recording")
+        if env_id not in self.columns:
+            self.columns[env_id] = len(self.env_ids)
+            self.env_ids.append(env_id)
+
+    def initialize(self):
+        """
+        Allocates the buffer.
+        """
+        self.env_ids = array(self.env_ids, dtype=int)
+        self.allocate(self.capacity)
+
+    def allocate(self, capacity):
+        """
+        Reallocates the buffer with room for |capacity| timesteps, keeping the
+            recorded rows.
+        """
+        buffer = empty((capacity, len(self.env_ids)), dtype=self.dtype)
+        if self.length > 0:
+            buffer[:self.length] = self.buffer[:self.length]
+        self.buffer = buffer
+
+    def reserve(self, count):
+        """
+        Ensures that there is room for |count| more timesteps.
+        """
+        length = self.length + count
+        capacity = len(self.buffer)
+        if length > capacity:
+            self.allocate(max(length, 2 * capacity))
+
+    def record(self, values):
+        """
+        Records a row of |values|, one for each registered env_id.
+        """
+        if self.length == len(self.buffer):
+            self.reserve(1)
+        self.buffer[self.length] = values
+        self.length += 1
+
+    def get(self, env_id):
+        """
+        Returns a list of the recorded values of |env_id|.
+        """
+        return self.buffer[:self.length, self.columns[env_id]].tolist()
+
+    def detach(self):
+        """
+        Empties the recording, for a worker that records its own timesteps.
+        """
+        self.length = 0
+
+    def drain(self, columns):
+        """
+        Returns the rows recorded since the last drain, restricted to the
+            given |columns|, and starts over.
+        """
+        rows = self.buffer[:self.length][:, columns]
+        self.length = 0
+        return rows
+
+    def merge(self, count, parts):
+        """
+        Records |count| rows assembled from |parts|, which are pairs of
+            columns and drained rows.
+        """
+        self.reserve(count)
+        rows = self.buffer[self.length:self.length + count]
+        for columns,values in parts:
+            if len(columns) > 0: rows[:, columns] = values
+        self.length += count
+
+class SpikeRecorder:
+    def __init__(self, capacity=1024, threshold=30.0):
+        """
+        Creates an empty spike recorder, with room for |capacity| spikes.
+        Values at or above the |threshold| are spikes.
+        """
+        self.threshold = threshold
+        self.env_ids = []
+        self.columns = None
+        self.times = empty(capacity, dtype=int32)
+        self.ids = empty(capacity, dtype=int32)
+        self.length = 0
+        self.time = 0
+        self.offsets = None
+
+    def __contains__(self, env_id):
+        if self.columns is None: return env_id in self.env_ids
+        return env_id in self.columns
+
+    def register(self, env_id):
+        if self.columns is not None:
+            raise RuntimeError("Cannot register with a started spike recorder")
+        if env_id not in self.env_ids:
+            self.env_ids.append(env_id)
+
+    def start(self):
+        """
+        Sorts the registered env_ids, which are then fixed.
+        """
+        self.env_ids = array(sorted(self.env_ids), dtype=int)
+        self.columns = dict((env_id, i)
+            for i,env_id in enumerate(self.env_ids.tolist()))
+
+    def record(self, values):
+        """
+        Records the spikes among the |values| of the current timestep.
+        """
+        if self.columns is None: self.start()
+        spiking = self.env_ids[values[self.env_ids] >= self.threshold]
+        if len(spiking) > 0:
+            self.append(full(len(spiking), self.time, dtype=int32), spiking)
+        self.time += 1
+
+    def append(self, times, ids):
+        """
+        Appends spike events, given arrays of their |times| and |ids|.
+        """
+        length = self.length + len(ids)
+        if length > len(self.times):
+            capacity = max(length, 2 * len(self.times))
+            for name in ("times", "ids"):
+                old = getattr(self, name)
+                new = empty(capacity, dtype=int32)
+                new[:self.length] = old[:self.length]
+                setattr(self, name, new)
+        self.times[self.length:length] = times
+        self.ids[self.length:length] = ids
+        self.length = length
+        self.offsets = None
+
+    def build_index(self):
+        """
+        Sorts the spikes by env_id and time, and finds the offset of the
+            first spike of each env_id.  This is done when the spikes are
+            first queried after recording.
+        """
+        if self.columns is None: self.start()
+        times = self.times[:self.length]
+        ids = self.ids[:self.length]
+        order = lexsort((times, ids))
+        self.sorted_times = times[order]
+        self.offsets = concatenate(
+            (searchsorted(ids[order], self.env_ids), [self.length]))
+        self.rows = repeat(arange(len(self.env_ids)), diff(self.offsets))
+
+    def spike_times(self, env_id):
+        """
+        Returns an array of the times at which |env_id| spiked.
+        """
+        if self.offsets is None: self.build_index()
+        column = self.columns[env_id]
+        return self.sorted_times[self.offsets[column]:self.offsets[column+1]]
+
+    def spike_count(self, env_id):
+        """
+        Returns the number of times |env_id| spiked.
+        """
+        return len(self.spike_times(env_id))
+
+    def dense(self, env_id):
+        """
+        Returns a list with 1 for each timestep at which |env_id| spiked,
+            and 0 otherwise.
+        """
+        record = zeros(self.time, dtype=int)
+        record[self.spike_times(env_id)] = 1
+        return record.tolist()
+
+    def raster(self, start=0, stop=None):
+        """
+        Returns the times of the spikes from |start| until |stop|, and the
+            rows of the env_ids that fired them, which are their positions
+            in |env_ids|.
+        """
+        if self.offsets is None: self.build_index()
+        if stop is None: stop = self.time
+        window = (self.sorted_times >= start) & (self.sorted_times < stop)
+        return self.sorted_times[window], self.rows[window]
+
+    def rates(self, start=0, stop=None):
+        """
+        Returns an array of the firing rate of each of the |env_ids|, in
+            spikes per timestep, from |start| until |stop|.
+        """
+        if stop is None: stop = self.time
+        _, rows = self.raster(start, stop)
+        counts = bincount(rows, minlength=len(self.env_ids))
+        return counts / float(max(1, stop - start))
+
+    def drain(self):
+        """
+        Returns the times and env_ids of the spikes recorded since the last
+            drain, and starts over.
+        """
+        events = (self.times[:self.length].copy(), self.ids[:self.length].copy())
+        self.length = 0
+        self.offsets = None
+        return events
+
+    def merge(self, count, parts):
+        """
+        Records |count| timesteps of spikes from |parts|, which are drained
+            pairs of times and env_ids.
+        """
+        for times,ids in parts:
+            self.append(times, ids)
+        self.time += count
@@ -0,0 +1,119 @@
+# Release Kernel
+#
+# Spiking axons and synapses release neurotransmitter over several timesteps
+#     after each spike, following the increments of an erlang distribution
+#     cdf.  The increments are computed once and cached as a kernel.
+#
+# Pending releases are kept in a release accumulator, which is a ring buffer
+#     with one row per timestep of the kernel and one column per spiking
+#     component.  A spike adds the kernel into the future rows of its column,
+#     so the release is the convolution of the spike train with the kernel.
+#     When the environment steps, it advances the accumulator, clearing the
+#     row of the timestep that just ended for every column at once.
+#
+# Components must be registered before the accumulator is initialized.  With
+#     worker processes, the buffer and head are then moved into shared memory,
+#     like the environment.
+
+from ctypes import c_long
+from numpy import array, arange, zeros
+from scipy.stats import erlang
+from shared import shared_copy, shared_value
+
+def erlang_kernel(shape=2, cutoff=0.001):
+    """
+    Computes the increments of the cdf of an erlang distribution with the
+        given |shape| at each timestep, until they drop below |cutoff|.
+    """
+    er = erlang(shape)
+    kernel = []
+    prev = 0.0
+    x = 1
+    while True:
+        curr = er.cdf(x)
+        diff = curr - prev
+        if diff < cutoff: break
+        prev = curr
+        kernel.append(diff)
+        x += 1
+    return array(kernel)
+
+release_kernel = erlang_kernel()
+
+class ReleaseAccumulator:
+    def __init__(self, kernel=release_kernel):
+        """
+        Creates an empty accumulator for the given release |kernel|.
+        """
+        self.kernel = kernel
+        self.length = len(kernel)
+        self.offsets = arange(self.length)
+        self.columns = 0
+        self.buffer = None
+
+    def register(self):
+        """
+        Registers a spiking component.  Returns its column in the buffer.
+        """
+        if self.buffer is not None:
+            raise RuntimeError("Cannot register with an initialized accumulator")
+        self.columns += 1
+        return self.columns - 1
+
+    def initialize(self):
+        """
+        Allocates the buffer and head.
+        """
+        self.head = c_long(0)
+        self.buffer = zeros((self.length, self.columns))
+
+    def share(self):
+        """
+        Moves the buffer and head into shared memory.
+        """
+        self.head = shared_value(self.head)
+        self.buffer = shared_copy(self.buffer)
+
+    def detach(self):
+        """
+        Replaces the shared buffer and head with private copies.
+        """
+        self.head = c_long(self.head.value)
+        self.buffer = self.buffer.copy()
+
+    def advance(self):
+        """
+        Clears the row of the current timestep and moves to the next one.
+        """
+        head = self.head.value
+        self.buffer[head] = 0.0
+        self.head.value = (head + 1) % self.length
+
+    def spike(self, column):
+        """
+        Adds the kernel into the pending releases of |column|, starting at
+            the current timestep.
+        """
+        rows = (self.head.value + self.offsets) % self.length
+        self.buffer[rows, column] += self.kernel
+
+    def get(self, column):
+        """
+        Returns the release of |column| for the current timestep.
+        """
+        return float(self.buffer[self.head.value, column])
+
+    def spike_many(self, columns):
+        """
+        Adds the kernel into the pending releases of each of the distinct
+            |columns|, starting at the current timestep.
+        """
+        rows = (self.head.value + self.offsets) % self.length
+        self.buffer[rows[:, None], columns] += self.kernel[:, None]
+
+    def get_many(self, columns):
+        """
+        Returns an array of the releases of |columns| for the current
+            timestep.
+        """
+        return self.buffer[self.head.value, columns]
@@ -5,64 +5,44 @@
 #     a means of activating the postsynaptic neuron.
 # It shares an interface with ChemicalSynapse, and is thus interchangeable
 #     with it.
+#
+# Delayed voltages are read from the delay line of the environment, which
+#     holds the voltage history of the presynaptic soma (|source_id|).
 
 from molecule import Receptors
-from collections import deque
-from sys import maxint
-from scipy.stats import erlang
-
-er = erlang(2)
-
-def erlang_generator():
-    """
-    Creates an erlang generator.
-    """
-    prev = 0.0
-
-    for x in xrange(1, maxint):
-        curr = er.cdf(x)
-        diff = curr - prev
-        if diff < 0.001: break
-        prev = curr
-        yield diff
 
 class SimpleSynapse:
     def __init__(self, postsynaptic_id=None, receptor=Receptors.AMPA,
                     spiking=True, delay=0, strength=1, environment=None,
-                    verbose=False):
+                    source_id=None, verbose=False):
         """
         """
         self.postsynaptic_id = postsynaptic_id
         self.receptor = receptor
-        self.delay = delay
+        self.delay = delay or 0
         self.strength = strength
         self.environment = environment
         self.verbose = verbose
         self.env_id = environment.register(0.0)
 
         if spiking:
-            self.release_generator = None
+            self.accumulator = environment.release_accumulator
+            self.release_column = self.accumulator.register()
             self.release_function = self.spike_release
         else:
             self.release_function = self.graded_release
 
-        if delay:
-            self.delay_queue = deque()
-            for _ in xrange(delay):
-                self.delay_queue.appendleft(-70.0)
-        else:
-            self.delay_queue = None
+        # Register delayed voltages with the delay line.
+        if self.delay:
+            self.column = environment.delay_line.register(source_id, self.delay)
 
     def step(self, voltage):
         """
         Cycles the axon.
         """
-        # If there is a delay, use the queue.
-        try:
-            self.delay_queue.appendleft(voltage)
-            # Remove voltage from queue.
-            voltage = self.delay_queue.pop()
-        except AttributeError: pass
+        # If there is a delay, read the voltage from the delay line.
+        if self.delay:
+            voltage = self.environment.delay_line.get(self.column, self.delay)
 
         return self.release(voltage)
 
@@ -71,6 +51,12 @@ class SimpleSynapse:
             self.environment.get(self.env_id),
             neuron)
 
+    def activation_env_ids(self):
+        """
+        Returns the environment ids read when activating dendrites.
+        """
+        return [self.env_id]
+
     def release(self, voltage):
         """
         Releases neurochemical into the synaptic cleft.
@@ -88,23 +74,13 @@ class SimpleSynapse:
             return False
 
     def spike_release(self, voltage):
-        # If the voltage exceeds the threshold for spiking, create a release
-        #     generator (erlang distribution).  Return the first call.
+        # If the voltage exceeds the threshold for spiking, add the release
+        #     kernel (erlang distribution) into the accumulator.
         if voltage > 30:
-            gen = erlang_generator()
-            self.release_generator = gen
-            return next(gen)
+            self.accumulator.spike(self.release_column)
 
-        # Otherwise, attempt to access the release generator, and return the
-        #     results of the next() call.  If that fails, the release is
-        #     complete for the previous spike, and 0.0 can be returned.
-        else:
-            try:
-                return next(self.release_generator)
-            except TypeError: return 0.0
-            except StopIteration:
-                self.release_generator = None
-                return 0.0
+        # Return the pending release for this timestep.
+        return self.accumulator.get(self.release_column)
 
     def graded_release(self, voltage):
         threshold = -150.0
@@ -9,7 +9,9 @@
 # Synaptic neurotransmitters bind stochastically to postsynaptic neuron
 #     receptors and presynaptic transporters.
 
-from molecule import Molecules, Enzymes, metabolize, Molecule_IDs
+from numpy import array, zeros
+from molecule import Molecules, Enzymes, metabolize, Molecule_IDs, \
+                     affinity_matrix, receptor_masks
 
 class SynapticCleft:
     def __init__(self, enzyme_concentration=1.0, active_molecules=None, verbose=False):
@@ -39,6 +41,9 @@ class SynapticCleft:
         self.axon = None
         self.dendrites = []
 
+        # Compiled affinity matrices for complex_bind.
+        self.binding = None
+
         self.stable = True
 
     def get_total_concentration(self):
@@ -139,6 +144,54 @@ class SynapticCleft:
                 print("")
         return total_bound
 
+    def compile_binding(self):
+        """
+        Compiles the receptors of the dendrites and the transporter of the
+            axon into affinity matrices over the active molecules, which
+            are used by complex_bind.  The result is cached until the
+            dendrites or axon change.
+        """
+        dendrites = self.dendrites
+        axon = self.axon
+        mol_ids = sorted(self.concentrations)
+        columns = dict((mol_id, i) for i,mol_id in enumerate(mol_ids))
+
+        # Receptors of dendrites with nonzero density, in order of appearance.
+        receptors = []
+        for dendrite in dendrites:
+            if dendrite.density != 0.0 and dendrite.protein not in receptors:
+                receptors.append(dendrite.protein)
+        receptor_affinities = affinity_matrix(receptors, mol_ids)
+        agonists, _ = receptor_masks(receptors, mol_ids)
+
+        # Concentration of receptors competing for each molecule.
+        receptor_counts = zeros(len(mol_ids))
+        for dendrite in dendrites:
+            if dendrite.density == 0.0: continue
+            receptor_counts += dendrite.density \
+                * receptor_affinities[receptors.index(dendrite.protein)]
+
+        # Dendrite-agonist pairs, as tuples of dendrite index, receptor index,
+        #     molecule index, affinity, and protein count.
+        # Dendrites with zero density still bind if another dendrite has
+        #     receptors of the same type.
+        pairs = []
+        for i,dendrite in enumerate(dendrites):
+            if dendrite.protein not in receptors: continue
+            r = receptors.index(dendrite.protein)
+            for m in agonists[r].nonzero()[0].tolist():
+                affinity = float(receptor_affinities[r, m])
+                pairs.append((i, r, m, affinity, affinity * dendrite.density))
+
+        if axon is None: transporter = None
+        else:
+            transporter = (affinity_matrix([axon.protein], mol_ids)[0],
+                columns.get(axon.native_mol_id),
+                axon.affinities[axon.native_mol_id])
+
+        self.binding = (len(dendrites), axon, mol_ids,
+            receptor_affinities, receptor_counts, pairs, transporter)
+
     def complex_bind(self):
         """
         Bound/Unbound fraction
@@ -150,122 +203,99 @@ class SynapticCleft:
 
         The adapted version of this equation takes into account competition
             between similar receptors and similar molecules.
+        Competition is computed from the affinity matrices compiled by
+            compile_binding.
         """
-        total_bound = 0.0
+        dendrites = self.dendrites
+        axon = self.axon
+        if self.binding is None or self.binding[0] != len(dendrites) \
+                or self.binding[1] is not axon:
+            self.compile_binding()
+        (_, _, mol_ids, receptor_affinities, receptor_counts,
+            pairs, transporter) = self.binding
 
         # Total concentration of each molecule
-        mol_concentrations = dict()
-        # Map of molecules to total concentrations of receptive proteins
-        mol_protein_count = dict()
-        # Map of proteins to total concentration of receptive molecules
-        protein_mol_count = dict()
-
-        # Check available molecules
-        for mol_id, pool_id in self.pool_ids.iteritems():
-            concentration = self.get_concentration(mol_id)
-            if concentration == 0.0: continue
-            mol_concentrations[mol_id] = concentration
-            mol_protein_count[mol_id] = 0.0
-
-        if len(mol_concentrations) == 0: return
+        mol_concentrations = [self.get_concentration(mol_id) for mol_id in mol_ids]
+        if not any(mol_concentrations): return
+        concentrations = array(mol_concentrations)
 
-        # Calculate densities of all proteins.
-        for dendrite in self.dendrites:
-            if dendrite.density == 0.0: continue
-
-            # Register protein and its receptive molecules
-            # Factor in affinity
-            protein_mol_count[dendrite.protein] = 0.0
-            for mol_id,affinity in dendrite.protein.affinities.iteritems():
-                if mol_id in mol_protein_count:
-                    mol_protein_count[mol_id] += dendrite.density * affinity
-                    protein_mol_count[dendrite.protein] += mol_concentrations[mol_id] * affinity
+        # Concentration of receptive molecules competing for each receptor,
+        #     and of receptive proteins competing for each molecule.
+        # Absent molecules have zero concentration, so they do not compete.
+        protein_mol_count = (receptor_affinities * concentrations).sum(axis=1).tolist()
+        mol_protein_count = receptor_counts
 
         # Axon
-        try:
-            axon = self.axon
-            native_mol_id = axon.native_mol_id
-            axon_available = min(axon.density, axon.capacity-axon.get_concentration())
+        if transporter is not None:
+            transporter_affinities, native, affinity = transporter
+            axon_available = min(axon.density,
+                axon.capacity-axon.get_concentration())
             if axon_available > 0.0:
-                count,affinity = (axon_available, axon.affinities[native_mol_id])
-                protein_count = count*affinity
-
-                # Register protein and its receptive molecules
-                # Factor in affinity
-                protein_mol_count[axon.protein] = 0.0
-                for mol_id,affinity in axon.protein.affinities.iteritems():
-                    if mol_id in mol_protein_count:
-                        mol_protein_count[mol_id] += axon_available * affinity
-                        protein_mol_count[axon.protein] += mol_concentrations[mol_id] * affinity
+                protein_count = axon_available*affinity
+                mol_protein_count = mol_protein_count \
+                    + axon_available * transporter_affinities
 
                 # Check if native molecule is present.
-                mol_concentration = mol_concentrations[native_mol_id]
+                if native is not None and mol_concentrations[native] != 0.0:
+                    mol_concentration = mol_concentrations[native]
 
-                competing_proteins = mol_protein_count[native_mol_id]
-                if competing_proteins > 0:
-                    # How many molecules are competing for this protein?
-                    competing_molecules = protein_mol_count[axon.protein]
+                    competing_proteins = float(mol_protein_count[native])
+                    if competing_proteins > 0:
+                        # How many molecules are competing for this protein?
+                        competing_molecules = float(
+                            (transporter_affinities * concentrations).sum())
 
-                    # Proportion of molecule relative to competitors.
-                    mol_fraction = affinity * mol_concentration / competing_molecules
+                        # Proportion of molecule relative to competitors.
+                        mol_fraction = affinity * mol_concentration / competing_molecules
 
-                    # Proportion of protein relative to competitors.
-                    protein_fraction = protein_count / competing_proteins
+                        # Proportion of protein relative to competitors.
+                        protein_fraction = protein_count / competing_proteins
 
-                    # Calculate bound concentration.
-                    k = (1 - (mol_fraction * protein_fraction * mol_fraction))
-                    bound = protein_count * (mol_concentration**2) / ( mol_concentration + k )
+                        # Calculate bound concentration.
+                        k = (1 - (mol_fraction * protein_fraction * mol_fraction))
+                        bound = protein_count * (mol_concentration**2) / ( mol_concentration + k )
 
-                    # Transfer molecules.
-                    axon.add_concentration(bound, mol_id)
-                    self.remove_concentration(bound, mol_id)
-        except KeyError: pass
-        except AttributeError: pass
-
-        # Compute for each protein-molecule pair.
-        for dendrite in self.dendrites:
-            dendrite.set_bound(0.0)
+                        # Transfer molecules.
+                        axon.add_concentration(bound)
+                        self.remove_concentration(bound, axon.native_mol_id)
+        mol_protein_count = mol_protein_count.tolist()
 
-            # How many molecules are competing for this protein?
-            try: competing_molecules = protein_mol_count[dendrite.protein]
-            except KeyError: continue
-
-            # For each receptive agonist molecule, bind to dendrite.
-            # Skip antagonists, which will be competitive inhibitors, as they
-            #     contribute to the overall molecule count.
-            for mol_id in dendrite.protein.agonists:
-                try:
-                    mol_concentration = mol_concentrations[mol_id]
-                except KeyError: continue
+        # Compute for each dendrite-agonist pair.
+        # Antagonists are not bound, but are competitive inhibitors, as they
+        #     contribute to the overall molecule count.
+        total_bound = 0.0
+        bound_totals = [0.0] * len(dendrites)
+        for i,r,m,affinity,protein_count in pairs:
+            mol_concentration = mol_concentrations[m]
+            if mol_concentration == 0.0: continue
 
-                competing_proteins = mol_protein_count[mol_id]
-                if competing_proteins == 0: continue
+            competing_proteins = mol_protein_count[m]
+            if competing_proteins == 0: continue
 
-                affinity = dendrite.protein.affinities[mol_id]
+            # Proportion of molecule relative to competitors.
+            mol_fraction = affinity * mol_concentration / protein_mol_count[r]
 
-                # Proportion of molecule relative to competitors.
-                mol_fraction = affinity * mol_concentration / competing_molecules
+            # Proportion of protein relative to competitors.
+            protein_fraction = protein_count / competing_proteins
 
-                # Proportion of protein relative to competitors.
-                protein_count = affinity * dendrite.density
-                protein_fraction = protein_count / competing_proteins
+            # Calculate bound concentration.
+            k = (1 - (mol_fraction * protein_fraction))
+            bound = protein_count * (mol_concentration**2) / ( mol_concentration + k )
+            bound_totals[i] += bound
+            total_bound += bound
 
-                # Calculate bound concentration.
-                k = (1 - (mol_fraction * protein_fraction))
-                bound = protein_count * (mol_concentration**2) / ( mol_concentration + k )
+            if self.verbose:
+                print("Concentrations:")
+                print(" P: %f      M: %f" % (protein_count, mol_concentration))
+                print("Proportions::")
+                print("fP: %f    fM: %f" % (protein_fraction, mol_fraction))
+                print("Constant and final bound count:")
+                print("k: %f    bound: %f" % (k, bound))
+                print("")
 
-                # Transfer molecules.
-                dendrite.bind(bound)
-                total_bound += bound
-
-                if self.verbose:
-                    print("Concentrations:")
-                    print(" P: %f      M: %f" % (protein_count, mol_concentration))
-                    print("Proportions::")
-                    print("fP: %f    fM: %f" % (protein_fraction, mol_fraction))
-                    print("Constant and final bound count:")
-                    print("k: %f    bound: %f" % (k, bound))
-                    print("")
+        # Activate dendrites.
+        for dendrite,bound in zip(dendrites, bound_totals):
+            dendrite.set_bound(bound)
         return total_bound
 
     def simple_metabolize(self):
@@ -278,10 +308,11 @@ class SynapticCleft:
             concentration of appropriate enzymes.
         Uses single molecule helper.
         """
-        remaining = False
+        stable = True
         for mol in Molecules:
-            remaining |= self.metabolize_molecule(mol.mol_id,
+            stable &= self.metabolize_molecule(mol.mol_id,
                 self.enzymes[mol.enzyme_id], mol.metab_rate)
+        return stable
 
     def metabolize_molecule(self, mol_id, enzyme_count, rate):
         """
@@ -43,7 +43,8 @@ def test_grid(
     height = len(image)
     width = len(image[0])
 
-    neuron_factory = NeuronFactory(num_threads=1)
+    neuron_factory = NeuronFactory(num_threads=args.threads,
+        lookahead=args.lookahead)
     photoreceptor_grid = neuron_factory.create_neuron_grid(width, height,
                         neuron_type=NeuronTypes.PHOTORECEPTOR, record=False)
     ganglion_grid = neuron_factory.create_neuron_grid(width, height, record=True)
@@ -55,7 +56,7 @@ def test_grid(
         print(image[i][:width])
         for j in xrange(width):
             neuron_factory.create_synapse(photoreceptor_grid[i][j], ganglion_grid[i][j],
-                dendrite_strength=100)
+                dendrite_strength=100, axon_delay=args.delay)
             neuron_factory.register_driver(
                 photoreceptor_grid[i][j],
                 ConstantDriver(current=-image[i][j]*255, delay=10))
@@ -123,6 +124,12 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 50, help = 
     """table""")
+    parser.add_argument("-t", "--threads", type = int, default = 1, help = 
+    """number of worker processes""")
+    parser.add_argument("-l", "--lookahead", action = "store_true", help = 
+    """step the layers in separate workers, ahead by the synapse delay""")
+    parser.add_argument("-d", "--delay", type = int, default = 0, help = 
+    """delay of the synapses between layers""")
 
     return parser.parse_args()
 
@@ -0,0 +1,109 @@
+import argparse
+from numpy import allclose
+
+from axon import Axon
+from chemical_synapse import ChemicalSynapse
+from environment import Environment
+from molecule import Molecule_IDs, Receptor, Receptors, Transporter, \
+                     affinity_matrix, receptor_masks
+
+# Concentrations of the two molecule synapse of complex_bind after the given
+#     number of steps: glutamate and GABA in the cleft, bound AMPA, GABA and
+#     NMDA receptors, and the axon.
+COMPLEX_BIND_REFERENCE = [
+    (1, [0.2744651336889252, 0.22608695652173913, 0.11647058823529412,
+         0.09509433962264154, 0.050769230769230775, 0.6338968723584109]),
+    (3, [0.05045461826267189, 0.04618164863211752, 0.008852925227937647,
+         0.014218604519691407, 0.0033942736707286954, 0.6648761956451406]),
+]
+
+def two_molecule_synapse(environment):
+    syn = ChemicalSynapse(
+        active_molecules=[Molecule_IDs.GLUTAMATE, Molecule_IDs.GABA],
+        verbose=args.verbose)
+    syn.set_enzyme_concentration(0.5)
+    syn.synaptic_cleft.add_concentration(0.6, Molecule_IDs.GLUTAMATE)
+    syn.synaptic_cleft.add_concentration(0.4, Molecule_IDs.GABA)
+
+    # GABA inhibits the transporter, so that the axon competes for both
+    #     molecules, but only takes up glutamate.
+    transporter = Transporter(Molecule_IDs.GLUTAMATE)
+    transporter.add_reuptake_inhibitor(Molecule_IDs.GABA, 0.5)
+    axon = syn.create_axon(transporter=transporter, replenish_rate=0.0,
+        spiking=False, verbose=args.verbose)
+    axon.set_concentration(0.5)
+
+    for receptor in (Receptors.AMPA, Receptors.GABA, Receptors.NMDA):
+        syn.create_dendrite(receptor=receptor, density=0.5,
+            environment=environment, verbose=args.verbose)
+    return syn
+
+def concentrations(syn):
+    cleft = syn.synaptic_cleft
+    return [cleft.get_concentration(Molecule_IDs.GLUTAMATE),
+            cleft.get_concentration(Molecule_IDs.GABA)] \
+        + [dendrite.get_bound() for dendrite in syn.dendrites] \
+        + [syn.axon.get_concentration()]
+
+def complex_bind():
+    mol_ids = [Molecule_IDs.GLUTAMATE, Molecule_IDs.GABA]
+    receptors = [Receptors.AMPA, Receptors.GABA, Receptors.NMDA]
+    if affinity_matrix(receptors, mol_ids).tolist() != \
+            [[0.8, 0.0], [0.0, 0.9], [0.4, 0.0]]:
+        raise AssertionError("Affinity matrix does not match the receptors")
+    blocked = Receptor(Molecule_IDs.GLUTAMATE, 0.8, None)
+    blocked.add_antagonist(Molecule_IDs.GABA, 0.3)
+    agonists, antagonists = receptor_masks([Receptors.AMPA, blocked], mol_ids)
+    if agonists.tolist() != [[True, False], [True, False]] \
+            or antagonists.tolist() != [[False, False], [False, True]]:
+        raise AssertionError("Receptor masks do not match the receptors")
+
+    environment = Environment()
+    syn = two_molecule_synapse(environment)
+    environment.initialize()
+    cleft = syn.synaptic_cleft
+    time = 0
+    for steps,expected in COMPLEX_BIND_REFERENCE:
+        while time < steps:
+            cleft.step()
+            environment.step()
+            time += 1
+        if not allclose(concentrations(syn), expected, rtol=0, atol=1e-12):
+            raise AssertionError("Concentrations after %d steps do not match" % steps)
+
+    # The compiled binding is rebuilt when a dendrite is added, or the axon
+    #     is replaced.
+    dendrite = syn.create_dendrite(receptor=Receptors.AMPA, density=0.25,
+        environment=environment)
+    cleft.bind()
+    environment.step()
+    if cleft.binding[0] != len(cleft.dendrites) or dendrite.get_bound() == 0.0:
+        raise AssertionError("Binding was not compiled for the new dendrite")
+    old_axon = syn.axon
+    old_concentration = old_axon.get_concentration()
+    axon = Axon(cleft, replenish_rate=0.0, spiking=False)
+    axon.set_concentration(0.0)
+    cleft.axon = axon
+    cleft.bind()
+    if cleft.binding[1] is not axon or axon.get_concentration() == 0.0 \
+            or old_axon.get_concentration() != old_concentration:
+        raise AssertionError("Binding was not compiled for the new axon")
+    print("Two molecule binding matches the reference.")
+
+def main():
+    complex_bind()
+
+def set_options():
+    """
+    Retrieve the user-entered arguments for the program.
+    """
+    parser = argparse.ArgumentParser(description =
+    """Tests binding of molecules in the synaptic cleft.""")
+    parser.add_argument("-v", "--verbose", action = "store_true", help =
+    """print table""")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = set_options()
+    main()
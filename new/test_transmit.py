@@ -1,11 +1,16 @@
 import argparse
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from plot import plot
 
 from neuron import Neuron
 from soma import Soma
 from neuron_factory import NeuronFactory
+from partition import PartitionTypes
 from tools import PulseDriver
+from checkpoint import checkpoint, restore
 
 def transmit(strength=0.25, delays=[None, 100]):
     data = []
@@ -39,9 +44,188 @@ def transmit(strength=0.25, delays=[None, 100]):
             data.append(("Post neuron", post_neuron.get_record()))
         plot(data, title="Synaptic transmission")
 
+def resume(strength=100, delay=95):
+    # The pulse is timed so that the checkpoint falls while the release of
+    #     the last spike is still spreading through the release accumulator
+    #     of the chemical synapse.  The restored axon must keep adding into
+    #     the accumulator of the restored environment.
+    records = []
+    for interrupted in (False, True):
+        neuron_factory = NeuronFactory()
+        pre_neuron = neuron_factory.create_neuron(record=True)
+        post_neuron = neuron_factory.create_neuron(record=True)
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            dendrite_strength=25, chemical=True)
+        neuron_factory.register_driver(pre_neuron,
+            PulseDriver(current=strength, period=100, length=1, delay=delay))
+        neuron_factory.step(args.iterations / 2)
+
+        if interrupted:
+            accumulator = neuron_factory.environment.release_accumulator
+            if not accumulator.buffer.any():
+                raise AssertionError("No release is pending at the checkpoint")
+            directory = mkdtemp()
+            try:
+                path = join(directory, "transmit.checkpoint")
+                checkpoint(neuron_factory, path)
+                neuron_factory = restore(path)
+            finally: rmtree(directory)
+            pre_neuron, post_neuron = neuron_factory.neurons
+            accumulator = neuron_factory.environment.release_accumulator
+            if neuron_factory.synapses[0].axon.accumulator is not accumulator:
+                raise AssertionError("Axon does not share the accumulator")
+
+        neuron_factory.step(args.iterations - args.iterations / 2)
+        records.append([list(pre_neuron.get_record()),
+                        list(post_neuron.get_record())])
+
+    if records[0] != records[1]:
+        raise AssertionError("Restored run does not match")
+    print("Restored run matches the uninterrupted run.")
+
+def lookahead(strength=100, delay=300, period=500):
+    # The presynaptic neuron stabilizes well within the |delay| after each
+    #     pulse, so its spikes are still in the delay line when it is no
+    #     longer stepped, and must be delivered |delay| timesteps after them,
+    #     whichever worker steps the postsynaptic neuron.
+    records = []
+    for threads in (1, 2):
+        neuron_factory = NeuronFactory(num_threads=threads, lookahead=True)
+        pre_neuron = neuron_factory.create_neuron(record=True)
+        post_neuron = neuron_factory.create_neuron(record=True)
+        neuron_factory.create_synapse(pre_neuron, post_neuron,
+            axon_delay=delay, dendrite_strength=25)
+        neuron_factory.register_driver(pre_neuron,
+            PulseDriver(current=strength, period=period, length=1, delay=25))
+        neuron_factory.step(args.iterations)
+        neuron_factory.close()
+        records.append([list(pre_neuron.get_record()),
+                        list(post_neuron.get_record())])
+
+    if records[0] != records[1]:
+        raise AssertionError("Lookahead run does not match")
+    if 1 not in records[0][1]:
+        raise AssertionError("Delayed spikes were not delivered")
+    print("Lookahead run matches the single threaded run.")
+
+def feedback(strength=100, delays=[20, 30, 25], period=200):
+    # A ring of neurons, each exciting the next through a delayed synapse,
+    #     so that the last feeds back onto the first, which is driven.
+    #     Lookahead must still step every neuron in its own worker, and
+    #     match a single threaded run.
+    records = []
+    for threads in (1, 2, 3):
+        neuron_factory = NeuronFactory(num_threads=threads, lookahead=True)
+        neurons = [neuron_factory.create_neuron(record=True) for _ in delays]
+        for i,delay in enumerate(delays):
+            neuron_factory.create_synapse(neurons[i],
+                neurons[(i+1) % len(neurons)],
+                axon_delay=delay, dendrite_strength=25)
+        neuron_factory.register_driver(neurons[0],
+            PulseDriver(current=strength, period=period, length=1, delay=25))
+        neuron_factory.step(args.iterations)
+        neuron_factory.close()
+        records.append([list(neuron.get_record()) for neuron in neurons])
+
+        if threads > 1 and not (neuron_factory.ahead
+                and len(neuron_factory.partitions) == threads
+                and neuron_factory.window == min(delays)):
+            raise AssertionError("Feedback loop was not split between %d "
+                "lookahead workers" % threads)
+
+    # The feedback makes the first neuron spike between pulses.
+    if records[0][0].count(1) <= args.iterations / period:
+        raise AssertionError("Feedback did not reach the first neuron")
+    for threads,record in zip((1, 2, 3), records):
+        if record != records[0]:
+            raise AssertionError("Lookahead run with %d workers does not match"
+                % threads)
+    print("Lookahead runs with feedback match the single threaded run.")
+
+def partitions(strength=100, width=4, height=3, delay=5):
+    # Two grids connected point to point are stepped by one process, and by
+    #     workers under each partition type, which must all give the same
+    #     records.  Grid partitioning tiles both grids alike, so it must not
+    #     cut any synapse.
+    records = []
+    runs = [(1, PartitionTypes.GRAPH)] + \
+        [(threads, partition_type) for threads in (2, 3)
+            for partition_type in (PartitionTypes.CONTIGUOUS,
+                PartitionTypes.GRAPH, PartitionTypes.GRID)]
+    for threads,partition_type in runs:
+        neuron_factory = NeuronFactory(num_threads=threads,
+            partition_type=partition_type)
+        pre_grid = neuron_factory.create_neuron_grid(width, height, record=True)
+        post_grid = neuron_factory.create_neuron_grid(width, height, record=True)
+        synapses = []
+        for i in xrange(height):
+            for j in xrange(width):
+                synapses.append((pre_grid[i][j], post_grid[i][j]))
+                neuron_factory.create_synapse(pre_grid[i][j], post_grid[i][j],
+                    axon_delay=delay, dendrite_strength=25)
+                neuron_factory.register_driver(pre_grid[i][j],
+                    PulseDriver(current=strength, period=50 + 10 * j,
+                        length=1, delay=5 * i))
+        neuron_factory.step(args.iterations / 4)
+        neuron_factory.close()
+        records.append([list(neuron.get_record())
+            for grid in (pre_grid, post_grid) for row in grid for neuron in row])
+
+        if threads > 1 and partition_type == PartitionTypes.GRID:
+            owners = neuron_factory.owners
+            if any(owners[pre.neuron_id] != owners[post.neuron_id]
+                    for pre,post in synapses):
+                raise AssertionError("Grid partitioning cuts a synapse")
+
+    for (threads,partition_type),record in zip(runs, records):
+        if record != records[0]:
+            raise AssertionError("Records with %d workers and partition type %d"
+                " do not match" % (threads, partition_type))
+    print("Partitioned runs match the single threaded run.")
+
+def spike_queries(strength=100, delay=10, window=200):
+    # The voltages of the spiking neurons are also recorded, and spike times,
+    #     rasters and rates read from the spike index must agree with them.
+    neuron_factory = NeuronFactory()
+    pre_neuron = neuron_factory.create_neuron(record=True)
+    post_neuron = neuron_factory.create_neuron(record=True)
+    neuron_factory.create_synapse(pre_neuron, post_neuron,
+        axon_delay=delay, dendrite_strength=25)
+    neuron_factory.register_driver(pre_neuron,
+        PulseDriver(current=strength, period=100, length=1, delay=25))
+    environment = neuron_factory.environment
+    env_ids = [pre_neuron.soma.env_id, post_neuron.soma.env_id]
+    for env_id in env_ids: environment.records.register(env_id)
+    neuron_factory.step(args.iterations)
+
+    spikes = environment.spikes
+    start, stop = (args.iterations / 2, args.iterations / 2 + window)
+    raster = []
+    for env_id in env_ids:
+        times = [time for time,voltage in enumerate(environment.records.get(env_id))
+            if voltage >= spikes.threshold]
+        if len(times) == 0 or spikes.spike_times(env_id).tolist() != times \
+                or spikes.spike_count(env_id) != len(times):
+            raise AssertionError("Spike times do not match the voltages")
+        times = [time for time in times if start <= time < stop]
+        raster += [(time, env_id) for time in times]
+        rate = spikes.rates(start, stop)[spikes.columns[env_id]]
+        if rate != len(times) / float(window):
+            raise AssertionError("Rates do not match the spike times")
+
+    times, rows = spikes.raster(start, stop)
+    if sorted(zip(times.tolist(), spikes.env_ids[rows].tolist())) != sorted(raster):
+        raise AssertionError("Raster does not match the spike times")
+
 def main():
     #transmit(strength = -0.5)
     transmit(strength = 100, delays=[10])
+    spike_queries()
+    if args.checkpoint: resume()
+    if args.lookahead:
+        lookahead()
+        feedback()
+    if args.partition: partitions()
     #transmit(strength = 0.1, delays=[None])
 
 def set_options():
@@ -56,6 +240,14 @@ def set_options():
     """do not display graphs""")
     parser.add_argument("-i", "--iterations", type = int, default = 1000, help = 
     """table""")
+    parser.add_argument("-c", "--checkpoint", action = "store_true", help = 
+    """checkpoint halfway through, and compare the restored run with an
+    uninterrupted one""")
+    parser.add_argument("-l", "--lookahead", action = "store_true", help = 
+    """step with lookahead workers, and compare with a single threaded run""")
+    parser.add_argument("-p", "--partition", action = "store_true", help = 
+    """step with workers under each partition type, and compare with a
+    single threaded run""")
 
     return parser.parse_args()
 
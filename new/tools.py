@@ -1,4 +1,7 @@
 # Drivers can be added to activate particular neurons at each timestep.
+#     A driver returns the next time it needs to be driven, or None if it
+#     will not change the neuron again, so that the neuron factory only
+#     calls it when something happens.
 # 
 # Probes can be added to any component to take measurements of voltage, current,
 #     or concentration over the course of the simulation.
@@ -10,15 +13,16 @@ class ConstantDriver:
     def __init__(self, current=0.0, delay=0):
         self.current = current
         self.delay = delay
-        self.drive = self.predelay
+        self.done = False
 
-    def predelay(self, neuron, time):
+    def drive(self, neuron, time):
+        # The current is set once, after the delay.
+        # Drivers are plain data, so that they can be sent to workers.
+        if self.done: return
         if time-self.delay >= 0:
-            self.drive = self.postdelay
+            self.done = True
             neuron.set_external_current(self.current)
-
-    def postdelay(self, neuron, time):
-        pass
+        else: return self.delay
 
 class PulseDriver:
     def __init__(self, current=0.0, period=1000, length=500,
@@ -38,3 +42,16 @@ class PulseDriver:
         elif time % self.period == self.length:
             neuron.set_external_current(0.0)
             if self.record: self.data.append(-0.3)
+        return self.delay + self.next_change(time)
+
+    def next_change(self, time):
+        """
+        Returns the first time after |time| (relative to the delay) at which
+            the pulse turns on or off.
+        """
+        start = max(time+1, 0)
+        on = start + (-start % self.period)
+        if 0 <= self.length < self.period:
+            off = time + 1 + ((self.length - time - 1) % self.period)
+            return min(on, off)
+        return on